@@ -4,6 +4,7 @@ import asyncio
 import tomllib
 import traceback
 
+import asyncpg
 import click
 
 from .app import Application
@@ -31,8 +32,9 @@ def db():
 async def _drop():
     config = load_config()
 
+    # a bare connection, Database.connect would refuse a database with pending migrations
     try:
-        db = await Database.connect(config['database'])
+        connection = await asyncpg.connect(config['database']['uri'])
     except Exception:
         click.echo(
             f'Could not connect to the database.\n{traceback.format_exc()}',
@@ -40,26 +42,64 @@ async def _drop():
         )
         return
 
-    click.confirm(
-        'Are you sure you want to drop all tables in the database? This action cannot be undone.',
-        abort=True,
-    )
+    try:
+        click.confirm(
+            'Are you sure you want to drop all tables in the database? This action cannot be undone.',
+            abort=True,
+        )
+
+        try:
+            await connection.execute(DROP_TABLES)
+        except Exception:
+            click.echo(
+                f'Could not drop the database.\n{traceback.format_exc()}',
+                err=True,
+            )
+            return
+    finally:
+        await connection.close()
+
+    click.echo('Dropped all tables in the database.')
+
+
+@db.command()
+def drop():
+    asyncio.run(_drop())
+
+
+async def _migrate():
+    config = load_config()
 
     try:
-        await db.pool.execute(DROP_TABLES)
+        connection = await asyncpg.connect(config['database']['uri'])
     except Exception:
         click.echo(
-            f'Could not drop the database.\n{traceback.format_exc()}',
+            f'Could not connect to the database.\n{traceback.format_exc()}',
             err=True,
         )
         return
 
-    click.echo('Dropped all tables in the database.')
+    try:
+        applied = await Database.migrate(connection)
+    except Exception:
+        click.echo(
+            f'Could not migrate the database.\n{traceback.format_exc()}',
+            err=True,
+        )
+        return
+    finally:
+        await connection.close()
+
+    if not applied:
+        click.echo('The database is already up to date.')
+
+    for migration in applied:
+        click.echo(f'Applied migration {migration.version:04}_{migration.name}.')
 
 
 @db.command()
-def drop():
-    asyncio.run(_drop())
+def migrate():
+    asyncio.run(_migrate())
 
 
 cli()
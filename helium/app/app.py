@@ -4,19 +4,39 @@ import asyncio
 import importlib
 import logging
 import os.path
-from collections import defaultdict
-from typing import Any, MutableMapping, Protocol, Union, runtime_checkable
+import signal
+import sys
+import time
+from typing import Any, Callable, MutableMapping, Protocol, Union, runtime_checkable
 
-import tornado.web
+import asyncpg
+import tornado.httpserver
 import tornado.log
+import tornado.netutil
+import tornado.process
+import tornado.web
 from rich.logging import RichHandler
 from tornado.platform.asyncio import BaseAsyncIOLoop
 from tornado.routing import _RuleList
 
 from . import __version__
-from .modules.websocket import WebSocketHandler
+from .modules.websocket import DispatchEvent, Session, WebSocketHandler
+from .utils.cache import (
+    LinkCache,
+    MembershipIndex,
+    Relationship,
+    RelationshipStore,
+    User,
+    UserCache,
+)
+from .utils.cache_maintainer import CacheMaintainer
 from .utils.database import Database
+from .utils.event_bus import BusEvent, EventBus, LocalEventBus, PostgresEventBus
+from .utils.message_writer import MessageWriter
+from .utils.password_hasher import PasswordHasher
+from .utils.snowflake import SnowflakeGenerator
 from .utils.errors import NotFound as NotFoundError
+from .utils.timer_wheel import TimerWheel
 from .utils.token import Tokens
 
 logger: logging.Logger = logging.getLogger()
@@ -34,6 +54,7 @@ MODULES_TO_LOAD: list[str] = [
     'api.rooms.rooms',
     'api.users.me',
     'api.websocket',
+    'api.stats',
     'api.index',
 ]
 
@@ -61,11 +82,18 @@ class NotFound(tornado.web.RequestHandler):
 
 
 class Application(tornado.web.Application):
-    def __init__(self, config: MutableMapping[str, Any], database: Database):
+    WARMUP_REPORT_INTERVAL = 5  # seconds between cache warmup progress logs
+    MAX_CLOCK_SKEW = 60  # seconds the newest id may be ahead of this machine's clock
+    REVOCATION_SWEEP_INTERVAL = 3600  # seconds between deleting revocations of expired tokens
+
+    def __init__(
+        self, config: MutableMapping[str, Any], database: Database, *, process_id: int = 0
+    ):
         self.database = database
         self.config = config
+        self.process_id = process_id
 
-        self.tokens = Tokens(**config['tokens'])
+        self.tokens = Tokens(**config['tokens'], process_id=process_id)
 
         self.client_url: str = config['client']['url']
         self.version = __version__
@@ -93,40 +121,170 @@ class Application(tornado.web.Application):
             else:
                 routes.append(routes_to_add)
 
-        # user_id: connection
-        self.websocket_connections: defaultdict[str, list[WebSocketHandler]] = defaultdict(list)
-        # room_id: info
-        self.room_cache: defaultdict[str, list[str]] = defaultdict(list)
-        # user_id: info
-        self.user_cache: dict[str, dict[str, Any]] = {}
-        self.room_member_cache: dict[str, dict[str, Any]] = {}
-        # user_id: list[tuple[type, user_id]]
-        self.relationship_cache: defaultdict[str, list[tuple[int, str]]] = defaultdict(list)
+        # session_id: session
+        self.sessions: dict[str, Session] = {}
+        # user_id: sessions, including ones waiting to be resumed
+        self.user_sessions: dict[str, set[Session]] = {}
+        self.room_cache = MembershipIndex()
+        self.relationship_cache = RelationshipStore()
+        self.relationships_ready = asyncio.Event()
+        self.relationship_task: asyncio.Task
+
+        # a single sweeper closes every connection that stops sending heartbeats
+        self.heartbeats: TimerWheel[WebSocketHandler] = TimerWheel(self.expire_connections)
+
+        gateway_config: dict[str, Any] = config.get('gateway', {})
+        self.max_queued_events: int = gateway_config.get('max_queued_events', 1000)
+        self.resume_timeout: float = gateway_config.get('resume_timeout', 60)
+        self.resume_buffer_size: int = gateway_config.get('resume_buffer_size', 500)
+
+        # a resumed connection's replay goes through its queue, so a bigger buffer would
+        # close it as a slow consumer before anything was sent
+        if self.resume_buffer_size > self.max_queued_events:
+            logging.warning(
+                f'resume_buffer_size ({self.resume_buffer_size}) is larger than '
+                f'max_queued_events ({self.max_queued_events}), using {self.max_queued_events}.'
+            )
+            self.resume_buffer_size = self.max_queued_events
+        self.gateway_stats: dict[str, int] = {
+            'slow_consumer_disconnects': 0,
+            'dropped_events': 0,
+            'queue_high_water': 0,  # the most events ever queued for one connection
+        }
+
+        events_config: dict[str, Any] = config.get('events', {})
+        self.event_bus: EventBus
+
+        if events_config.get('backend', 'local') == 'postgres':
+            self.event_bus = PostgresEventBus(
+                self.deliver_event,
+                database,
+                channel=events_config.get('channel', 'helium_events'),
+                payload_ttl=events_config.get('payload_ttl', 60),
+            )
+        else:
+            self.event_bus = LocalEventBus(
+                self.deliver_event, channel=events_config.get('channel', 'helium_events')
+            )
+
+        cache_config: dict[str, Any] = config.get('cache', {})
+        self.warmup_batch_size: int = cache_config.get('warmup_batch_size', 5000)
+        self.user_cache = UserCache(
+            database,
+            max_size=cache_config.get('max_users', 0),
+            ttl=cache_config.get('user_ttl', 0),
+        )
+        self.cache_maintainer = CacheMaintainer(self)
+
+        links_config: dict[str, Any] = config.get('links', {})
+        self.link_cache = LinkCache(
+            database,
+            max_size=links_config.get('cache_size', 1000),
+            ttl=links_config.get('cache_ttl', 30),
+        )
+        self.link_sweep_interval: float = links_config.get('sweep_interval', 60)
+        self.link_sweep_batch_size: int = links_config.get('sweep_batch_size', 1000)
+        self.links_swept: int = 0
+        self.link_sweeper_task: asyncio.Task
+        self.revocation_sweeper_task: asyncio.Task | None = None
+
+        messages_config: dict[str, Any] = config.get('messages', {})
+        self.message_writer = MessageWriter(
+            database,
+            max_batch_size=messages_config.get('batch_size', 100),
+            max_delay=messages_config.get('batch_delay', 0.005),
+        )
 
         super().__init__(routes, default_host=config['server']['host'], **settings)
 
+    @staticmethod
+    def get_workers(server_config: dict[str, Any]) -> int:
+        """Gets how many worker processes to start.
+
+        Each worker is given its index as its process id, so there can't be more workers
+        than process ids.
+        """
+
+        workers: int = server_config.get('workers', 1) or tornado.process.cpu_count()
+
+        if workers > 1 and server_config.get('autoreload'):
+            logging.warning('Autoreload only works with a single worker, starting one.')
+            workers = 1
+
+        if workers > SnowflakeGenerator.MAX_PROCESS_ID + 1:
+            # every worker needs its own process id to create ids that don't collide
+            raise ValueError(f'At most {SnowflakeGenerator.MAX_PROCESS_ID + 1} workers can run.')
+
+        return workers
+
     @classmethod
     def run(cls, config: MutableMapping[str, Any]):
-        """Starts the server."""
+        """Starts the server.
+
+        With more than one worker, the server pre-forks that many processes. Each worker
+        binds the port with SO_REUSEPORT so the kernel spreads connections between them,
+        and gets its share of the database pool. The parent process only supervises,
+        restarting any worker that crashes.
+        """
 
         logger.setLevel(logging.INFO)
 
+        server_config = config['server']
+        workers = cls.get_workers(server_config)
+        process_id = 0
+
+        if workers > 1:
+            if config.get('events', {}).get('backend', 'local') != 'postgres':
+                logging.warning(
+                    'Running several workers without the postgres event bus, '
+                    'events will only reach users connected to the same worker.'
+                )
+
+            logging.info(f'Starting {workers} workers...')
+            # only returns in the workers, the parent stays here restarting them
+            process_id = tornado.process.fork_processes(workers)
+
+        # the event loop has to be created after forking
         BaseAsyncIOLoop.current().make_current()
         loop = asyncio.get_event_loop()
 
         logging.info('Connecting to database...')
-        database = loop.run_until_complete(Database.connect(config['database']))
-        self = cls(config, database)
+        hashing_config: dict[str, Any] = config.get('hashing', {})
+        hasher = PasswordHasher(
+            # the hashing threads of every worker share the machine's cores
+            threads=hashing_config.get('threads', max(1, tornado.process.cpu_count() // workers)),
+            max_queue=hashing_config.get('max_queue', 100),
+            **hashing_config.get('parameters', {}),
+        )
+        database = loop.run_until_complete(
+            Database.connect(config['database'], workers=workers, hasher=hasher)
+        )
+        self = cls(config, database, process_id=process_id)
 
         loop.run_until_complete(self.prepare())
 
-        self.listen(config['server']['port'], config['server']['host'])
+        sockets = tornado.netutil.bind_sockets(
+            server_config['port'], server_config['host'], reuse_port=workers > 1
+        )
+        server = tornado.httpserver.HTTPServer(self)
+        server.add_sockets(sockets)
+
         logging.info(
-            f'Listening at http://{config["server"]["host"] or "localhost"}:{config["server"]["port"]}'
+            f'Listening at http://{server_config["host"] or "localhost"}:{server_config["port"]}'
         )
         logging.info('Ready to go.')
+
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, loop.stop)
+
+        # returns once a signal stops the loop
         BaseAsyncIOLoop.current().start()
 
+        logging.info('Shutting down...')
+        server.stop()
+        loop.run_until_complete(self.close())
+        loop.run_until_complete(database.close())
+
     def get_link_url(self, id: str):
         """Gets the full URL for a short link."""
 
@@ -136,64 +294,272 @@ class Application(tornado.web.Application):
         base_url = self.config['links']['base_url'] or default
         return base_url + id
 
-    def dispatch(self, event: str, data: dict[str, Any], *, room_id: str):
+    async def get_last_message(self, record: Any) -> dict[str, Any] | None:
+        """Builds a room's last message from a record joined with room_last_messages."""
+
+        if not record['message_id']:
+            return None
+
+        return {
+            'id': record['message_id'],
+            'content': record['message_content'],
+            'room_id': record['id'],
+            'author': await self.user_cache.fetch(record['message_author_id']),
+        }
+
+    def expire_connections(self, websockets: list[WebSocketHandler]):
+        """Closes websocket connections that have stopped sending heartbeats."""
+
+        logging.info(f'Closing {len(websockets)} websocket connections that missed heartbeats.')
+
+        for websocket in websockets:
+            websocket.close()
+
+    def get_stats(self) -> dict[str, Any]:
+        """Gets runtime statistics about the server's caches and gateway."""
+
+        queues = [
+            session.connection.event_queue
+            for session in self.sessions.values()
+            if session.connection is not None
+        ]
+
+        return {
+            'user_cache': self.user_cache.stats(),
+            'cache_changes': self.cache_maintainer.stats(),
+            'message_writer': self.message_writer.stats(),
+            'pool': self.database.get_pool_stats(),
+            'queries': self.database.get_query_stats(),
+            'hashing': self.database.hasher.stats(),
+            'tokens': self.tokens.stats(),
+            'links': {**self.link_cache.stats(), 'swept': self.links_swept},
+            'gateway': {
+                **self.gateway_stats,
+                'sessions': len(self.sessions),
+                'connections': len(queues),
+                'queued_events': sum(map(len, queues)),
+                'queue_high_water': max(
+                    [self.gateway_stats['queue_high_water'], *(q.high_water for q in queues)]
+                ),
+            },
+        }
+
+    def dispatch(
+        self, event: str, data: dict[str, Any], *, room_id: str, ephemeral: bool = False
+    ):
         """Dispatches an event to all connected users in a room."""
 
-        for user_id in self.room_cache[room_id]:
-            self.send_event(user_id, event, data)
+        self.publish_event(BusEvent(event, data, room_id=room_id, ephemeral=ephemeral))
 
-    def send_event(self, user_id: str, event: str, data: dict[str, Any]):
+    def send_event(
+        self, user_id: str, event: str, data: dict[str, Any], *, ephemeral: bool = False
+    ):
         """Sends an event to a user if they are connected."""
 
-        try:
-            connections = self.websocket_connections[user_id]
-        except KeyError:
+        self.publish_event(BusEvent(event, data, user_id=user_id, ephemeral=ephemeral))
+
+    def publish_event(self, event: BusEvent):
+        """Delivers an event to this process's sessions and publishes it to the others."""
+
+        self.deliver_event(event)
+        self.event_bus.publish(event)
+
+    def deliver_event(self, event: BusEvent):
+        """Delivers an event to the affected users that have a session in this process."""
+
+        if event.room_id is not None:
+            members = self.room_cache.members(event.room_id)
+
+            # only users with a session here matter, so walk whichever side is smaller
+            if len(self.user_sessions) < len(members):
+                user_ids = [user_id for user_id in self.user_sessions if user_id in members]
+            else:
+                user_ids = [user_id for user_id in members if user_id in self.user_sessions]
+        elif event.user_id in self.user_sessions:
+            user_ids = [event.user_id]
+        else:
+            return
+
+        if not user_ids:
+            return
+
+        # serialized once here and shared by every connection
+        dispatch_event = DispatchEvent(event.name, event.data, ephemeral=event.ephemeral)
+
+        for user_id in user_ids:
+            self.send_dispatch_event(user_id, dispatch_event)
+
+    def send_dispatch_event(self, user_id: str, event: DispatchEvent):
+        """Sends an already serialized event to a user if they have a session."""
+
+        sessions = self.user_sessions.get(user_id)
+
+        if not sessions:
             return  # user is not connected
 
-        logging.info(f'Sending event {event} to user id {user_id}.')
+        logging.debug(f'Sending event {event.name} to user id {user_id}.')
 
-        for websocket in connections:
-            websocket.event_queue.put_nowait((event, data))
+        for session in tuple(sessions):
+            session.send(event)
 
-    async def fill_cache(self):
-        """Fills the user, room, and room member cache."""
+    def create_session(self, user_id: str) -> Session:
+        session = Session(user_id, buffer_size=self.resume_buffer_size)
+
+        self.sessions[session.id] = session
+        self.user_sessions.setdefault(user_id, set()).add(session)
+
+        return session
+
+    def detach_session(self, session: Session):
+        """Keeps a session that lost its connection around until it is resumed or expires."""
+
+        loop = asyncio.get_running_loop()
+        session.expire_handle = loop.call_later(self.resume_timeout, self.expire_session, session)
+
+    def expire_session(self, session: Session):
+        if session.expire_handle is not None:
+            session.expire_handle.cancel()
+            session.expire_handle = None
+
+        self.sessions.pop(session.id, None)
 
-        query = """SELECT id, username, name, room_id, room_members.permission_level
-                   FROM room_members
-                   INNER JOIN users ON room_members.user_id = users.id;
-                """
+        sessions = self.user_sessions.get(session.user_id)
 
-        async with self.database.acquire() as conn:
-            records = await conn.fetch(query)
-            users = await conn.fetch('SELECT id, username, name FROM users;')
-            relationships = await conn.fetch('SELECT type, user_id, recipient_id FROM relationships;')
+        if sessions is not None:
+            sessions.discard(session)
+
+            if not sessions:
+                del self.user_sessions[session.user_id]
+
+    async def warm_cache(
+        self, name: str, statement: str, callback: Callable[[list[asyncpg.Record]], None]
+    ):
+        """Streams the results of a statement into a cache in batches, logging progress."""
+
+        started_at = last_report = time.perf_counter()
+        count = 0
+
+        async for records in self.database.stream(statement, batch_size=self.warmup_batch_size):
+            callback(records)
+            count += len(records)
+
+            now = time.perf_counter()
+            if now - last_report >= self.WARMUP_REPORT_INTERVAL:
+                logging.info(f'Loaded {count} {name} so far...')
+                last_report = now
+
+        logging.info(f'Loaded {count} {name} in {time.perf_counter() - started_at:.2f}s.')
+
+    def cache_users(self, records: list[asyncpg.Record], user_cache: UserCache | None = None):
+        if user_cache is None:
+            user_cache = self.user_cache
 
         for record in records:
-            # TODO: fix all of this
-            user = {'id': record['id'], 'username': record['username'], 'name': record['name']}
+            user_cache.add(User.from_record(record))
+
+    def cache_room_members(
+        self, records: list[asyncpg.Record], room_cache: MembershipIndex | None = None
+    ):
+        if room_cache is None:
+            room_cache = self.room_cache
 
-            member = {
-                'id': record['id'],
-                'user': user,
-                'room_id': record['room_id'],
-                'permission_level': record['permission_level'],
-            }
+        for record in records:
+            room_cache.add(
+                sys.intern(record['room_id']),
+                sys.intern(record['user_id']),
+                record['permission_level'],
+            )
+
+    def cache_relationships(
+        self, records: list[asyncpg.Record], relationship_cache: RelationshipStore | None = None
+    ):
+        if relationship_cache is None:
+            relationship_cache = self.relationship_cache
 
-            self.user_cache[record['id']] = user
-            self.room_member_cache[record['id']] = member
-            self.room_cache[record['room_id']].append(record['id'])
+        for record in records:
+            relationship_cache.add(
+                record['type'], sys.intern(record['user_id']), sys.intern(record['recipient_id'])
+            )
 
-        for record in users:
-            if self.user_cache.get(record['id']):
-                return
+    async def fill_cache(self):
+        """Fills the user and room membership caches and the revoked token set."""
 
-            user = {'id': record['id'], 'username': record['username'], 'name': record['name']}
+        with self.cache_maintainer.hold('users', 'room_members', 'revoked_tokens'):
+            if self.user_cache.bounded:
+                # a bounded cache is filled on demand by the users that are actually active
+                logging.info('User cache is bounded, skipping user warmup.')
+            else:
+                await self.warm_cache('users', 'get_all_users', self.cache_users)
 
-            self.user_cache[record['id']] = user
+            await self.warm_cache('room members', 'get_all_room_members', self.cache_room_members)
+            await self.warm_cache(
+                'revoked tokens',
+                'get_all_revoked_tokens',
+                lambda records: self.tokens.revoked.update(record[0] for record in records),
+            )
 
-        for relationship in relationships:
-            user = self.relationship_cache[relationship['user_id']]
-            user.append((relationship['type'], relationship['recipient_id']))
+    async def fill_relationship_cache(self):
+        """Fills the relationship cache.
+
+        This runs in the background after the server starts accepting requests.
+        Relationship handlers wait on `relationships_ready` until it is done.
+        """
+
+        with self.cache_maintainer.hold('relationships'):
+            while True:
+                try:
+                    await self.warm_cache(
+                        'relationships', 'get_all_relationships', self.cache_relationships
+                    )
+                except Exception:
+                    logging.exception('Failed to load relationships, retrying in 5 seconds.')
+                    self.relationship_cache.clear()
+                    await asyncio.sleep(5)
+                else:
+                    break
+
+        self.relationships_ready.set()
+
+    async def reload_caches(self):
+        """Reloads every cache from the database.
+
+        Each cache is loaded on the side and swapped in once it is complete, so lookups
+        never see a partly loaded cache and rows deleted while changes were missed are
+        dropped.
+        """
+
+        if self.user_cache.bounded:
+            self.user_cache.clear()
+        else:
+            user_cache = UserCache(self.database, ttl=self.user_cache.ttl)
+            await self.warm_cache(
+                'users', 'get_all_users', lambda records: self.cache_users(records, user_cache)
+            )
+            self.user_cache.replace(user_cache)
+
+        room_cache = MembershipIndex()
+        await self.warm_cache(
+            'room members',
+            'get_all_room_members',
+            lambda records: self.cache_room_members(records, room_cache),
+        )
+        self.room_cache.replace(room_cache)
+
+        relationship_cache = RelationshipStore()
+        await self.warm_cache(
+            'relationships',
+            'get_all_relationships',
+            lambda records: self.cache_relationships(records, relationship_cache),
+        )
+        self.relationship_cache.replace(relationship_cache)
+
+        revoked: set[str] = set()
+        await self.warm_cache(
+            'revoked tokens',
+            'get_all_revoked_tokens',
+            lambda records: revoked.update(record[0] for record in records),
+        )
+        self.tokens.revoked = revoked
 
     async def prepare(self):
         """Prepares the server to start.
@@ -201,12 +567,93 @@ class Application(tornado.web.Application):
         Runs any tasks that need to be run before the server is started.
         """
 
+        await self.check_id_order()
+
+        # listening starts first so no change made during the warmup is missed
+        await self.cache_maintainer.start()
+
+        started_at = time.perf_counter()
         await self.fill_cache()
+        logging.info(f'Filled caches in {time.perf_counter() - started_at:.2f}s.')
+
+        self.relationship_task = asyncio.create_task(self.fill_relationship_cache())
+        self.link_sweeper_task = asyncio.create_task(self.sweep_links())
+
+        if self.tokens.revocation_ttl is not None:
+            self.revocation_sweeper_task = asyncio.create_task(self.sweep_revocations())
+
+        self.heartbeats.start()
+        await self.event_bus.start()
+
+    async def check_id_order(self):
+        """Makes sure new ids sort after existing ones, which paging messages relies on."""
+
+        last_message_id = await self.database.fetchval('get_last_message_id')
+
+        if last_message_id is None:
+            return
+
+        snowflakes = self.tokens.snowflakes
+        ahead = SnowflakeGenerator.timestamp_of(last_message_id) - snowflakes.current_timestamp()
+
+        if ahead > self.MAX_CLOCK_SKEW * 1000:
+            raise ValueError(
+                f'The newest message id is {ahead / 1000:.0f}s ahead of new ids. '
+                'The tokens epoch has to stay the one existing ids were created with.'
+            )
+
+    async def close(self):
+        """Stops everything started by prepare."""
+
+        await self.message_writer.close()
+        await self.event_bus.close()
+        self.heartbeats.stop()
+        self.link_sweeper_task.cancel()
+        self.relationship_task.cancel()
+
+        if self.revocation_sweeper_task is not None:
+            self.revocation_sweeper_task.cancel()
+
+        await self.cache_maintainer.close()
+
+    async def sweep_links(self):
+        """Deletes expired and used up links in the background, a batch at a time."""
+
+        while True:
+            await asyncio.sleep(self.link_sweep_interval)
+
+            try:
+                while True:
+                    records = await self.database.fetch(
+                        'delete_unusable_links', self.link_sweep_batch_size
+                    )
+
+                    for record in records:
+                        self.link_cache.pop(record['id'])
+
+                    self.links_swept += len(records)
+
+                    if len(records) < self.link_sweep_batch_size:
+                        break
+            except Exception:
+                logging.exception('Failed to sweep unusable links.')
+
+    async def sweep_revocations(self):
+        """Deletes revocations of tokens that have expired since, in the background.
+
+        Every process forgets a deleted revocation through CDC, which keeps the revoked
+        token set from growing forever.
+        """
+
+        while True:
+            await asyncio.sleep(self.REVOCATION_SWEEP_INTERVAL)
 
-    def get_relationship(self, user_id: str, recipient_id: str) -> dict[str, Any] | None:
-        for uid, relationships in self.relationship_cache.items():
-            for type, rid in relationships:
-                if user_id == uid and recipient_id == rid:
-                    return {'type': type, 'user_id': uid, 'recipient_id': rid}
+            try:
+                await self.database.execute(
+                    'delete_expired_revocations', self.tokens.revocation_ttl
+                )
+            except Exception:
+                logging.exception('Failed to sweep expired revocations.')
 
-        return None
+    def get_relationship(self, user_id: str, recipient_id: str) -> Relationship | None:
+        return self.relationship_cache.get(user_id, recipient_id)
@@ -41,23 +41,12 @@ class Accounts(RequestHandler, require_token=False):
         except DatabaseError:
             raise JsonError(400, 'Username is taken')
 
-        user = {
-            'id': record['id'],
-            'username': body.get('username'),
-            'name': body['name'],
-        }
-
-        self.application.user_cache[record['id']] = user
-
         token = self.tokens.create_token(record['id'])
         self.finish({'token': token})
 
     @with_body(GetBody)
     async def get(self):
-        query = 'SELECT 1 FROM accounts WHERE email=$1;'
-
-        async with self.database.acquire() as conn:
-            exists = await conn.fetchval(query, self.get_argument('email'))
+        exists = await self.database.fetchval('email_exists', self.get_argument('email'))
 
         if not exists:
             raise JsonError(404, 'An account with that email does not exist')
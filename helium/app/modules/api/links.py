@@ -2,7 +2,6 @@ from __future__ import annotations
 
 from typing import TYPE_CHECKING
 
-from app.utils.database import DatabaseError
 from app.utils.errors import NotFound
 from app.utils.handler import RequestHandler
 
@@ -15,39 +14,30 @@ class LinkType:
     USER: int = 1
 
 
-class Links(RequestHandler):
+class Links(RequestHandler, path_ids=False):
     async def join_room(self, link):
-        update_link = """UPDATE links
-                        SET uses = uses + 1
-                        WHERE id=$1;
-                      """
-
-        insert_member = """INSERT INTO room_members (user_id, room_id, permission_level)
-                           VALUES ($1, $2, $3);
-                        """
+        link_cache = self.application.link_cache
 
         async with self.database.acquire() as conn:
-            await conn.execute(update_link, link['id'])
-            await conn.execute(insert_member, self.user_id, link['entity_id'], 0)
+            async with conn.transaction():
+                # the cached link may be out of date, the database decides if it can be used
+                used = await self.database.fetchrow('use_link', link['id'], conn=conn)
 
-        record = await self.database.get_room(link['entity_id'], with_last_message=True)
+                if used is None:
+                    link_cache.pop(link['id'])
+                    raise NotFound
 
-        if record['message_id']:
-            message_author = {
-                'id': record['message_author_id'],
-                'name': record['message_author_name'],
-                'username': record['message_author_username'],
-            }
+                await self.database.execute(
+                    'add_room_member', self.user_id, link['entity_id'], 0, conn=conn
+                )
 
-            last_message = {
-                'id': record['message_id'],
-                'content': record['message_content'],
-                'room_id': record['message_room_id'],
-                'author': message_author,
-            }
+                if used['max_uses'] and used['uses'] >= used['max_uses']:
+                    await self.database.execute('delete_link', link['id'], conn=conn)
 
-        else:
-            last_message = None
+        link_cache.record_use(link['id'], used['uses'])
+        await self.application.cache_maintainer.sync()
+
+        record = await self.database.get_room(link['entity_id'], with_last_message=True)
 
         room = {
             'id': record['id'],
@@ -56,18 +46,16 @@ class Links(RequestHandler):
             'owner_id': record['owner_id'],
             'type': record['type'],
             'me': {'permission_level': 0},
-            'last_message': last_message,
+            'last_message': await self.application.get_last_message(record),
         }
         self.application.send_event(self.user_id, 'ROOM_JOIN', room)
 
-        self.application.room_cache[link['entity_id']].append(self.user_id)
-
         self.finish(room)
 
     async def post(self, link_id: str):
-        try:
-            link = await self.database.get_link(link_id)
-        except DatabaseError:
+        link = await self.application.link_cache.fetch(link_id)
+
+        if link is None:
             raise NotFound
 
         if link['type'] == 0:
@@ -77,15 +65,19 @@ class Links(RequestHandler):
             self.send_error(500)
 
     async def get(self, link_id: str):
-        try:
-            link_record = await self.database.get_link(link_id)
-        except DatabaseError:
+        link_record = await self.application.link_cache.fetch(
+            link_id, readonly=True, user_id=self.user_id
+        )
+
+        if link_record is None:
             raise NotFound
 
         entity = None
 
         if link_record['type'] == 0:
-            room_record = await self.database.get_room(link_record['entity_id'])
+            room_record = await self.database.get_room(
+                link_record['entity_id'], readonly=True, user_id=self.user_id
+            )
             entity = {
                 'id': room_record['id'],
                 'name': room_record['name'],
@@ -29,5 +29,16 @@ class Login(RequestHandler, require_token=False):
         self.finish({'token': token})
 
 
+class Logout(RequestHandler):
+    async def post(self):
+        # every process, this one included, hears about the revocation through CDC
+        token_hash = self.tokens.hash_token(self.token)
+        await self.database.execute('revoke_token', token_hash, self.user_id)
+        await self.application.cache_maintainer.sync()
+
+        self.set_status(204)
+        self.finish()
+
+
 def setup(app: Application):
-    return [(f'/login', Login)]
+    return [(f'/login', Login), (f'/logout', Logout)]
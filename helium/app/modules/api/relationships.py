@@ -1,10 +1,11 @@
 from __future__ import annotations
 
-from typing import TYPE_CHECKING, Literal, TypedDict, Union
+from typing import TYPE_CHECKING, Literal, TypedDict
 
 from app.utils.decorators import with_body
-from app.utils.errors import JsonError
+from app.utils.errors import BadRequest, JsonError
 from app.utils.handler import RequestHandler
+from app.utils.validate import is_id
 
 if TYPE_CHECKING:
     from app.app import Application
@@ -20,16 +21,24 @@ class PostBody(TypedDict):
     recipient_id: str
 
 
-async def delete_relationship(handler: Union[Relationships, RelationshipsID], recipient_id: str):
+class RelationshipHandler(RequestHandler):
+    async def prepare(self):
+        await super().prepare()
+
+        # the relationship cache is filled in the background at startup
+        await self.application.relationships_ready.wait()
+
+
+async def delete_relationship(handler: RelationshipHandler, recipient_id: str):
     # this is a separate function because it is used in both handlers
 
-    query = """DELETE FROM relationships
-               WHERE user_id=$1 AND recipient_id=$2
-               RETURNING type;
-                """
+    database = handler.database
+    other_relationship_type = None
 
-    async with handler.database.acquire() as conn:
-        relationship_type = await conn.fetchval(query, handler.user_id, recipient_id)
+    async with database.acquire() as conn:
+        relationship_type = await database.fetchval(
+            'delete_relationship', handler.user_id, recipient_id, conn=conn
+        )
 
         if relationship_type in (None, RelationshipType.FRIEND):
             # relationship was either a friend removal where both relationships exist,
@@ -37,7 +46,9 @@ async def delete_relationship(handler: Union[Relationships, RelationshipsID], re
             # or friend request cancellation where only the user-recipient relationship exists.
 
             # remove the other relationship (may not exist)
-            other_relationship_type = await conn.fetchval(query, recipient_id, handler.user_id)
+            other_relationship_type = await database.fetchval(
+                'delete_relationship', recipient_id, handler.user_id, conn=conn
+            )
 
             # TODO: throw error on no relationship
             # if other_relationship_type is not RelationshipType.block and not any((relationship_type, other_relationship_type)):
@@ -50,22 +61,14 @@ async def delete_relationship(handler: Union[Relationships, RelationshipsID], re
             data = {'user_id': recipient_id}
             handler.application.send_event(handler.user_id, 'RELATIONSHIP_REMOVE', data)
 
-    # deal with the cache
-    cache = handler.application.relationship_cache
-
-    if relationship_type is not None:
-        cache[handler.user_id].remove((relationship_type, handler.user_id))
+    # the relationship cache is updated through CDC
+    await handler.application.cache_maintainer.sync()
 
-    if relationship_type in (None, RelationshipType.FRIEND) and handler.application.get_relationship(recipient_id, handler.user_id):
-        cache[recipient_id].remove((RelationshipType.FRIEND, handler.user_id))
 
-
-class Relationships(RequestHandler):
+class Relationships(RelationshipHandler):
     async def insert_relationship(self, type: int, recipient_id: str):
-        sql = "INSERT INTO relationships (type, user_id, recipient_id) VALUES ($1, $2, $3);"
-
-        async with self.database.acquire() as conn:
-                await conn.execute(sql, type, self.user_id, recipient_id)
+        await self.database.execute('create_relationship', type, self.user_id, recipient_id)
+        await self.application.cache_maintainer.sync()
 
     async def friend(self):
         recipient_id = self.body['recipient_id']
@@ -82,27 +85,25 @@ class Relationships(RequestHandler):
             # TODO: confirm they share a room
 
             await self.insert_relationship(RelationshipType.FRIEND, recipient_id)
-            self.application.relationship_cache[self.user_id].append((RelationshipType.FRIEND, recipient_id))
 
-            user = self.application.user_cache[self.user_id]
+            user = await self.application.user_cache.fetch(self.user_id)
             data = {'user': user}
             self.application.send_event(recipient_id, 'RELATIONSHIP_CREATE', data)
 
             self.finish({'user_id': recipient_id})
         else:
             # at this point, the user is either blocked or is accepting a friend request from the recipient
-            if relationship['type'] is RelationshipType.BLOCK:
+            if relationship.type is RelationshipType.BLOCK:
                 raise JsonError(400, 'Friend request failed')
             else:
                 # accept the friend request
                 await self.insert_relationship(RelationshipType.FRIEND, recipient_id)
-                self.application.relationship_cache[self.user_id].append((RelationshipType.FRIEND, recipient_id))
 
-                user = self.application.user_cache[self.user_id]
+                user = await self.application.user_cache.fetch(self.user_id)
                 data = {'user': user}
                 self.application.send_event(recipient_id, 'RELATIONSHIP_CREATE', data)
 
-                recipient = self.application.user_cache[recipient_id]
+                recipient = await self.application.user_cache.fetch(recipient_id)
                 data = {'user': recipient}
                 self.application.send_event(self.user_id, 'RELATIONSHIP_CREATE', data)
 
@@ -113,25 +114,27 @@ class Relationships(RequestHandler):
 
         outgoing = self.application.get_relationship(self.user_id, recipient_id)
         if outgoing:
-            if outgoing['type'] is RelationshipType.BLOCK:
+            if outgoing.type is RelationshipType.BLOCK:
                 raise JsonError(400, message='User is already blocked')
             else:
                 await delete_relationship(self, recipient_id)  # remove friendship
 
         await self.insert_relationship(RelationshipType.BLOCK, recipient_id)
-        self.application.relationship_cache[self.user_id].append((RelationshipType.BLOCK, recipient_id))
 
         self.finish()
 
     @with_body(PostBody)
     async def post(self):
+        if not is_id(self.body['recipient_id']):
+            raise BadRequest(message='Invalid recipient_id')
+
         if self.body['type'] is RelationshipType.FRIEND:
             await self.friend()
         else:
             await self.block()
 
 
-class RelationshipsID(RequestHandler):
+class RelationshipsID(RelationshipHandler):
     async def get(self, recipient_id: str):
         # TODO
         pass
@@ -33,7 +33,7 @@ class Links(RequestHandler):
             # This is an easy solution I thought of, but it's probably not the best.
             for tries in range(20):
                 id = self.tokens.create_link_id()
-                already_exists = await conn.fetchval('SELECT 1 FROM links WHERE id=$1', id)
+                already_exists = await self.database.fetchval('link_exists', id, conn=conn)
 
                 if not already_exists:
                     break
@@ -56,13 +56,10 @@ class Links(RequestHandler):
                 'entity_id': room_id,
                 'user_id': self.user_id,
                 'expires_at': expires_at,
+                'max_uses': max_uses,
             }
 
-            query = """INSERT INTO links (id, type, entity_id, user_id, expires_at)
-                    VALUES ($1, $2, $3, $4, $5);
-                    """
-
-            await conn.execute(query, *link.values())
+            await self.database.execute('create_link', *link.values(), conn=conn)
 
         link['public'] = False
         link['uses'] = 0
@@ -4,7 +4,9 @@ from typing import TYPE_CHECKING, Optional, TypedDict
 
 from app.utils.decorators import with_body
 from app.utils.handler import RequestHandler
-from app.utils.errors import InvalidBody, NotFound
+from app.utils.errors import BadRequest, InvalidBody, NotFound
+from app.utils.message_writer import PendingMessage
+from app.utils.validate import is_id
 
 if TYPE_CHECKING:
     from app.app import Application
@@ -15,29 +17,102 @@ class PostBody(TypedDict):
 
 
 class Messages(RequestHandler):
+    DEFAULT_LIMIT = 50
+    MAX_LIMIT = 100
+
+    def get_snowflake_argument(self, name: str) -> str | None:
+        value = self.get_argument(name, None)
+
+        if value is not None and not is_id(value):
+            raise BadRequest(message=f'Invalid {name}')
+
+        return value
+
+    async def get(self, room_id: str):
+        # raise 404 if the room doesn't exist or the user isn't in it
+        if not self.application.room_cache.is_member(room_id, self.user_id):
+            raise NotFound(message='Room not found')
+
+        try:
+            limit = int(self.get_argument('limit', str(self.DEFAULT_LIMIT)))
+        except ValueError:
+            raise BadRequest(message='Invalid limit')
+
+        if not 1 <= limit <= self.MAX_LIMIT:
+            raise BadRequest(message='Invalid limit')
+
+        before = self.get_snowflake_argument('before')
+        after = self.get_snowflake_argument('after')
+        around = self.get_snowflake_argument('around')
+
+        if sum(arg is not None for arg in (before, after, around)) > 1:
+            raise BadRequest(message='Only one of before, after, or around can be provided')
+
+        # every page seeks the (room_id, id) index from a known id instead of using OFFSET,
+        # so loading old history costs the same as loading recent history.
+        # messages are always returned newest first.
+        # a replica is fine unless this user just sent a message they expect to see
+        async with self.database.acquire(readonly=True, user_id=self.user_id) as conn:
+            if before:
+                records = await self.database.fetch(
+                    'get_messages_before', room_id, before, limit, conn=conn
+                )
+            elif after:
+                records = await self.database.fetch(
+                    'get_messages_after', room_id, after, limit, conn=conn
+                )
+                records.reverse()
+            elif around:
+                # the message at `around` is included in the newer half
+                newer = await self.database.fetch(
+                    'get_messages_after', room_id, around, limit - limit // 2 - 1, conn=conn
+                )
+                older = await self.database.fetch(
+                    'get_messages_before', room_id, around, limit // 2, conn=conn
+                )
+                middle = await self.database.fetch('get_message', room_id, around, conn=conn)
+                newer.reverse()
+                records = newer + middle + older
+            else:
+                records = await self.database.fetch(
+                    'get_latest_messages', room_id, limit, conn=conn
+                )
+
+        authors = await self.application.user_cache.fetch_many(
+            record['author_id'] for record in records
+        )
+
+        messages = [
+            {
+                'id': record['id'],
+                'content': record['content'],
+                'room_id': room_id,
+                'author': authors.get(record['author_id']),
+                'type': record['type'],
+            }
+            for record in records
+        ]
+
+        self.finish(messages)
+
     @with_body(PostBody)
     async def post(self, room_id: str):
         if len(self.body['content']) > 4096:
             raise InvalidBody
 
-        if not self.application.room_cache.get(room_id):
-            raise NotFound(message='Room not found')
-
-        # raise 404 if user isn't in room
-        if self.user_id not in self.application.room_cache[room_id]:
+        # raise 404 if the room doesn't exist or the user isn't in it
+        if not self.application.room_cache.is_member(room_id, self.user_id):
             raise NotFound(message='Room not found')
 
         id = self.tokens.create_id()
         content: Optional[str] = self.body.get('content')
 
-        author = self.application.user_cache[self.user_id]
+        author = await self.application.user_cache.fetch(self.user_id)
         message_type = 0  # regular user message
 
-        query = """INSERT INTO messages (id, content, room_id, author_id, type)
-                   VALUES ($1, $2, $3, $4, $5);
-                """
-        async with self.database.acquire() as conn:
-            await conn.execute(query, id, content, room_id, self.user_id, message_type)
+        await self.application.message_writer.write(
+            PendingMessage(id, content, room_id, self.user_id, message_type)
+        )
 
         message = {
             'id': id,
@@ -53,25 +128,18 @@ class Messages(RequestHandler):
 
 class MessagesID(RequestHandler):
     async def get(self, room_id: str, message_id: str):
-        if not self.application.room_cache.get(room_id):
+        # raise 404 if the room doesn't exist or the user isn't in it
+        if not self.application.room_cache.is_member(room_id, self.user_id):
             raise NotFound(message='Room not found')
 
-        # raise 404 if user isn't in room
-        if self.user_id not in self.application.room_cache[room_id]:
-            raise NotFound(message='Room not found')
-
-        query = """SELECT content, author_id, type
-                   FROM messages
-                   WHERE room_id=$1 AND id=$2;
-                """
-
-        async with self.database.acquire() as conn:
-            record = await conn.fetchrow(query, room_id, message_id)
+        record = await self.database.fetchrow(
+            'get_message', room_id, message_id, readonly=True, user_id=self.user_id
+        )
 
         if not record:
             raise NotFound(message='Message not found')
 
-        author = self.application.user_cache[record['author_id']]
+        author = await self.application.user_cache.fetch(record['author_id'])
 
         message = {
             'id': message_id,
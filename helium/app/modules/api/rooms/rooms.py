@@ -27,16 +27,14 @@ class Rooms(RequestHandler):
 
         room_type = 0  # regular group room
 
-        insert_room = """INSERT INTO rooms (id, name, description, owner_id, type)
-                         VALUES ($1, $2, $3, $4, $5);
-                      """
-
-        insert_member = """INSERT INTO room_members (user_id, room_id, permission_level)
-                           VALUES ($1, $2, $3);
-                        """
         async with self.database.acquire() as conn:
-            await conn.execute(insert_room, id, name, description, self.user_id, room_type)
-            await conn.execute(insert_member, self.user_id, id, 0)
+            await self.database.execute(
+                'create_room', id, name, description, self.user_id, room_type, conn=conn
+            )
+            await self.database.execute('add_room_member', self.user_id, id, 0, conn=conn)
+
+        # the caches are updated through CDC, the creator's next request needs the room
+        await self.application.cache_maintainer.sync()
 
         room = {
             'id': id,
@@ -47,21 +45,16 @@ class Rooms(RequestHandler):
         }
         self.application.send_event(self.user_id, 'ROOM_JOIN', room)
 
-        self.application.room_cache[id].append(self.user_id)
-
         self.finish({'id': id})
 
 
 class RoomsID(RequestHandler):
     async def get(self, room_id: str):
-        if not self.application.room_cache.get(room_id):
-            raise NotFound
-
-        # raise 404 if user isn't in room
-        if self.user_id not in self.application.room_cache[room_id]:
+        # raise 404 if the room doesn't exist or the user isn't in it
+        if not self.application.room_cache.is_member(room_id, self.user_id):
             raise NotFound
 
-        record = await self.database.get_room(room_id)
+        record = await self.database.get_room(room_id, readonly=True, user_id=self.user_id)
 
         room = {
             'id': room_id,
@@ -0,0 +1,25 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+from app.utils.database import PermissionLevel
+from app.utils.errors import NotFound
+from app.utils.handler import RequestHandler
+
+if TYPE_CHECKING:
+    from app.app import Application
+
+
+class Stats(RequestHandler):
+    async def get(self):
+        permission_level = await self.database.fetchval('get_permission_level', self.user_id)
+
+        # only admins can see stats, so pretend this doesn't exist for everyone else
+        if permission_level != PermissionLevel.admin.value:
+            raise NotFound
+
+        self.finish(self.application.get_stats())
+
+
+def setup(app: Application):
+    return (f'/stats', Stats)
@@ -11,58 +11,29 @@ if TYPE_CHECKING:
 
 class Me(RequestHandler):
     async def get(self):
-        rooms_query = """SELECT id, name, description, owner_id, type, permission_level,
-                                last_message.*
-                         FROM rooms
-                         INNER JOIN room_members ON room_members.room_id = rooms.id
-                         LEFT JOIN (
-                             SELECT messages.id as message_id, content as message_content,
-                                    room_id as message_room_id,
-                                    users.name as message_author_name,
-                                    author_id as message_author_id,
-                                    users.username as message_author_username
-                             FROM messages
-                             INNER JOIN users ON users.id = author_id
-                             ORDER BY messages.created_at DESC
-                             LIMIT 1
-                         ) last_message ON last_message.message_room_id = rooms.id
-                         WHERE room_members.user_id = $1;
-                      """
+        room_records = await self.database.fetch(
+            'get_user_rooms', self.user_id, readonly=True, user_id=self.user_id
+        )
 
-        async with self.database.acquire() as conn:
-            room_records = await conn.fetch(rooms_query, self.user_id)
-
-        user = self.application.user_cache.get(self.user_id)
+        user = await self.application.user_cache.fetch(self.user_id)
 
         if not user:
             # the sky has fallen
             raise AppError('User not found')
 
         me = {
-            'id': user['id'],
-            'name': user['name'],
-            'username': user['username'],
+            'id': user.id,
+            'name': user.name,
+            'username': user.username,
             'rooms': {},
         }
 
-        for record in room_records:
-            if record['message_id']:
-                message_author = {
-                    'id': record['message_author_id'],
-                    'name': record['message_author_name'],
-                    'username': record['message_author_username'],
-                }
-
-                last_message = {
-                    'id': record['message_id'],
-                    'content': record['message_content'],
-                    'room_id': record['message_room_id'],
-                    'author': message_author,
-                }
-
-            else:
-                last_message = None
+        # load every last message author that isn't cached in one query
+        await self.application.user_cache.fetch_many(
+            record['message_author_id'] for record in room_records if record['message_id']
+        )
 
+        for record in room_records:
             room = {
                 'id': record['id'],
                 'name': record['name'],
@@ -70,7 +41,7 @@ class Me(RequestHandler):
                 'owner_id': record['owner_id'],
                 'type': record['type'],
                 'me': {'permission_level': record['permission_level']},
-                'last_message': last_message,
+                'last_message': await self.application.get_last_message(record),
             }
 
             me['rooms'][record['id']] = room
@@ -1,15 +1,22 @@
 from __future__ import annotations
 
 import asyncio
-import datetime
+import inspect
+import itertools
 import logging
+import secrets
+import time
+from collections import deque
 from enum import Enum
-from typing import TYPE_CHECKING, Any, Optional, Union
+from typing import TYPE_CHECKING, Any, NamedTuple, Optional, Union
 
-import orjson
 import tornado.ioloop
+import tornado.web
 import tornado.websocket
 
+from app.utils.encoding import ENCODINGS, Encoding
+from app.utils.event_queue import EventQueue
+
 if TYPE_CHECKING:
     from app.app import Application
 
@@ -20,6 +27,9 @@ class WebsocketOpcode(Enum):
     HEARTBEAT_ACK = 2  # confirmation that heartbeat was received
     IDENTIFY = 3       # information sent about who is connecting
     HELLO = 4          # initial info sent to the client that includes heartbeat interval
+    DISPATCH_BATCH = 5  # several dispatched events sent in one message
+    RESUME = 6         # resumes a previous session after reconnecting
+    READY = 7          # sent after identifying or resuming, includes the session id
 
 
 class WebsocketError:
@@ -27,29 +37,157 @@ class WebsocketError:
     INVALID_DATA: int = 4001
     INVALID_TOKEN: int = 4002
     ALREADY_IDENTIFIED: int = 4003
+    SLOW_CONSUMER: int = 4004
+    INVALID_SESSION: int = 4005
+
+
+class DispatchEvent:
+    """An event that can be dispatched to any number of connections.
+
+    The event is serialized at most once per encoding. Each connection only splices its
+    own increment onto the end of the frame, so the cost of fanning an event out to many
+    connections doesn't depend on the size of the event.
+    """
+
+    __slots__ = ('name', 'data', 'ephemeral', 'prefixes')
+
+    def __init__(self, name: str, data: dict[str, Any], *, ephemeral: bool = False):
+        self.name = name
+        self.data = data
+        # ephemeral events can be dropped if a connection falls behind. every event sent
+        # so far is durable, this is for ones like typing indicators that go stale
+        self.ephemeral = ephemeral
+        # encoding name: encoded frame prefix
+        self.prefixes: dict[str, bytes] = {}
+
+    def frame(self, increment: int, encoding: Encoding = ENCODINGS['json']) -> bytes:
+        prefix = self.prefixes.get(encoding.name)
+
+        if prefix is None:
+            prefix = encoding.dispatch_prefix(WebsocketOpcode.DISPATCH.value, self.name, self.data)
+            self.prefixes[encoding.name] = prefix
+
+        return encoding.dispatch_frame(prefix, increment)
+
+
+class QueuedEvent(NamedTuple):
+    increment: int
+    event: DispatchEvent
+
+    @property
+    def ephemeral(self) -> bool:
+        return self.event.ephemeral
+
+    def frame(self, encoding: Encoding) -> bytes:
+        return self.event.frame(self.increment, encoding)
+
+
+class Session:
+    """A gateway session, which can outlive the connection that identified it.
+
+    Every event sent in a session gets the next increment and is kept in a bounded replay
+    buffer, including events sent while no connection is attached. A client that
+    reconnects before the session expires can RESUME it to have the events it missed
+    replayed.
+    """
+
+    def __init__(self, user_id: str, *, buffer_size: int):
+        self.id = secrets.token_urlsafe(16)
+        self.user_id = user_id
+        self.increment: int = 0
+        self.buffer: deque[QueuedEvent] = deque(maxlen=buffer_size)
+        self.connection: WebSocketHandler | None = None
+        # scheduled while no connection is attached
+        self.expire_handle: asyncio.TimerHandle | None = None
+
+    def send(self, event: DispatchEvent):
+        queued = QueuedEvent(self.increment, event)
+        self.increment += 1
+        self.buffer.append(queued)
+
+        if self.connection is not None:
+            self.connection.queue_event(queued)
+
+    def missed_events(self, last_increment: int) -> list[QueuedEvent] | None:
+        """Gets the events sent after an increment, or None if they can't all be replayed."""
+
+        # increments in the buffer are consecutive, so the oldest one locates the rest
+        first_increment = self.buffer[0].increment if self.buffer else self.increment
+
+        if not first_increment - 1 <= last_increment < self.increment:
+            return None
+
+        start = last_increment + 1 - first_increment
+        return list(itertools.islice(self.buffer, start, None))
 
 
 class WebSocketHandler(tornado.websocket.WebSocketHandler):
     application: Application
     HEARTBEAT_INTERVAL = 60000  # 60 seconds. hardcoded for now.
+    HEARTBEAT_TIMEOUT = (HEARTBEAT_INTERVAL * 1.25) / 1000  # seconds without a heartbeat
+    MAX_BATCH_EVENTS = 100  # the most events sent in one DISPATCH_BATCH message
+    MAX_BATCH_SIZE = 64 * 1024  # stop adding events to a batch once it is this many bytes
+    DEFAULT_COMPRESSION_LEVEL = 6
+    DEFAULT_MEM_LEVEL = 8
 
     def initialize(self, *args, **kwargs):
         super().initialize(*args, **kwargs)
-        self.heartbeat_event = asyncio.Event()
-        self.last_heartbeat_ack = datetime.datetime.utcnow()
-        self.sleep_interval = (self.HEARTBEAT_INTERVAL * 1.25) / 1000
-        self.event_queue = asyncio.Queue()
+        self.event_queue: EventQueue[QueuedEvent] = EventQueue(
+            self.application.max_queued_events
+        )
         self.identified: bool = False
         self.user_id: str | None = None
-        self.increment: int = 0
+        self.session: Session | None = None
+        self.batch_events: bool = False
+        self.encoding: Encoding = ENCODINGS['json']
+        self.compression_options: dict[str, Any] | None = None
+        # set once the connection is being closed as a slow consumer
+        self.closing: bool = False
+
+        # only exists while there are queued events to send
+        self.flush_task: asyncio.Task | None = None
+
+    def get_int_argument(self, name: str, default: int, minimum: int, maximum: int) -> int:
+        try:
+            value = int(self.get_argument(name, str(default)))
+        except ValueError:
+            value = minimum - 1
+
+        if not minimum <= value <= maximum:
+            raise tornado.web.HTTPError(400, f'{name} must be between {minimum} and {maximum}')
+
+        return value
 
-        self.heartbeat_task: asyncio.Task
-        self.dispatch_task: asyncio.Task
+    def prepare(self):
+        # the encoding and compression are negotiated in the connect query string, e.g.
+        # /websocket/connect?encoding=msgpack&compress=deflate&compression_level=9
+        encoding = self.get_argument('encoding', 'json')
+
+        try:
+            self.encoding = ENCODINGS[encoding]
+        except KeyError:
+            raise tornado.web.HTTPError(400, f'Unsupported encoding ({encoding})')
+
+        compress = self.get_argument('compress', None)
+
+        if compress == 'deflate':
+            self.compression_options = {
+                'compression_level': self.get_int_argument(
+                    'compression_level', self.DEFAULT_COMPRESSION_LEVEL, 0, 9
+                ),
+                'mem_level': self.get_int_argument('mem_level', self.DEFAULT_MEM_LEVEL, 1, 9),
+            }
+        elif compress is not None:
+            raise tornado.web.HTTPError(400, f'Unsupported compression ({compress})')
+
+    def get_compression_options(self) -> dict[str, Any] | None:
+        # permessage-deflate is only used if the client also offers it in the handshake
+        return self.compression_options
 
     def write_message(self, message: Union[bytes, str, dict[str, Any]], binary: bool = False):
         if isinstance(message, dict):
-            message = orjson.dumps(message)
-        super().write_message(message, binary)
+            message = self.encoding.dumps(message)
+        return super().write_message(message, binary or self.encoding.binary)
 
     def send_message(
         self,
@@ -71,7 +209,12 @@ class WebSocketHandler(tornado.websocket.WebSocketHandler):
     #     data = {'heartbeat_interval': self.HEARTBEAT_INTERVAL}
     #     self.send_message(WebsocketOpcode.HELLO, data)
 
-    def on_identify(self, data: dict[str, str]):
+    def open(self, *args, **kwargs):
+        # connections are expired by the application's heartbeat sweeper,
+        # including ones that never identify or send a heartbeat
+        self.application.heartbeats.schedule(self, time.monotonic() + self.HEARTBEAT_TIMEOUT)
+
+    async def on_identify(self, data: dict[str, Any]):
         if self.identified:
             self.close(WebsocketError.ALREADY_IDENTIFIED, 'Already identified.')
             return
@@ -86,32 +229,109 @@ class WebSocketHandler(tornado.websocket.WebSocketHandler):
             self.close(WebsocketError.INVALID_TOKEN, 'Token is invalid.')
             return
 
-        if self.user_id not in self.application.user_cache:
+        if not await self.application.user_cache.fetch(self.user_id):
             self.close(WebsocketError.INVALID_TOKEN, 'Token is invalid.')
             return
 
-        self.application.websocket_connections[self.user_id].append(self)
-        self.identified = True
+        if self.ws_connection is None:
+            return  # the connection closed while the user was being loaded
 
-        self.dispatch_task = asyncio.create_task(self.dispatch_loop())
-        self.heartbeat_task = asyncio.create_task(self.heartbeat_loop())
+        # clients that opt in get queued events coalesced into DISPATCH_BATCH messages
+        self.batch_events = data.get('batch') is True
+
+        self.attach_session(self.application.create_session(self.user_id))
 
         logging.info(f'User {self.user_id} connected and identified.')
 
+    def on_resume(self, data: dict[str, Any]):
+        if self.identified:
+            self.close(WebsocketError.ALREADY_IDENTIFIED, 'Already identified.')
+            return
+
+        try:
+            user_id = self.application.tokens.validate_token(data['token'])
+        except Exception:
+            self.close(WebsocketError.INVALID_TOKEN, 'Token is invalid.')
+            return
+
+        session = self.application.sessions.get(data.get('session_id'))  # type: ignore
+        last_increment: int | None = data.get('last_increment')
+
+        # bool is a subclass of int, but true isn't an increment
+        if not isinstance(last_increment, int) or isinstance(last_increment, bool):
+            last_increment = None
+
+        if session is None or session.user_id != user_id or last_increment is None:
+            self.close(WebsocketError.INVALID_SESSION, 'Session is invalid.')
+            return
+
+        missed_events = session.missed_events(last_increment)
+
+        if missed_events is None:
+            # too many events were sent while disconnected to fit in the buffer
+            self.application.expire_session(session)
+            self.close(WebsocketError.INVALID_SESSION, 'Session can no longer be resumed.')
+            return
+
+        previous_connection = session.connection
+
+        self.batch_events = data.get('batch') is True
+        self.attach_session(session, resumed=True)
+
+        if previous_connection is not None:
+            previous_connection.close(WebsocketError.INVALID_SESSION, 'Session was resumed.')
+
+        for queued in missed_events:
+            self.queue_event(queued)
+
+        logging.info(f'User {self.user_id} resumed session {session.id}.')
+
+    def attach_session(self, session: Session, *, resumed: bool = False):
+        if session.expire_handle is not None:
+            session.expire_handle.cancel()
+            session.expire_handle = None
+
+        session.connection = self
+        self.session = session
+        self.user_id = session.user_id
+        self.identified = True
+
+        self.send_message(WebsocketOpcode.READY, {'session_id': session.id, 'resumed': resumed})
+
+    def queue_event(self, event: QueuedEvent):
+        """Queues an event to be sent, closing the connection if it has fallen too far behind."""
+
+        if self.closing:
+            return
+
+        if self.event_queue.put(event):
+            if self.flush_task is None:
+                self.flush_task = asyncio.create_task(self.flush_events())
+            return
+
+        logging.warning(
+            f'Closing websocket connection with user {self.user_id}, '
+            f'{len(self.event_queue)} events are waiting to be sent.'
+        )
+        self.closing = True
+        self.application.gateway_stats['slow_consumer_disconnects'] += 1
+        self.close(WebsocketError.SLOW_CONSUMER, 'Slow consumer.')
+
     def on_heartbeat(self, *_):
-        self.heartbeat_event.set()
-        self.last_heartbeat_ack = datetime.datetime.utcnow()
+        self.application.heartbeats.schedule(self, time.monotonic() + self.HEARTBEAT_TIMEOUT)
         self.send_message(opcode=WebsocketOpcode.HEARTBEAT_ACK)
 
     OPCODE_MAPPING = {
         WebsocketOpcode.IDENTIFY: on_identify,
         WebsocketOpcode.HEARTBEAT: on_heartbeat,
+        WebsocketOpcode.RESUME: on_resume,
     }
 
-    def on_message(self, message: str):
+    async def on_message(self, message: Union[str, bytes]):
         try:
-            data = orjson.loads(message)
-        except orjson.JSONDecodeError:
+            data = self.encoding.loads(message)
+        except (ValueError, TypeError):
+            # msgpack raises TypeError for text frames
             self.close(WebsocketError.INVALID_DATA, 'Invalid message received.')
             return
 
@@ -124,43 +344,64 @@ class WebSocketHandler(tornado.websocket.WebSocketHandler):
             return
 
         method = self.OPCODE_MAPPING[opcode]
-        method(self, data.get('data'))
+        result = method(self, data.get('data'))
+
+        if inspect.isawaitable(result):
+            await result
 
     def on_close(self):
-        if not self.identified or not self.user_id:
+        self.application.heartbeats.remove(self)
+
+        if self.session is None:
             return
 
         logging.info(f'Closing websocket connection with user {self.user_id}')
 
-        self.heartbeat_task.cancel()
-        self.dispatch_task.cancel()
+        if self.flush_task is not None:
+            self.flush_task.cancel()
 
-        user_connections: list[WebSocketHandler] = self.application.websocket_connections[self.user_id]
-        user_connections.pop(user_connections.index(self))
-        if not user_connections:
-            self.application.websocket_connections.pop(self.user_id)
+        stats = self.application.gateway_stats
+        stats['dropped_events'] += self.event_queue.dropped
+        stats['queue_high_water'] = max(stats['queue_high_water'], self.event_queue.high_water)
 
-    async def heartbeat_loop(self):
-        delta = datetime.timedelta(seconds=self.sleep_interval)
+        # the session is kept around for a while in case the client resumes it
+        if self.session.connection is self:
+            self.session.connection = None
+            self.application.detach_session(self.session)
 
-        while True:
-            await self.heartbeat_event.wait()
-            await asyncio.sleep(self.sleep_interval)
-            self.heartbeat_event.clear()
+    async def flush_events(self):
+        """Sends queued events until the queue is empty."""
 
-            behind = self.last_heartbeat_ack < datetime.datetime.utcnow() - delta
-
-            if behind:
-                self.close()
-                return
-
-    async def dispatch_loop(self):
-        while True:
-            event, data = await self.event_queue.get()
-            self.send_message(
-                WebsocketOpcode.DISPATCH, data, event_name=event, increment=self.increment
-            )
-            self.increment += 1
+        try:
+            while not self.event_queue.empty():
+                frame = self.event_queue.get_nowait().frame(self.encoding)
+
+                if not self.batch_events or self.event_queue.empty():
+                    # waiting for the write to flush means the queue backs up behind
+                    # a slow client instead of tornado's write buffer
+                    await self.write_message(frame)
+                    continue
+
+                # drain whatever else is already queued into a single message
+                frames = [frame]
+                size = len(frame)
+
+                while (
+                    not self.event_queue.empty()
+                    and len(frames) < self.MAX_BATCH_EVENTS
+                    and size < self.MAX_BATCH_SIZE
+                ):
+                    frame = self.event_queue.get_nowait().frame(self.encoding)
+                    frames.append(frame)
+                    size += len(frame)
+
+                await self.write_message(
+                    self.encoding.batch(WebsocketOpcode.DISPATCH_BATCH.value, frames)
+                )
+        except tornado.websocket.WebSocketClosedError:
+            pass
+        finally:
+            self.flush_task = None
 
     def check_origin(self, origin):
         return True
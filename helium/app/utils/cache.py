@@ -0,0 +1,506 @@
+from __future__ import annotations
+
+import asyncio
+import dataclasses
+import datetime
+import sys
+import time
+from collections import OrderedDict
+from typing import Any, Iterable, Iterator, KeysView, NamedTuple, Protocol
+
+
+class UserSource(Protocol):
+    """Where a UserCache loads users from on a miss, normally the Database."""
+
+    async def get_user(self, user_id: str) -> Any:
+        ...
+
+    async def get_users(self, user_ids: list[str]) -> Iterable[Any]:
+        ...
+
+
+class LinkSource(Protocol):
+    """Where a LinkCache loads links from on a miss, normally the Database."""
+
+    async def get_link(
+        self, link_id: str, *, readonly: bool = False, user_id: str | None = None
+    ) -> Any:
+        ...
+
+
+@dataclasses.dataclass(slots=True)
+class User:
+    """A cached user.
+
+    Users are stored as slotted dataclasses rather than dicts to keep the per-user memory
+    cost down. orjson serializes dataclasses natively, so a user can be embedded directly
+    in any payload that gets written out.
+    """
+
+    id: str
+    username: str | None
+    name: str
+
+    def __post_init__(self):
+        # ids are repeated across every cache, so share a single copy of each
+        self.id = sys.intern(self.id)
+
+    @classmethod
+    def from_record(cls, record: Any) -> User:
+        return cls(record['id'], record['username'], record['name'])
+
+
+class UserCache:
+    """A cache of users that reads through to the database on a miss.
+
+    By default every user is kept forever. If `max_size` is set, the least recently used
+    users are evicted once the cache is full, and if `ttl` is set, users are reloaded
+    once they have been cached for that many seconds. Concurrent misses for the same user
+    share a single query.
+    """
+
+    def __init__(self, database: UserSource, *, max_size: int = 0, ttl: float = 0):
+        self.database = database
+        self.max_size = max_size
+        self.ttl = ttl
+
+        self._users: dict[str, User] = OrderedDict() if max_size else {}
+        # user_id: monotonic time the user expires at, only used with a ttl
+        self._expires_at: dict[str, float] = {}
+        # user_id: the query loading them, shared by everyone waiting on it
+        self._pending: dict[str, asyncio.Task[dict[str, User]]] = {}
+
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+        self.expirations: int = 0
+
+    @property
+    def bounded(self) -> bool:
+        return bool(self.max_size or self.ttl)
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    def __contains__(self, user_id: object) -> bool:
+        return user_id in self._users
+
+    def __getitem__(self, user_id: str) -> User:
+        user = self.get(user_id)
+
+        if user is None:
+            raise KeyError(user_id)
+
+        return user
+
+    def __setitem__(self, user_id: str, user: User):
+        self.add(user)
+
+    def get(self, user_id: str) -> User | None:
+        """Gets a user from the cache without going to the database."""
+
+        user = self._users.get(user_id)
+
+        if user is None:
+            self.misses += 1
+            return None
+
+        if self.ttl and self._expires_at[user_id] <= time.monotonic():
+            self.pop(user_id)
+            self.expirations += 1
+            self.misses += 1
+            return None
+
+        if self.max_size:
+            self._users.move_to_end(user_id)  # type: ignore
+
+        self.hits += 1
+        return user
+
+    def add(self, user: User):
+        self._users[user.id] = user
+
+        if self.ttl:
+            self._expires_at[user.id] = time.monotonic() + self.ttl
+
+        if self.max_size:
+            self._users.move_to_end(user.id)  # type: ignore
+
+            while len(self._users) > self.max_size:
+                user_id, _ = self._users.popitem(last=False)  # type: ignore
+                self._expires_at.pop(user_id, None)
+                self.evictions += 1
+
+    def pop(self, user_id: str, default: Any = None) -> User | Any:
+        self._expires_at.pop(user_id, None)
+        return self._users.pop(user_id, default)
+
+    def clear(self):
+        self._users.clear()
+        self._expires_at.clear()
+
+    def replace(self, other: UserCache):
+        """Takes over the users of another cache, which was loaded on the side."""
+
+        self._users = other._users
+        self._expires_at = other._expires_at
+
+    async def _load(self, user_ids: list[str]) -> dict[str, User]:
+        if len(user_ids) == 1:
+            record = await self.database.get_user(user_ids[0])
+            records = [record] if record else []
+        else:
+            records = await self.database.get_users(user_ids)
+
+        users: dict[str, User] = {}
+
+        for record in records:
+            user = User.from_record(record)
+            self.add(user)
+            users[user.id] = user
+
+        return users
+
+    def _start_load(self, user_ids: list[str]) -> asyncio.Task[dict[str, User]]:
+        # one query for every id, each registered so later misses for it wait on this one
+        task = asyncio.create_task(self._load(user_ids))
+
+        for user_id in user_ids:
+            self._pending[user_id] = task
+
+        def done(_):
+            for user_id in user_ids:
+                if self._pending.get(user_id) is task:
+                    del self._pending[user_id]
+
+        task.add_done_callback(done)
+        return task
+
+    async def fetch(self, user_id: str) -> User | None:
+        """Gets a user, loading them from the database if they aren't cached."""
+
+        user = self.get(user_id)
+
+        if user is not None:
+            return user
+
+        task = self._pending.get(user_id) or self._start_load([user_id])
+
+        # shielded so a cancelled request doesn't cancel the query for everyone waiting on it
+        return (await asyncio.shield(task)).get(user_id)
+
+    async def fetch_many(self, user_ids: Iterable[str]) -> dict[str, User]:
+        """Gets several users, loading any that aren't cached in a single query.
+
+        Users already being loaded by another call are waited on rather than queried again.
+        """
+
+        users: dict[str, User] = {}
+        missing: list[str] = []
+        tasks: dict[str, asyncio.Task[dict[str, User]]] = {}
+
+        for user_id in set(user_ids):
+            user = self.get(user_id)
+
+            if user is not None:
+                users[user_id] = user
+            elif user_id in self._pending:
+                tasks[user_id] = self._pending[user_id]
+            else:
+                missing.append(user_id)
+
+        if missing:
+            task = self._start_load(missing)
+            tasks.update(dict.fromkeys(missing, task))
+
+        unique_tasks = set(tasks.values())
+        results = await asyncio.gather(*map(asyncio.shield, unique_tasks))
+
+        for loaded in results:
+            users.update((id, user) for id, user in loaded.items() if id in tasks)
+
+        return users
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            'size': len(self._users),
+            'max_size': self.max_size,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'pending': len(self._pending),
+        }
+
+
+class Relationship(NamedTuple):
+    type: int
+    user_id: str
+    recipient_id: str
+
+
+class RelationshipStore:
+    """An index of relationships between users.
+
+    Relationships are keyed by their (user_id, recipient_id) pair, with adjacency maps
+    in both directions so a user's outgoing and incoming relationships can be found
+    without scanning every relationship.
+    """
+
+    def __init__(self):
+        self._relationships: dict[tuple[str, str], Relationship] = {}
+        # user_id: {recipient_id: relationship}
+        self._outgoing: dict[str, dict[str, Relationship]] = {}
+        # recipient_id: {user_id: relationship}
+        self._incoming: dict[str, dict[str, Relationship]] = {}
+
+    def __len__(self) -> int:
+        return len(self._relationships)
+
+    def __iter__(self) -> Iterator[Relationship]:
+        return iter(self._relationships.values())
+
+    def get(self, user_id: str, recipient_id: str) -> Relationship | None:
+        return self._relationships.get((user_id, recipient_id))
+
+    def add(self, type: int, user_id: str, recipient_id: str) -> Relationship:
+        """Adds a relationship, replacing any existing one between the two users."""
+
+        relationship = Relationship(type, user_id, recipient_id)
+
+        self._relationships[(user_id, recipient_id)] = relationship
+        self._outgoing.setdefault(user_id, {})[recipient_id] = relationship
+        self._incoming.setdefault(recipient_id, {})[user_id] = relationship
+
+        return relationship
+
+    def remove(self, user_id: str, recipient_id: str) -> Relationship | None:
+        """Removes a relationship and returns it, if it existed."""
+
+        relationship = self._relationships.pop((user_id, recipient_id), None)
+
+        if relationship is None:
+            return None
+
+        outgoing = self._outgoing[user_id]
+        del outgoing[recipient_id]
+        if not outgoing:
+            del self._outgoing[user_id]
+
+        incoming = self._incoming[recipient_id]
+        del incoming[user_id]
+        if not incoming:
+            del self._incoming[recipient_id]
+
+        return relationship
+
+    def outgoing(self, user_id: str) -> list[Relationship]:
+        """Returns the relationships a user has created."""
+
+        return list(self._outgoing.get(user_id, {}).values())
+
+    def incoming(self, recipient_id: str) -> list[Relationship]:
+        """Returns the relationships other users have with a user."""
+
+        return list(self._incoming.get(recipient_id, {}).values())
+
+    def clear(self):
+        self._relationships.clear()
+        self._outgoing.clear()
+        self._incoming.clear()
+
+    def replace(self, other: RelationshipStore):
+        """Takes over the contents of another store, which was loaded on the side."""
+
+        self._relationships = other._relationships
+        self._outgoing = other._outgoing
+        self._incoming = other._incoming
+
+
+class MembershipIndex:
+    """An index of room memberships.
+
+    Each room maps its members to their permission level, and each user maps to the
+    set of rooms they are in, so membership checks and lookups in either direction
+    don't depend on the size of the room.
+    """
+
+    def __init__(self):
+        # room_id: {user_id: permission_level}
+        self._rooms: dict[str, dict[str, int]] = {}
+        # user_id: {room_id}
+        self._users: dict[str, set[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self._rooms)
+
+    def __contains__(self, room_id: object) -> bool:
+        return room_id in self._rooms
+
+    def add(self, room_id: str, user_id: str, permission_level: int = 0):
+        self._rooms.setdefault(room_id, {})[user_id] = permission_level
+        self._users.setdefault(user_id, set()).add(room_id)
+
+    def remove(self, room_id: str, user_id: str) -> bool:
+        """Removes a user from a room and returns whether they were a member."""
+
+        members = self._rooms.get(room_id)
+
+        if members is None or user_id not in members:
+            return False
+
+        del members[user_id]
+        if not members:
+            del self._rooms[room_id]
+
+        rooms = self._users[user_id]
+        rooms.discard(room_id)
+        if not rooms:
+            del self._users[user_id]
+
+        return True
+
+    def remove_room(self, room_id: str):
+        for user_id in self._rooms.pop(room_id, {}):
+            rooms = self._users[user_id]
+            rooms.discard(room_id)
+            if not rooms:
+                del self._users[user_id]
+
+    def is_member(self, room_id: str, user_id: str) -> bool:
+        members = self._rooms.get(room_id)
+        return members is not None and user_id in members
+
+    def members(self, room_id: str) -> KeysView[str]:
+        return self._rooms.get(room_id, {}).keys()
+
+    def rooms(self, user_id: str) -> frozenset[str]:
+        return frozenset(self._users.get(user_id, ()))
+
+    def permission_level(self, room_id: str, user_id: str) -> int | None:
+        return self._rooms.get(room_id, {}).get(user_id)
+
+    def clear(self):
+        self._rooms.clear()
+        self._users.clear()
+
+    def replace(self, other: MembershipIndex):
+        """Takes over the contents of another index, which was loaded on the side."""
+
+        self._rooms = other._rooms
+        self._users = other._users
+
+
+def link_is_usable(link: Any) -> bool:
+    """Whether a link hasn't expired or run out of uses."""
+
+    if link['expires_at'] and link['expires_at'] < datetime.datetime.utcnow():
+        return False
+
+    return not (link['max_uses'] and link['uses'] >= link['max_uses'])
+
+
+class LinkCache:
+    """A small cache of recently used links in front of the database.
+
+    Links are kept for `ttl` seconds, and the least recently used are evicted past
+    `max_size`, so only the links people are actively opening stay cached. Uses made by
+    this process are counted into the cached link as they happen, so showing a popular
+    link doesn't need a read per click. Uses are only enforced by the database, so the
+    count of a link used from other processes may lag by up to `ttl` seconds.
+    """
+
+    def __init__(self, database: LinkSource, *, max_size: int = 1000, ttl: float = 30):
+        self.database = database
+        self.max_size = max_size
+        self.ttl = ttl
+
+        # link_id: (link, monotonic time it expires from the cache)
+        self._links: OrderedDict[str, tuple[dict[str, Any], float]] = OrderedDict()
+        # loads are only shared between fetches routed the same way, a read from the
+        # primary shouldn't wait on one from a lagging replica
+        # (link_id, readonly, user_id): load
+        self._pending: dict[tuple[str, bool, str | None], asyncio.Task[dict[str, Any] | None]] = {}
+
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def __len__(self) -> int:
+        return len(self._links)
+
+    def get(self, link_id: str) -> dict[str, Any] | None:
+        """Gets a usable link from the cache without going to the database."""
+
+        cached = self._links.get(link_id)
+
+        if cached is None:
+            return None
+
+        link, expires_at = cached
+
+        if expires_at <= time.monotonic() or not link_is_usable(link):
+            self.pop(link_id)
+            return None
+
+        self._links.move_to_end(link_id)
+        return link
+
+    def add(self, link: dict[str, Any]):
+        self._links[link['id']] = (link, time.monotonic() + self.ttl)
+        self._links.move_to_end(link['id'])
+
+        while len(self._links) > self.max_size:
+            self._links.popitem(last=False)
+
+    def pop(self, link_id: str):
+        self._links.pop(link_id, None)
+
+    def record_use(self, link_id: str, uses: int):
+        cached = self._links.get(link_id)
+
+        if cached is not None:
+            cached[0]['uses'] = uses
+
+    async def _load(
+        self, link_id: str, readonly: bool, user_id: str | None
+    ) -> dict[str, Any] | None:
+        record = await self.database.get_link(link_id, readonly=readonly, user_id=user_id)
+
+        if record is None or not link_is_usable(record):
+            return None
+
+        link = dict(record)
+        self.add(link)
+        return link
+
+    async def fetch(
+        self, link_id: str, *, readonly: bool = False, user_id: str | None = None
+    ) -> dict[str, Any] | None:
+        """Gets a usable link, loading it from the database if it isn't cached."""
+
+        link = self.get(link_id)
+
+        if link is not None:
+            self.hits += 1
+            return link
+
+        self.misses += 1
+        key = (link_id, readonly, user_id)
+        task = self._pending.get(key)
+
+        if task is None:
+            task = asyncio.create_task(self._load(link_id, readonly, user_id))
+            self._pending[key] = task
+            task.add_done_callback(lambda _: self._pending.pop(key, None))
+
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            'size': len(self._links),
+            'max_size': self.max_size,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
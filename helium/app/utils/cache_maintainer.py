@@ -0,0 +1,193 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import logging
+import secrets
+import sys
+from typing import TYPE_CHECKING, Any, Iterator
+
+import orjson
+
+from .cache import User
+
+if TYPE_CHECKING:
+    from app.app import Application
+
+
+TABLES = ('users', 'room_members', 'relationships', 'revoked_tokens')
+
+
+class CacheMaintainer:
+    """Keeps the caches in sync with changes made by any process.
+
+    Triggers on the cached tables send a notification for every changed row. Changes
+    carry the whole cached row, so applying one is idempotent and replaying them in
+    order always ends on the latest state.
+
+    Postgres only sends notifications once their transaction commits, in commit order,
+    and doesn't drop any while the listener is connected. Changes can only be missed
+    while the listener connection is down, so the caches resync from the database once
+    it reconnects.
+    """
+
+    CHANNEL = 'cache_changes'
+    SYNC_TIMEOUT = 5  # seconds to wait for a sync marker to come back before giving up
+
+    def __init__(self, application: Application):
+        self.application = application
+
+        # table: changes held back while its cache is being loaded
+        self._held: dict[str, list[dict[str, Any]]] = {}
+        self._tasks: set[asyncio.Task] = set()
+        self._resyncing = False
+        # marker: future resolved once the marker comes back through the listener
+        self._syncs: dict[str, asyncio.Future[None]] = {}
+
+        self.applied: int = 0
+        self.resyncs: int = 0
+
+    async def start(self):
+        await self.application.database.listen(
+            self.CHANNEL, self.on_notification, on_reconnect=self.on_reconnect
+        )
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+
+        await self.application.database.unlisten(self.CHANNEL, self.on_notification)
+
+    def _create_task(self, coro: Any):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    @contextlib.contextmanager
+    def hold(self, *tables: str) -> Iterator[None]:
+        """Holds back changes to tables while their caches are loaded, then applies them.
+
+        Changes committed after the load started may or may not be in what was loaded,
+        so every change that arrived during the load is applied once it is done.
+        """
+
+        for table in tables:
+            self._held.setdefault(table, [])
+
+        try:
+            yield
+        finally:
+            for table in tables:
+                for change in self._held.pop(table, []):
+                    self.apply(change)
+
+    async def sync(self):
+        """Waits until every change committed so far has been applied to the caches.
+
+        Notifications arrive in commit order, so once a marker sent now comes back through
+        the listener, every change committed before it has been applied. Handlers call
+        this after a write the user's next request depends on.
+        """
+
+        marker = secrets.token_hex(8)
+        future: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        self._syncs[marker] = future
+
+        try:
+            payload = orjson.dumps({'t': 'sync', 'd': [marker]}).decode()
+            await self.application.database.execute('notify', self.CHANNEL, payload)
+            await asyncio.wait_for(future, self.SYNC_TIMEOUT)
+        except asyncio.TimeoutError:
+            logging.warning('Timed out waiting for cache changes to be applied.')
+        finally:
+            self._syncs.pop(marker, None)
+
+    def on_notification(self, connection: Any, pid: int, channel: str, payload: str):
+        try:
+            change = orjson.loads(payload)
+
+            if change['t'] == 'sync':
+                # markers sent by other processes aren't waited on here
+                future = self._syncs.get(change['d'][0])
+
+                if future is not None and not future.done():
+                    future.set_result(None)
+
+                return
+
+            held = self._held.get(change['t'])
+
+            if held is not None:
+                held.append(change)
+            else:
+                self.apply(change)
+        except Exception:
+            logging.exception('Failed to apply cache change.')
+
+    def on_reconnect(self):
+        self._create_task(self.resync('the listener reconnected'))
+
+    def apply(self, change: dict[str, Any]):
+        table: str = change['t']
+        deleted: bool = change['o'] == 'D'
+        app = self.application
+
+        if table == 'users':
+            id, username, name = change['d']
+
+            if deleted:
+                app.user_cache.pop(id)
+            elif not app.user_cache.bounded or id in app.user_cache:
+                # a bounded cache only keeps users that have been asked for
+                app.user_cache.add(User(id, username, name))
+        elif table == 'room_members':
+            room_id, user_id, permission_level = change['d']
+            room_id, user_id = sys.intern(room_id), sys.intern(user_id)
+
+            if deleted:
+                app.room_cache.remove(room_id, user_id)
+            else:
+                app.room_cache.add(room_id, user_id, permission_level)
+        elif table == 'relationships':
+            type, user_id, recipient_id = change['d']
+            user_id, recipient_id = sys.intern(user_id), sys.intern(recipient_id)
+
+            if deleted:
+                app.relationship_cache.remove(user_id, recipient_id)
+            else:
+                app.relationship_cache.add(type, user_id, recipient_id)
+        elif table == 'revoked_tokens':
+            (token_hash,) = change['d']
+
+            if deleted:
+                app.tokens.unrevoke(token_hash)
+            else:
+                app.tokens.revoke(token_hash)
+
+        self.applied += 1
+
+    async def resync(self, reason: str):
+        if self._resyncing:
+            return
+
+        logging.warning(f'Resyncing caches because {reason}.')
+        self._resyncing = True
+
+        try:
+            # the first relationship load is still holding back its own changes
+            await self.application.relationships_ready.wait()
+
+            with self.hold(*TABLES):
+                await self.application.reload_caches()
+        except Exception:
+            logging.exception('Failed to resync caches.')
+        else:
+            self.resyncs += 1
+        finally:
+            self._resyncing = False
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            'applied': self.applied,
+            'resyncs': self.resyncs,
+        }
@@ -1,15 +1,23 @@
 from __future__ import annotations
 
+import asyncio
+import bisect
 import contextlib
-import datetime
+import dataclasses
+import logging
+import struct
+import time
 from enum import Enum
-from typing import Any
+from typing import Any, AsyncIterator, Callable
 
-import argon2
 import asyncpg
 import orjson
 
-from .errors import AppError
+from . import migrations
+from .errors import AppError, ServiceUnavailable
+from .migrations import Migration, MigrationRequired
+from .password_hasher import PasswordHasher
+from .queries import QUERIES
 
 
 class DatabaseError(AppError):
@@ -21,178 +29,674 @@ class PermissionLevel(Enum):
     admin = 1
 
 
+class Connection(asyncpg.Connection):
+    """A pooled connection.
+
+    Statements from the query registry are prepared the first time a connection runs
+    them and kept in its statement cache, which is sized to hold all of them. Prepared
+    statement objects can't be kept instead, asyncpg invalidates them once the
+    connection goes back to the pool.
+    """
+
+
+class PoolStats:
+    """Wait times and outcomes of acquiring connections from the pool."""
+
+    # upper bounds of the wait time histogram buckets, in seconds
+    BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+
+    def __init__(self):
+        self.acquires: int = 0
+        self.timeouts: int = 0
+        self.in_use: int = 0
+        self.total_wait: float = 0
+        self.max_wait: float = 0
+        # one count per bucket, and a last one for waits longer than every bucket
+        self.histogram: list[int] = [0] * (len(self.BUCKETS) + 1)
+
+    def record(self, wait: float):
+        self.acquires += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        self.histogram[bisect.bisect_left(self.BUCKETS, wait)] += 1
+
+    def stats(self) -> dict[str, Any]:
+        labels = [f'<={bound * 1000:g}ms' for bound in self.BUCKETS]
+        labels.append(f'>{self.BUCKETS[-1] * 1000:g}ms')
+
+        return {
+            'acquires': self.acquires,
+            'timeouts': self.timeouts,
+            'in_use': self.in_use,
+            'mean_wait_ms': round(self.total_wait * 1000 / (self.acquires or 1), 3),
+            'max_wait_ms': round(self.max_wait * 1000, 3),
+            'wait_histogram': dict(zip(labels, self.histogram)),
+        }
+
+
+@dataclasses.dataclass(slots=True)
+class QueryStats:
+    calls: int = 0
+    total_time: float = 0  # seconds
+
+    def record(self, elapsed: float):
+        self.calls += 1
+        self.total_time += elapsed
+
+
+INT8 = struct.Struct('!q')
+SCHEMA_LOCK_ID = 0x6865  # advisory lock held while the schema is created
+
 DROP_TABLES = """
-DROP TABLE relationships;
-DROP TABLE links;
-DROP TABLE messages;
-DROP TABLE room_members;
-DROP TABLE rooms;
-DROP TABLE user_settings;
-DROP TABLE users;
+DROP TABLE IF EXISTS event_payloads;
+DROP TABLE IF EXISTS revoked_tokens;
+DROP TABLE IF EXISTS relationships;
+DROP TABLE IF EXISTS links;
+DROP TABLE IF EXISTS room_last_messages;
+DROP TABLE IF EXISTS messages;
+DROP TABLE IF EXISTS room_members;
+DROP TABLE IF EXISTS rooms;
+DROP TABLE IF EXISTS user_settings;
+DROP TABLE IF EXISTS users;
+DROP TABLE IF EXISTS schema_migrations;
 """
 
 
-class Database:
+Notification = Callable[[asyncpg.Connection, int, str, str], None]
+
+# failures that mean a replica can't be used right now
+REPLICA_ERRORS = (OSError, asyncio.TimeoutError, asyncpg.PostgresError, asyncpg.InterfaceError)
 
-    def __init__(self, pool: asyncpg.Pool):
+
+class Replica:
+    """A read replica and its last known state."""
+
+    def __init__(self, uri: str):
+        self.uri = uri
+        self.pool: asyncpg.Pool | None = None
+        self.healthy: bool = False
+        self.lag: float | None = None  # seconds behind the primary
+        self.fallbacks: int = 0  # reads sent to the primary because this replica failed
+
+    def mark_down(self):
+        self.healthy = False
+        self.fallbacks += 1
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            'healthy': self.healthy,
+            'lag': self.lag,
+            'fallbacks': self.fallbacks,
+            'size': self.pool.get_size() if self.pool else 0,
+            'idle': self.pool.get_idle_size() if self.pool else 0,
+        }
+
+
+class Database:
+    LISTENER_RECONNECT_DELAY = 5
+    REPLICA_CHECK_INTERVAL = 1  # seconds between replica lag checks
+    REPLICA_ACQUIRE_TIMEOUT = 0.5  # a busy replica falls back to the primary quickly
+
+    def __init__(
+        self,
+        pool: asyncpg.Pool,
+        uri: str | None = None,
+        *,
+        acquire_timeout: float | None = None,
+        pool_options: dict[str, Any] | None = None,
+        replicas: list[str] | None = None,
+        max_replica_lag: float = 1,
+        hasher: PasswordHasher | None = None,
+    ):
         self.pool = pool
-        self.hasher = argon2.PasswordHasher()
+        self.uri = uri
+        self.acquire_timeout = acquire_timeout
+        self.pool_options: dict[str, Any] = pool_options or {}
+        self.pool_stats = PoolStats()
+
+        self.replicas = [Replica(uri) for uri in replicas or ()]
+        self.max_replica_lag = max_replica_lag
+        # user_id: monotonic time of their last write, only tracked with replicas and only
+        # for writes made through this process
+        self.last_writes: dict[str, float] = {}
+        self._next_replica = 0
+        self._replica_task: asyncio.Task | None = None
+        self.hasher = hasher or PasswordHasher()
         self.setup_completed: bool | None = None
+        self.query_stats: dict[str, QueryStats] = {name: QueryStats() for name in QUERIES}
+
+        # LISTEN needs a connection of its own, shared by every channel
+        self._listener: asyncpg.Connection | None = None
+        self._listener_task: asyncio.Task | None = None
+        # channel: callbacks
+        self._listeners: dict[str, list[Notification]] = {}
+        self._reconnect_callbacks: list[Callable[[], None]] = []
 
     @staticmethod
-    async def connection_init(connection: asyncpg.Connection) -> asyncpg.Connection:
+    async def connection_init(connection: Connection) -> Connection:
         await connection.set_type_codec(
             'json', encoder=orjson.dumps, decoder=orjson.loads, schema='pg_catalog'
         )
+        # ids are BIGINT in the database but strings everywhere else, since they don't fit
+        # in a javascript number
+        await connection.set_type_codec(
+            'int8',
+            encoder=lambda value: INT8.pack(int(value)),
+            decoder=lambda data: str(INT8.unpack(data)[0]),
+            schema='pg_catalog',
+            format='binary',
+        )
+
         return connection
 
-    async def create_tables(self):
+    @staticmethod
+    async def create_baseline(connection: asyncpg.Connection):
         with open('schema.sql', 'r') as f:
-            await self.pool.execute(f.read())
+            schema = f.read()
+
+        await connection.execute(schema)
 
     @classmethod
-    async def connect(cls, config: dict[str, Any]):
-        pool = await asyncpg.create_pool(config['uri'], init=cls.connection_init)
-        assert pool
+    async def create_schema(cls, connection: asyncpg.Connection):
+        """Creates the schema in a new database, or checks an existing one is up to date.
+
+        A new database gets the baseline schema.sql and then every migration. An existing
+        one is only changed by `db migrate`, and starting with migrations pending raises
+        MigrationRequired.
+        """
 
-        self = cls(pool)
+        async with connection.transaction():
+            # worker processes starting together would otherwise race to create tables
+            await connection.execute('SELECT pg_advisory_xact_lock($1);', SCHEMA_LOCK_ID)
 
-        await self.create_tables()
+            new = await connection.fetchval("SELECT to_regclass('users') IS NULL;")
+            await migrations.create_migrations_table(connection)
+            pending = await migrations.get_pending(connection)
 
-        if await pool.fetchval('SELECT 1 FROM users LIMIT 1;'):
-            self.setup_completed = True
-        else:
-            self.setup_completed = False
+            if new:
+                await cls.create_baseline(connection)
+
+                for migration in pending:
+                    await migrations.apply(connection, migration)
+
+                return
+
+        if pending:
+            raise MigrationRequired(pending)
+
+    @classmethod
+    async def migrate(cls, connection: asyncpg.Connection) -> list[Migration]:
+        """Applies every pending migration in order, each in a transaction of its own."""
+
+        await connection.execute('SELECT pg_advisory_lock($1);', SCHEMA_LOCK_ID)
+
+        try:
+            await migrations.create_migrations_table(connection)
+            pending = await migrations.get_pending(connection)
+
+            if pending and not await connection.fetchval('SELECT 1 FROM schema_migrations;'):
+                # databases from before migrations may be missing parts of the baseline
+                await cls.create_baseline(connection)
+
+            for migration in pending:
+                await migrations.apply(connection, migration)
+
+            return pending
+        finally:
+            await connection.execute('SELECT pg_advisory_unlock($1);', SCHEMA_LOCK_ID)
+
+    async def create_tables(self):
+        async with self.acquire() as conn:
+            await self.create_schema(conn)
+
+        # statements prepared against tables that were dropped and created again fail
+        await self.pool.expire_connections()
+
+    @classmethod
+    async def connect(
+        cls, config: dict[str, Any], *, workers: int = 1, hasher: PasswordHasher | None = None
+    ):
+        """Connects to the database.
+
+        The pool sizes in the database config are totals, which are split evenly between
+        `workers` processes.
+        """
+
+        connection = await asyncpg.connect(config['uri'])
+        try:
+            await cls.create_schema(connection)
+        finally:
+            await connection.close()
+
+        max_size = config.get('max_size', 10) // workers
+
+        if max_size < 2:
+            # background work like the relationship cache load holds a connection for a
+            # long time, requests would queue behind it with only one
+            logging.warning(
+                f'max_size ({config.get("max_size", 10)}) leaves each of the {workers} '
+                'workers less than 2 connections, opening 2 per worker.'
+            )
+            max_size = 2
+
+        min_size = min(max_size, config.get('min_size', 10) // workers)
+
+        pool_options: dict[str, Any] = dict(
+            min_size=min_size,
+            max_size=max_size,
+            max_queries=config.get('max_queries', 50000),
+            max_inactive_connection_lifetime=config.get('max_inactive_lifetime', 300),
+            # room for every statement in the registry on top of one-off queries
+            statement_cache_size=len(QUERIES) + 100,
+        )
+        pool = await cls.create_pool(config['uri'], pool_options)
+
+        self = cls(
+            pool,
+            config['uri'],
+            acquire_timeout=config.get('acquire_timeout', 10) or None,
+            pool_options=pool_options,
+            replicas=config.get('replicas', []),
+            max_replica_lag=config.get('max_replica_lag', 1),
+            hasher=hasher,
+        )
+        self.setup_completed = bool(await self.fetchval('any_user_exists'))
+
+        if self.replicas:
+            await self.check_replicas()
+            self._replica_task = asyncio.create_task(self.monitor_replicas())
 
         return self
 
+    @classmethod
+    async def create_pool(cls, uri: str, options: dict[str, Any]) -> asyncpg.Pool:
+        pool = await asyncpg.create_pool(
+            uri, init=cls.connection_init, connection_class=Connection, **options
+        )
+        assert pool
+        return pool
+
+    async def _checkout(self, pool: asyncpg.Pool, timeout: float | None) -> Connection:
+        started_at = time.perf_counter()
+
+        try:
+            conn: Connection = await pool.acquire(timeout=timeout)
+        except asyncio.TimeoutError:
+            self.pool_stats.timeouts += 1
+            raise
+
+        self.pool_stats.record(time.perf_counter() - started_at)
+        return conn
+
     @contextlib.asynccontextmanager
-    async def acquire(self, *, timeout: float | None = None):
-        conn: asyncpg.Connection = await self.pool.acquire(timeout=timeout)
+    async def acquire(
+        self, *, timeout: float | None = None, readonly: bool = False, user_id: str | None = None
+    ) -> AsyncIterator[Connection]:
+        """Acquires a pooled connection, waiting at most `acquire_timeout` by default.
+
+        Connections for `readonly` work may come from a replica that is caught up. Passing
+        the `user_id` the read is for makes it read-your-writes: a user who wrote
+        something recently is kept on the primary until the write has reached replicas.
+        """
+
+        replica = self.choose_replica(user_id) if readonly else None
+        conn: Connection | None = None
+        pool = self.pool
+
+        if replica is not None and replica.pool is not None:
+            try:
+                conn = await self._checkout(replica.pool, self.REPLICA_ACQUIRE_TIMEOUT)
+                pool = replica.pool
+            except REPLICA_ERRORS:
+                logging.warning('Could not use a replica, falling back to the primary.')
+                replica.mark_down()
+
+        if conn is None:
+            try:
+                conn = await self._checkout(
+                    self.pool, self.acquire_timeout if timeout is None else timeout
+                )
+            except asyncio.TimeoutError:
+                logging.warning('Timed out waiting for a database connection.')
+                raise ServiceUnavailable
+
+        self.pool_stats.in_use += 1
+
         try:
             yield conn
         finally:
-            await self.pool.release(conn)
+            self.pool_stats.in_use -= 1
+            await pool.release(conn)
 
-    async def create_account(
-        self, username: str | None, name: str, password: str, email: str, id: str
-    ) -> dict[str, Any]:
-        hashed_pw: str = self.hasher.hash(password)
-        permission_level = (
-            PermissionLevel.user if self.setup_completed else PermissionLevel.admin
-        ).value
+    def choose_replica(self, user_id: str | None = None) -> Replica | None:
+        if user_id is not None:
+            written_at = self.last_writes.get(user_id)
 
-        query = """INSERT INTO users (id, username, name, hashed_password, email, permission_level)
-                   VALUES ($1, $2, $3, $4, $5, $6)
-                """
+            if written_at is not None and time.monotonic() - written_at < self.write_window:
+                return None
 
-        async with self.acquire() as conn:
-            try:
-                await conn.execute(query, id, username, name, hashed_pw, email, permission_level)
-            except asyncpg.UniqueViolationError:
-                raise DatabaseError('That username is already taken.')
+        healthy = [replica for replica in self.replicas if replica.healthy]
 
-        return {'id': id, 'username': username, 'name': name, 'email': email}
+        if not healthy:
+            return None
 
-    async def rehash_password(self, id: str, password: str):
-        hashed_password = self.hasher.hash(password)
+        self._next_replica += 1
+        return healthy[self._next_replica % len(healthy)]
 
-        query = """UPDATE users
-                   SET hashed_password=$1
-                   WHERE id=$2;
-                """
-        async with self.acquire() as conn:
-            await conn.execute(query, hashed_password, id)
+    @property
+    def write_window(self) -> float:
+        # a replica is used while it is at most max_replica_lag behind, and that is only
+        # known as of its last check
+        return self.max_replica_lag + self.REPLICA_CHECK_INTERVAL
 
-    async def get_account(self, email: str, password: str) -> dict[str, str]:
-        query = """SELECT id, username, name, hashed_password
-                   FROM users
-                   WHERE email=$1;
-                """
+    def mark_write(self, user_id: str):
+        """Notes that a user wrote something, for routing their reads afterwards.
 
-        async with self.acquire() as conn:
-            record = await conn.fetchrow(query, email)
+        Writes are only remembered by the process that made them, so with several
+        workers read-your-writes is best-effort: a read that lands on another worker
+        can still go to a replica that doesn't have the write yet.
+        """
 
-        if not record:
-            raise DatabaseError
+        if self.replicas:
+            self.last_writes[user_id] = time.monotonic()
 
+    async def check_replica(self, replica: Replica):
         try:
-            self.hasher.verify(record['hashed_password'], password)
-        except argon2.exceptions.VerifyMismatchError:
-            raise DatabaseError
+            if replica.pool is None:
+                replica.pool = await self.create_pool(replica.uri, self.pool_options)
+
+            async with replica.pool.acquire() as conn:
+                lag = await self.fetchval('get_replica_lag', conn=conn)
+        except REPLICA_ERRORS:
+            if replica.healthy:
+                logging.exception('Replica is down, reads will go to the primary.')
+
+            replica.healthy = False
+            replica.lag = None
+            return
+
+        healthy = lag <= self.max_replica_lag
+
+        if healthy != replica.healthy:
+            state = 'caught up' if healthy else f'lagging by {lag:.2f}s'
+            logging.info(f'Replica is {state}.')
+
+        replica.healthy = healthy
+        replica.lag = lag
+
+    async def check_replicas(self):
+        await asyncio.gather(*map(self.check_replica, self.replicas))
+
+    async def monitor_replicas(self):
+        while True:
+            await asyncio.sleep(self.REPLICA_CHECK_INTERVAL)
+            await self.check_replicas()
+
+            # writes older than the window are visible on every replica in use
+            deadline = time.monotonic() - self.write_window
+            self.last_writes = {
+                user_id: written_at
+                for user_id, written_at in self.last_writes.items()
+                if written_at > deadline
+            }
+
+    def get_pool_stats(self) -> dict[str, Any]:
+        return {
+            'size': self.pool.get_size(),
+            'idle': self.pool.get_idle_size(),
+            'min_size': self.pool.get_min_size(),
+            'max_size': self.pool.get_max_size(),
+            **self.pool_stats.stats(),
+            'replicas': [replica.stats() for replica in self.replicas],
+        }
+
+    async def run(
+        self,
+        method: str,
+        name: str,
+        args: tuple[Any, ...],
+        conn: Connection | None,
+        *,
+        readonly: bool = False,
+        user_id: str | None = None,
+    ):
+        """Runs a statement from the query registry, on `conn` or a pooled connection."""
+
+        if conn is None:
+            async with self.acquire(readonly=readonly, user_id=user_id) as conn:
+                return await self.run(method, name, args, conn)
+
+        started_at = time.perf_counter()
 
-        if self.hasher.check_needs_rehash(record['hashed_password']):
-            await self.rehash_password(record['id'], password)
+        try:
+            return await getattr(conn, method)(QUERIES[name], *args)
+        finally:
+            self.query_stats[name].record(time.perf_counter() - started_at)
+
+    async def fetch(
+        self,
+        name: str,
+        *args: Any,
+        conn: Connection | None = None,
+        readonly: bool = False,
+        user_id: str | None = None,
+    ) -> list[asyncpg.Record]:
+        return await self.run('fetch', name, args, conn, readonly=readonly, user_id=user_id)
+
+    async def fetchrow(
+        self,
+        name: str,
+        *args: Any,
+        conn: Connection | None = None,
+        readonly: bool = False,
+        user_id: str | None = None,
+    ) -> asyncpg.Record | None:
+        return await self.run('fetchrow', name, args, conn, readonly=readonly, user_id=user_id)
+
+    async def fetchval(
+        self,
+        name: str,
+        *args: Any,
+        conn: Connection | None = None,
+        readonly: bool = False,
+        user_id: str | None = None,
+    ) -> Any:
+        return await self.run('fetchval', name, args, conn, readonly=readonly, user_id=user_id)
+
+    async def execute(self, name: str, *args: Any, conn: Connection | None = None):
+        await self.run('execute', name, args, conn)
+
+    def get_query_stats(self) -> dict[str, dict[str, Any]]:
+        """Gets call counts and timings for each statement, most total time first."""
+
+        stats = sorted(self.query_stats.items(), key=lambda item: -item[1].total_time)
+
+        return {
+            name: {
+                'calls': query.calls,
+                'total_ms': round(query.total_time * 1000, 3),
+                'mean_ms': round(query.total_time * 1000 / query.calls, 3),
+            }
+            for name, query in stats
+            if query.calls
+        }
+
+    async def listen(
+        self,
+        channel: str,
+        callback: Notification,
+        *,
+        on_reconnect: Callable[[], None] | None = None,
+    ):
+        """Calls a callback with every notification sent on a channel.
+
+        Listeners share one connection outside the pool, which is reopened if it is lost.
+        Notifications sent while it is down are gone, so `on_reconnect` is called once it
+        is back for listeners that need to catch up.
+        """
+
+        self._listeners.setdefault(channel, []).append(callback)
+
+        if on_reconnect is not None:
+            self._reconnect_callbacks.append(on_reconnect)
+
+        if self._listener is None and self._listener_task is None:
+            await self._connect_listener()
+        elif self._listener is not None:
+            await self._listener.add_listener(channel, callback)
+
+    async def unlisten(self, channel: str, callback: Notification):
+        callbacks = self._listeners.get(channel, [])
+
+        if callback in callbacks:
+            callbacks.remove(callback)
+
+        if self._listener is not None:
+            await self._listener.remove_listener(channel, callback)
+
+    async def _connect_listener(self):
+        connection: asyncpg.Connection = await asyncpg.connect(self.uri)
+        connection.add_termination_listener(self._on_listener_lost)
+
+        for channel, callbacks in self._listeners.items():
+            for callback in callbacks:
+                await connection.add_listener(channel, callback)
+
+        self._listener = connection
+
+    def _on_listener_lost(self, connection: asyncpg.Connection):
+        if connection is not self._listener:
+            return
+
+        self._listener = None
+        logging.warning('Lost the listener connection, notifications will be missed for now.')
+        self._listener_task = asyncio.create_task(self._reconnect_listener())
+
+    async def _reconnect_listener(self):
+        while True:
+            try:
+                await self._connect_listener()
+            except Exception:
+                delay = self.LISTENER_RECONNECT_DELAY
+                logging.exception(f'Failed to reconnect the listener, retrying in {delay}s.')
+                await asyncio.sleep(delay)
+            else:
+                break
+
+        logging.info('Reconnected the listener.')
+        self._listener_task = None
+
+        for callback in self._reconnect_callbacks:
+            try:
+                callback()
+            except Exception:
+                logging.exception('Listener reconnect callback failed.')
 
-        return record
+    async def close_replicas(self):
+        if self._replica_task is not None:
+            self._replica_task.cancel()
+            self._replica_task = None
 
-    async def get_room(self, room_id: str, *, with_last_message: bool = False) -> dict[str, Any]:
-        if with_last_message:
-            query = """SELECT id, name, description, owner_id, type, last_message.*
-                       FROM rooms
-                       LEFT JOIN (
-                            SELECT messages.id as message_id, content as message_content,
-                                room_id as message_room_id,
-                                users.name as message_author_name,
-                                author_id as message_author_id,
-                                users.username as message_author_username
-                            FROM messages
-                            INNER JOIN users ON users.id = author_id
-                            ORDER BY messages.created_at DESC
-                            LIMIT 1
-                       ) last_message ON last_message.message_room_id = rooms.id
-                       WHERE id=$1;
-                    """
-        else:
-            query = """SELECT id, name, description, owner_id, type
-                       FROM rooms
-                       WHERE id=$1;
-                    """
+        for replica in self.replicas:
+            if replica.pool is not None:
+                pool, replica.pool = replica.pool, None
+                replica.healthy = False
+                await pool.close()
 
-        async with self.acquire() as conn:
-            record = await conn.fetchrow(query, room_id)
+    async def close_listener(self):
+        if self._listener_task is not None:
+            self._listener_task.cancel()
+            self._listener_task = None
 
-        if not record:
-            raise DatabaseError
+        if self._listener is not None:
+            connection, self._listener = self._listener, None
+            await connection.close()
 
-        return record
+    async def close(self):
+        """Closes every connection and the password hashing threads."""
 
-    async def get_link(self, link_id: str) -> dict[str, Any]:
-        query = """SELECT id, type, entity_id, uses, public, user_id,
-                          max_uses, expires_at, created_at
-                   FROM links
-                   WHERE id=$1;
-                """
+        await self.close_listener()
+        await self.close_replicas()
+        await self.pool.close()
+        self.hasher.close()
 
-        async with self.acquire() as conn:
-            record = await conn.fetchrow(query, link_id)
+    async def stream(
+        self, name: str, *args: Any, batch_size: int = 5000
+    ) -> AsyncIterator[list[asyncpg.Record]]:
+        """Yields the results of a statement in batches read from a server-side cursor."""
 
-        if not record:
-            raise DatabaseError
+        started_at = time.perf_counter()
+
+        try:
+            async with self.acquire() as conn:
+                async with conn.transaction(readonly=True):
+                    cursor = await conn.cursor(QUERIES[name], *args)
 
-        async def delete_link():
-            await conn.execute('DELETE FROM links WHERE id=$1', link_id)
+                    while records := await cursor.fetch(batch_size):
+                        yield records
+        finally:
+            self.query_stats[name].record(time.perf_counter() - started_at)
+
+    async def create_account(
+        self, username: str | None, name: str, password: str, email: str, id: str
+    ) -> dict[str, Any]:
+        hashed_pw = await self.hasher.hash(password)
+        permission_level = (
+            PermissionLevel.user if self.setup_completed else PermissionLevel.admin
+        ).value
 
-        if record['expires_at'] and record['expires_at'] < datetime.datetime.utcnow():
-            await delete_link()
+        try:
+            await self.execute(
+                'create_user', id, username, name, hashed_pw, email, permission_level
+            )
+        except asyncpg.UniqueViolationError:
+            raise DatabaseError('That username is already taken.')
+
+        return {'id': id, 'username': username, 'name': name, 'email': email}
+
+    async def rehash_password(self, id: str, password: str):
+        hashed_password = await self.hasher.hash(password)
+
+        await self.execute('set_password', hashed_password, id)
+
+    async def get_account(self, email: str, password: str) -> asyncpg.Record:
+        record = await self.fetchrow('get_account', email)
+
+        if not record:
             raise DatabaseError
 
-        if record['max_uses'] and record['uses'] >= record['max_uses']:
-            await delete_link()
+        if not await self.hasher.verify(record['hashed_password'], password):
             raise DatabaseError
 
+        if self.hasher.check_needs_rehash(record['hashed_password']):
+            await self.rehash_password(record['id'], password)
+
         return record
 
-    async def get_relationship(self, user_id: str, recipient_id: str) -> dict[str, Any]:
-        query = """SELECT type, user_id, recipient_id, created_at
-                   FROM relationships
-                   WHERE user_id=$1 AND recipient_id=$2;
-                   """
+    async def get_user(self, user_id: str) -> asyncpg.Record | None:
+        return await self.fetchrow('get_user', user_id)
 
-        async with self.acquire() as conn:
-            record = await conn.fetchrow(query, user_id, recipient_id)
+    async def get_users(self, user_ids: list[str]) -> list[asyncpg.Record]:
+        return await self.fetch('get_users', user_ids)
+
+    async def get_room(
+        self,
+        room_id: str,
+        *,
+        with_last_message: bool = False,
+        readonly: bool = False,
+        user_id: str | None = None,
+    ) -> asyncpg.Record:
+        name = 'get_room_with_last_message' if with_last_message else 'get_room'
+        record = await self.fetchrow(name, room_id, readonly=readonly, user_id=user_id)
 
         if not record:
             raise DatabaseError
 
         return record
+
+    async def get_link(
+        self, link_id: str, *, readonly: bool = False, user_id: str | None = None
+    ) -> asyncpg.Record | None:
+        # expired and used up links are deleted by the application's link sweeper
+        return await self.fetchrow('get_link', link_id, readonly=readonly, user_id=user_id)
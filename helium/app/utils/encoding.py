@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+import dataclasses
+from typing import Any, Protocol
+
+import orjson
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+
+class Encoding(Protocol):
+    """How messages sent over the websocket gateway are encoded.
+
+    Dispatch frames are built from a prefix that is encoded once per event and a suffix
+    holding the per-connection increment, so an event can be shared between connections
+    without being encoded again.
+    """
+
+    name: str
+    binary: bool
+
+    @staticmethod
+    def dumps(obj: Any, /) -> bytes:
+        ...
+
+    @staticmethod
+    def loads(data: str | bytes, /) -> Any:
+        ...
+
+    @staticmethod
+    def dispatch_prefix(opcode: int, event_name: str, data: dict[str, Any]) -> bytes:
+        ...
+
+    @staticmethod
+    def dispatch_frame(prefix: bytes, increment: int) -> bytes:
+        ...
+
+    @staticmethod
+    def batch(opcode: int, frames: list[bytes]) -> bytes:
+        ...
+
+
+class JSONEncoding:
+    name = 'json'
+    binary = False
+
+    dumps = staticmethod(orjson.dumps)
+    loads = staticmethod(orjson.loads)
+
+    @staticmethod
+    def dispatch_prefix(opcode: int, event_name: str, data: dict[str, Any]) -> bytes:
+        return b''.join(
+            (
+                b'{"opcode":"%d","event_name":' % opcode,
+                orjson.dumps(event_name),
+                b',"data":',
+                orjson.dumps(data),
+                b',"increment":',
+            )
+        )
+
+    @staticmethod
+    def dispatch_frame(prefix: bytes, increment: int) -> bytes:
+        return b'%b%d}' % (prefix, increment)
+
+    @staticmethod
+    def batch(opcode: int, frames: list[bytes]) -> bytes:
+        return b'{"opcode":"%d","data":[%b]}' % (opcode, b','.join(frames))
+
+
+def _msgpack_default(obj: Any) -> Any:
+    # cached users are slotted dataclasses, which msgpack doesn't know about
+    if dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+        return {field.name: getattr(obj, field.name) for field in dataclasses.fields(obj)}
+
+    raise TypeError(f'Object of type {type(obj).__name__} is not msgpack serializable')
+
+
+class MsgpackEncoding:
+    name = 'msgpack'
+    binary = True
+
+    @staticmethod
+    def dumps(obj: Any) -> bytes:
+        return msgpack.packb(obj, default=_msgpack_default)  # type: ignore
+
+    @staticmethod
+    def loads(data: str | bytes) -> Any:
+        return msgpack.unpackb(data)  # type: ignore
+
+    @staticmethod
+    def dispatch_prefix(opcode: int, event_name: str, data: dict[str, Any]) -> bytes:
+        # a msgpack map is a header followed by its keys and values, so the increment
+        # can be appended to the end as the final value
+        dumps = MsgpackEncoding.dumps
+        return b''.join(
+            (
+                b'\x84',  # fixmap with 4 entries
+                dumps('opcode'),
+                dumps(str(opcode)),
+                dumps('event_name'),
+                dumps(event_name),
+                dumps('data'),
+                dumps(data),
+                dumps('increment'),
+            )
+        )
+
+    @staticmethod
+    def dispatch_frame(prefix: bytes, increment: int) -> bytes:
+        return prefix + msgpack.packb(increment)  # type: ignore
+
+    @staticmethod
+    def batch(opcode: int, frames: list[bytes]) -> bytes:
+        dumps = MsgpackEncoding.dumps
+        return b''.join(
+            (
+                b'\x82',  # fixmap with 2 entries
+                dumps('opcode'),
+                dumps(str(opcode)),
+                dumps('data'),
+                msgpack.Packer().pack_array_header(len(frames)),  # type: ignore
+                *frames,
+            )
+        )
+
+
+ENCODINGS: dict[str, Encoding] = {'json': JSONEncoding()}
+
+if msgpack is not None:
+    ENCODINGS['msgpack'] = MsgpackEncoding()
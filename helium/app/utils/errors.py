@@ -36,6 +36,11 @@ class InvalidMethod(JsonError):
         super().__init__(status_code, message)
 
 
+class ServiceUnavailable(JsonError):
+    def __init__(self, status_code: int = 503, message: str = 'Service Unavailable') -> None:
+        super().__init__(status_code, message)
+
+
 err = tuple[int, str]
 
 
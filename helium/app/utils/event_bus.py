@@ -0,0 +1,226 @@
+from __future__ import annotations
+
+import abc
+import asyncio
+import itertools
+import logging
+import secrets
+from typing import TYPE_CHECKING, Any, Callable, NamedTuple
+
+import orjson
+
+if TYPE_CHECKING:
+    from .database import Database
+
+
+class BusEvent(NamedTuple):
+    """An event published on the event bus.
+
+    Room events only carry the room id, and every process resolves the members it holds
+    connections for itself, so an event is published once no matter how big the room is.
+    """
+
+    name: str
+    data: dict[str, Any]
+    room_id: str | None = None
+    user_id: str | None = None
+    ephemeral: bool = False
+
+
+class EventBus(abc.ABC):
+    """Carries dispatched events between helium processes.
+
+    A process delivers the events it publishes to its own connections directly, so
+    subscribers are only called with events published by other processes.
+    """
+
+    def __init__(self, callback: Callable[[BusEvent], None]):
+        self.callback = callback
+        # identifies the events this process published
+        self.origin = secrets.token_hex(8)
+        # numbers each published event, Postgres drops identical notifications otherwise
+        self._sequence = itertools.count()
+
+    @abc.abstractmethod
+    async def start(self):
+        ...
+
+    @abc.abstractmethod
+    async def close(self):
+        ...
+
+    @abc.abstractmethod
+    def publish(self, event: BusEvent):
+        ...
+
+    def encode(self, event: BusEvent) -> bytes:
+        # orjson doesn't serialize named tuples, so the event is sent as a plain array
+        message = {'origin': self.origin, 'sequence': next(self._sequence), 'event': tuple(event)}
+        return orjson.dumps(message)
+
+    def receive(self, message: dict[str, Any]):
+        """Passes a decoded message to the callback, unless this process published it."""
+
+        if message['origin'] == self.origin:
+            return
+
+        try:
+            self.callback(BusEvent(*message['event']))
+        except Exception:
+            logging.exception('Failed to deliver event from the event bus.')
+
+
+class LocalEventBus(EventBus):
+    """An event bus that doesn't leave the process.
+
+    Buses on the same channel receive each other's events, which is enough for a single
+    worker and lets tests stand up several "processes" side by side.
+    """
+
+    _channels: dict[str, list[LocalEventBus]] = {}
+
+    def __init__(self, callback: Callable[[BusEvent], None], *, channel: str = 'helium_events'):
+        super().__init__(callback)
+        self.channel = channel
+
+    async def start(self):
+        self._channels.setdefault(self.channel, []).append(self)
+
+    async def close(self):
+        buses = self._channels.get(self.channel, [])
+
+        if self in buses:
+            buses.remove(self)
+
+    def publish(self, event: BusEvent):
+        buses = self._channels.get(self.channel)
+
+        if not buses or buses == [self]:
+            return
+
+        payload = self.encode(event)
+        loop = asyncio.get_running_loop()
+
+        for bus in buses:
+            if bus is not self:
+                loop.call_soon(bus.receive, orjson.loads(payload))
+
+
+class PostgresEventBus(EventBus):
+    """An event bus backed by Postgres LISTEN/NOTIFY.
+
+    Notifications arrive on the database's listener connection. Published events are
+    queued and sent in order by a single task, with everything queued since the last
+    send going out in one round trip. NOTIFY payloads are limited to 8000 bytes, so
+    larger events are stored in the event_payloads table and only their id is sent;
+    stored payloads are deleted once they are older than `payload_ttl` seconds.
+    """
+
+    MAX_NOTIFY_SIZE = 7900  # leaves room for the reference wrapper under the 8000 byte limit
+
+    def __init__(
+        self,
+        callback: Callable[[BusEvent], None],
+        database: Database,
+        *,
+        channel: str = 'helium_events',
+        payload_ttl: float = 60,
+    ):
+        super().__init__(callback)
+        self.database = database
+        self.channel = channel
+        self.payload_ttl = payload_ttl
+
+        self._outgoing: asyncio.Queue[bytes] = asyncio.Queue()
+        # notifications are handled in order, even while a referenced payload is fetched
+        self._incoming: asyncio.Queue[str] = asyncio.Queue()
+        self._tasks: list[asyncio.Task] = []
+
+    async def start(self):
+        await self.database.listen(
+            self.channel, self.on_notification, on_reconnect=self.on_reconnect
+        )
+
+        self._tasks = [
+            asyncio.create_task(self.send_events()),
+            asyncio.create_task(self.receive_events()),
+            asyncio.create_task(self.prune_payloads()),
+        ]
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+
+        self._tasks = []
+        await self.database.unlisten(self.channel, self.on_notification)
+
+    def on_notification(self, connection: Any, pid: int, channel: str, payload: str):
+        self._incoming.put_nowait(payload)
+
+    def on_reconnect(self):
+        logging.warning('Event bus events sent while the listener was down were missed.')
+
+    def publish(self, event: BusEvent):
+        self._outgoing.put_nowait(self.encode(event))
+
+    async def send_events(self):
+        while True:
+            payloads = [await self._outgoing.get()]
+
+            while not self._outgoing.empty():
+                payloads.append(self._outgoing.get_nowait())
+
+            try:
+                await self.notify(payloads)
+            except Exception:
+                logging.exception(f'Failed to publish {len(payloads)} events.')
+
+    async def notify(self, payloads: list[bytes]):
+        messages = [payload.decode() for payload in payloads]
+
+        database = self.database
+
+        async with database.acquire() as conn:
+            for i, message in enumerate(messages):
+                if len(payloads[i]) > self.MAX_NOTIFY_SIZE:
+                    payload_id = await database.fetchval('create_event_payload', message, conn=conn)
+                    reference = {'origin': self.origin, 'payload_id': payload_id}
+                    messages[i] = orjson.dumps(reference).decode()
+
+            # notifications sent in one statement are delivered in order
+            await database.execute('notify_events', self.channel, messages, conn=conn)
+
+    async def receive_events(self):
+        while True:
+            payload = await self._incoming.get()
+
+            try:
+                message = orjson.loads(payload)
+
+                if message['origin'] == self.origin:
+                    continue
+
+                if 'payload_id' in message:
+                    payload = await self.database.fetchval(
+                        'get_event_payload', message['payload_id']
+                    )
+
+                    if payload is None:
+                        logging.warning('Event payload was pruned before it was received.')
+                        continue
+
+                    message = orjson.loads(payload)
+
+                self.receive(message)
+            except Exception:
+                logging.exception('Failed to receive event from the event bus.')
+
+    async def prune_payloads(self):
+        while True:
+            await asyncio.sleep(self.payload_ttl)
+
+            try:
+                await self.database.execute('prune_event_payloads', float(self.payload_ttl))
+            except Exception:
+                logging.exception('Failed to prune event payloads.')
+
@@ -0,0 +1,64 @@
+from __future__ import annotations
+
+from collections import deque
+from typing import Generic, Protocol, TypeVar
+
+
+class QueuedEvent(Protocol):
+    @property
+    def ephemeral(self) -> bool:
+        ...
+
+
+E = TypeVar('E', bound=QueuedEvent)
+
+
+class EventQueue(Generic[E]):
+    """A bounded queue of events waiting to be sent to a connection.
+
+    When the queue is full, the oldest ephemeral event is dropped to make room. If there is
+    no ephemeral event to drop, an incoming ephemeral event is dropped instead, and any
+    other event is refused so the caller can deal with the slow consumer.
+    """
+
+    def __init__(self, maxsize: int = 0):
+        self.maxsize = maxsize
+        self.high_water: int = 0
+        self.dropped: int = 0
+
+        self._events: deque[E] = deque()
+
+    def __len__(self) -> int:
+        return len(self._events)
+
+    def empty(self) -> bool:
+        return not self._events
+
+    def full(self) -> bool:
+        return bool(self.maxsize) and len(self._events) >= self.maxsize
+
+    def _drop_oldest_ephemeral(self) -> bool:
+        for index, event in enumerate(self._events):
+            if event.ephemeral:
+                del self._events[index]
+                self.dropped += 1
+                return True
+
+        return False
+
+    def put(self, event: E) -> bool:
+        """Queues an event, returning False if the queue is full and it was refused."""
+
+        if self.full() and not self._drop_oldest_ephemeral():
+            if not event.ephemeral:
+                return False
+
+            self.dropped += 1
+            return True
+
+        self._events.append(event)
+        self.high_water = max(self.high_water, len(self._events))
+        return True
+
+    def get_nowait(self) -> E:
+        return self._events.popleft()
@@ -2,13 +2,14 @@ from __future__ import annotations
 
 import re
 import sys
-from typing import TYPE_CHECKING, Any, Generic, TypeVar, Union
+from typing import TYPE_CHECKING, Any, Awaitable, Generic, TypeVar, Union
 
 import orjson
 import tornado.log
 import tornado.web
 
-from app.utils.errors import InvalidMethod, JsonError
+from app.utils.errors import InvalidMethod, JsonError, NotFound
+from app.utils.validate import is_id
 
 from .database import Database
 
@@ -26,11 +27,14 @@ class RequestHandler(tornado.web.RequestHandler, Generic[GET_T, POST_T]):
 
     application: Application
     user_id: str
+    token: str
     body: dict[str, Any]
 
-    def __init_subclass__(cls, require_token: bool = True) -> None:
+    def __init_subclass__(cls, require_token: bool = True, path_ids: bool = True) -> None:
         super().__init_subclass__()
         cls.require_token = require_token  # type: ignore
+        # whether the arguments captured from the path are all ids
+        cls.path_ids = path_ids
 
     def initialize(self):
         self.user_id = None  # type: ignore
@@ -43,13 +47,19 @@ class RequestHandler(tornado.web.RequestHandler, Generic[GET_T, POST_T]):
     def tokens(self):
         return self.application.tokens
 
-    def write(self, chunk: Union[str, bytes, dict]) -> None:
-        if isinstance(chunk, dict):
+    def write(self, chunk: Union[str, bytes, dict, list]) -> None:
+        if isinstance(chunk, (dict, list)):
             self.set_header('Content-Type', 'application/json')
             chunk = orjson.dumps(chunk)
 
         return super().write(chunk)
 
+    def finish(self, chunk: Union[str, bytes, dict, list, None] = None) -> Awaitable[None]:
+        if chunk is not None:
+            self.write(chunk)
+
+        return super().finish()
+
     def write_error(self, status_code: int, **kwargs):
         try:
             reason: dict[str, Any] = {'code': kwargs.pop('code'), 'message': kwargs.pop('message')}
@@ -76,12 +86,18 @@ class RequestHandler(tornado.web.RequestHandler, Generic[GET_T, POST_T]):
                 self.send_error(401, code=0, message='Invalid Authorization header.')
                 return
 
+            self.token = match.groups()[0]
+
             try:
-                self.user_id = self.tokens.validate_token(match.groups()[0])
+                self.user_id = self.tokens.validate_token(self.token)
             except Exception:
                 self.write_error(401, code=0, message='Invalid token.')
                 return
 
+        # nothing can have an id that isn't one, and the database would reject it
+        if self.path_ids and not all(map(is_id, self.path_args)):
+            raise NotFound
+
     def set_default_headers(self):
         self.set_header('Access-Control-Allow-Origin', '*')
         self.set_header('Access-Control-Allow-Headers', '*')
@@ -93,6 +109,11 @@ class RequestHandler(tornado.web.RequestHandler, Generic[GET_T, POST_T]):
         self.set_status(204)
         self.finish()
 
+    def on_finish(self):
+        # keeps this user's reads on the primary until replicas have their write
+        if self.user_id and self.request.method not in ('GET', 'HEAD', 'OPTIONS'):
+            self.database.mark_write(self.user_id)
+
     def _unimplemented_method(self, *args, **kwargs):
         raise InvalidMethod
 
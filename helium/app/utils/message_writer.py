@@ -0,0 +1,145 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import TYPE_CHECKING, Any, NamedTuple
+
+if TYPE_CHECKING:
+    from .database import Connection, Database
+
+
+class PendingMessage(NamedTuple):
+    id: str
+    content: str | None
+    room_id: str
+    author_id: str
+    type: int
+
+
+class MessageWriter:
+    """Writes messages to the database in batches.
+
+    Messages sent by concurrent requests are collected for up to `max_delay` seconds, or
+    until `max_batch_size` are waiting, and then written together in one transaction,
+    so a busy room costs one round trip and one commit per batch rather than per
+    message. If a batch fails, its messages are retried one by one so only the messages
+    that can't be written fail.
+    """
+
+    COLUMNS = ('id', 'content', 'room_id', 'author_id', 'type')
+
+    def __init__(self, database: Database, *, max_batch_size: int = 100, max_delay: float = 0.005):
+        self.database = database
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+
+        self._pending: list[tuple[PendingMessage, asyncio.Future[None]]] = []
+        self._flush_handle: asyncio.TimerHandle | None = None
+        self._tasks: set[asyncio.Task] = set()
+
+        self.batches: int = 0
+        self.messages: int = 0
+        self.largest_batch: int = 0
+        self.failed_batches: int = 0
+
+    async def write(self, message: PendingMessage):
+        """Waits until a message has been written to the database."""
+
+        future: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        self._pending.append((message, future))
+
+        if len(self._pending) >= self.max_batch_size:
+            self.flush()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(self.max_delay, self.flush)
+
+        await future
+
+    def flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        if not self._pending:
+            return
+
+        batch, self._pending = self._pending, []
+
+        task = asyncio.create_task(self.write_batch(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def write_batch(self, batch: list[tuple[PendingMessage, asyncio.Future[None]]]):
+        messages = [message for message, _ in batch]
+
+        try:
+            async with self.database.acquire() as conn:
+                async with conn.transaction():
+                    await self.insert(conn, messages)
+        except Exception:
+            logging.exception(f'Failed to write a batch of {len(batch)} messages, retrying each.')
+            self.failed_batches += 1
+            await self.write_each(batch)
+            return
+
+        self.batches += 1
+        self.messages += len(batch)
+        self.largest_batch = max(self.largest_batch, len(batch))
+
+        for _, future in batch:
+            if not future.done():
+                future.set_result(None)
+
+    async def write_each(self, batch: list[tuple[PendingMessage, asyncio.Future[None]]]):
+        try:
+            async with self.database.acquire() as conn:
+                for message, future in batch:
+                    try:
+                        async with conn.transaction():
+                            await self.insert(conn, [message])
+                    except Exception as e:
+                        if not future.done():
+                            future.set_exception(e)
+                    else:
+                        self.messages += 1
+
+                        if not future.done():
+                            future.set_result(None)
+        except Exception as e:
+            # no connection to retry on, or it was lost, so the rest fail with it
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+    async def close(self):
+        """Writes the messages still waiting and waits for batches being written."""
+
+        self.flush()
+
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def insert(self, conn: Connection, messages: list[PendingMessage]):
+        await conn.copy_records_to_table('messages', records=messages, columns=self.COLUMNS)
+
+        # room id: newest message id in this batch
+        last_messages: dict[str, str] = {}
+
+        for message in messages:
+            current = last_messages.get(message.room_id)
+
+            if current is None or int(message.id) > int(current):
+                last_messages[message.room_id] = message.id
+
+        await self.database.execute(
+            'update_last_messages', list(last_messages), list(last_messages.values()), conn=conn
+        )
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            'batches': self.batches,
+            'messages': self.messages,
+            'largest_batch': self.largest_batch,
+            'failed_batches': self.failed_batches,
+            'pending': len(self._pending),
+        }
@@ -0,0 +1,76 @@
+from __future__ import annotations
+
+import logging
+import os
+import re
+from typing import NamedTuple
+
+import asyncpg
+
+MIGRATIONS_DIRECTORY = 'migrations'
+MIGRATION_FILENAME_REGEX = re.compile(r'(\d+)_(\w+)\.sql')
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    path: str
+
+
+class MigrationRequired(Exception):
+    def __init__(self, pending: list[Migration]):
+        self.pending = pending
+        names = ', '.join(f'{migration.version:04}_{migration.name}' for migration in pending)
+        super().__init__(
+            f'The database needs to be migrated ({names}). Run `python -m app db migrate`.'
+        )
+
+
+def load_migrations(directory: str = MIGRATIONS_DIRECTORY) -> list[Migration]:
+    """Finds the migrations in a directory, named like `0001_name.sql`, ordered by version."""
+
+    migrations: list[Migration] = []
+
+    for filename in os.listdir(directory):
+        match = MIGRATION_FILENAME_REGEX.fullmatch(filename)
+
+        if match:
+            version, name = match.groups()
+            migrations.append(Migration(int(version), name, os.path.join(directory, filename)))
+
+    migrations.sort()
+    return migrations
+
+
+async def create_migrations_table(connection: asyncpg.Connection):
+    await connection.execute(
+        """CREATE TABLE IF NOT EXISTS schema_migrations (
+               version INT PRIMARY KEY,
+               name TEXT NOT NULL,
+               applied_at TIMESTAMP DEFAULT (now() at time zone 'utc')
+           );
+        """
+    )
+
+
+async def get_pending(connection: asyncpg.Connection) -> list[Migration]:
+    records = await connection.fetch('SELECT version FROM schema_migrations;')
+    applied = {record[0] for record in records}
+    return [migration for migration in load_migrations() if migration.version not in applied]
+
+
+async def apply(connection: asyncpg.Connection, migration: Migration):
+    """Applies a migration in a transaction of its own, recording that it was applied."""
+
+    with open(migration.path, 'r') as f:
+        sql = f.read()
+
+    logging.info(f'Applying migration {migration.version:04}_{migration.name}...')
+
+    async with connection.transaction():
+        await connection.execute(sql)
+        await connection.execute(
+            'INSERT INTO schema_migrations (version, name) VALUES ($1, $2);',
+            migration.version,
+            migration.name,
+        )
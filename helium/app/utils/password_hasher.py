@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import asyncio
+import concurrent.futures
+import functools
+import logging
+import time
+from typing import Any, Callable, TypeVar
+
+import argon2
+
+from .errors import ServiceUnavailable
+
+T = TypeVar('T')
+
+
+class PasswordHasher:
+    """Hashes and verifies passwords with argon2 on a pool of threads.
+
+    Each hash takes tens of milliseconds of CPU, which would stall every request and
+    websocket on the process if it ran on the event loop. argon2 releases the GIL while
+    hashing, so the threads run in parallel with the loop and each other.
+
+    At most `threads` hashes run at once. Calls beyond that queue up, and once
+    `max_queue` are waiting further calls fail with ServiceUnavailable, so a login storm
+    is turned away instead of piling up behind itself.
+    """
+
+    def __init__(self, *, threads: int = 2, max_queue: int = 100, **parameters: Any):
+        self.hasher = argon2.PasswordHasher(**parameters)
+        self.max_queue = max_queue
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=threads, thread_name_prefix='password-hasher'
+        )
+        self._semaphore = asyncio.Semaphore(threads)
+        self.threads = threads
+
+        self.queued: int = 0
+        self.running: int = 0
+        self.max_queued: int = 0
+        self.rejected: int = 0
+        self.hashes: int = 0
+        self.verifications: int = 0
+        self.total_wait: float = 0
+        self.total_time: float = 0
+
+    async def run(self, function: Callable[..., T], *args: Any) -> T:
+        if self.max_queue and self.queued >= self.max_queue:
+            self.rejected += 1
+            logging.warning('Too many passwords are waiting to be hashed, turning one away.')
+            raise ServiceUnavailable
+
+        queued_at = time.perf_counter()
+        self.queued += 1
+        self.max_queued = max(self.max_queued, self.queued)
+
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.queued -= 1
+
+        started_at = time.perf_counter()
+        self.total_wait += started_at - queued_at
+        self.running += 1
+
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, functools.partial(function, *args))
+        finally:
+            self.running -= 1
+            self.total_time += time.perf_counter() - started_at
+            self._semaphore.release()
+
+    async def hash(self, password: str) -> str:
+        hashed_password = await self.run(self.hasher.hash, password)
+        self.hashes += 1
+        return hashed_password
+
+    async def verify(self, hashed_password: str, password: str) -> bool:
+        """Returns whether a password matches, raising on malformed hashes."""
+
+        try:
+            await self.run(self.hasher.verify, hashed_password, password)
+        except argon2.exceptions.VerifyMismatchError:
+            matches = False
+        else:
+            matches = True
+
+        # runs turned away with ServiceUnavailable or failing on a malformed hash don't count
+        self.verifications += 1
+        return matches
+
+    def check_needs_rehash(self, hashed_password: str) -> bool:
+        # only parses the hash, cheap enough for the loop
+        return self.hasher.check_needs_rehash(hashed_password)
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict[str, Any]:
+        completed = self.hashes + self.verifications
+
+        return {
+            'threads': self.threads,
+            'queued': self.queued,
+            'running': self.running,
+            'max_queued': self.max_queued,
+            'rejected': self.rejected,
+            'hashes': self.hashes,
+            'verifications': self.verifications,
+            'avg_wait_ms': round(self.total_wait / completed * 1000, 3) if completed else 0,
+            'avg_time_ms': round(self.total_time / completed * 1000, 3) if completed else 0,
+        }
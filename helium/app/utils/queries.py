@@ -0,0 +1,163 @@
+from __future__ import annotations
+
+# Every statement the server runs against the database, by name. Each one is prepared
+# once per pooled connection, the first time the connection runs it, and Database keeps
+# call counts and timings for each name.
+#
+# Schema setup, the advisory lock around it and other one-off statements are not here.
+
+QUERIES: dict[str, str] = {
+    # users
+    'create_user': """INSERT INTO users
+                          (id, username, name, hashed_password, email, permission_level)
+                      VALUES ($1, $2, $3, $4, $5, $6);
+                   """,
+    'set_password': """UPDATE users
+                       SET hashed_password=$1
+                       WHERE id=$2;
+                    """,
+    'get_account': """SELECT id, username, name, hashed_password
+                      FROM users
+                      WHERE email=$1;
+                   """,
+    'email_exists': 'SELECT 1 FROM users WHERE email=$1;',
+    'any_user_exists': 'SELECT 1 FROM users LIMIT 1;',
+    'get_user': """SELECT id, username, name
+                   FROM users
+                   WHERE id=$1;
+                """,
+    'get_users': """SELECT id, username, name
+                    FROM users
+                    WHERE id = ANY($1::bigint[]);
+                 """,
+    'revoke_token': """INSERT INTO revoked_tokens (token_hash, user_id)
+                       VALUES ($1, $2)
+                       ON CONFLICT DO NOTHING;
+                    """,
+    'get_all_revoked_tokens': 'SELECT token_hash FROM revoked_tokens;',
+    'delete_expired_revocations': """DELETE FROM revoked_tokens
+                                     WHERE revoked_at < utc_now() - make_interval(secs => $1);
+                                  """,
+    'get_permission_level': 'SELECT permission_level FROM users WHERE id=$1;',
+    'get_all_users': 'SELECT id, username, name FROM users;',
+    # rooms
+    'create_room': """INSERT INTO rooms (id, name, description, owner_id, type)
+                      VALUES ($1, $2, $3, $4, $5);
+                   """,
+    'add_room_member': """INSERT INTO room_members (user_id, room_id, permission_level)
+                          VALUES ($1, $2, $3);
+                       """,
+    'get_room': """SELECT id, name, description, owner_id, type
+                   FROM rooms
+                   WHERE id=$1;
+                """,
+    'get_room_with_last_message': """SELECT rooms.id, name, description, owner_id, rooms.type,
+                                            messages.id AS message_id,
+                                            messages.content AS message_content,
+                                            messages.author_id AS message_author_id
+                                     FROM rooms
+                                     LEFT JOIN room_last_messages
+                                         ON room_last_messages.room_id = rooms.id
+                                     LEFT JOIN messages
+                                         ON messages.id = room_last_messages.message_id
+                                     WHERE rooms.id=$1;
+                                  """,
+    # room_last_messages holds one row per room, so this is a plain join per room
+    'get_user_rooms': """SELECT rooms.id, name, description, owner_id, rooms.type,
+                                permission_level,
+                                messages.id AS message_id, messages.content AS message_content,
+                                messages.author_id AS message_author_id
+                         FROM room_members
+                         INNER JOIN rooms ON rooms.id = room_members.room_id
+                         LEFT JOIN room_last_messages ON room_last_messages.room_id = rooms.id
+                         LEFT JOIN messages ON messages.id = room_last_messages.message_id
+                         WHERE room_members.user_id = $1;
+                      """,
+    'get_all_room_members': 'SELECT user_id, room_id, permission_level FROM room_members;',
+    # messages, paged by seeking the (room_id, id) index from a known id
+    'get_messages_before': """SELECT id, content, author_id, type
+                              FROM messages
+                              WHERE room_id=$1 AND id < $2
+                              ORDER BY id DESC
+                              LIMIT $3;
+                           """,
+    'get_messages_after': """SELECT id, content, author_id, type
+                             FROM messages
+                             WHERE room_id=$1 AND id > $2
+                             ORDER BY id ASC
+                             LIMIT $3;
+                          """,
+    'get_latest_messages': """SELECT id, content, author_id, type
+                              FROM messages
+                              WHERE room_id=$1
+                              ORDER BY id DESC
+                              LIMIT $2;
+                           """,
+    'get_last_message_id': 'SELECT max(id) FROM messages;',
+    'get_message': """SELECT id, content, author_id, type
+                      FROM messages
+                      WHERE room_id=$1 AND id=$2;
+                   """,
+    'update_last_messages': """INSERT INTO room_last_messages (room_id, message_id)
+                               SELECT * FROM unnest($1::bigint[], $2::bigint[])
+                               ON CONFLICT (room_id) DO UPDATE
+                               SET message_id = EXCLUDED.message_id
+                               WHERE room_last_messages.message_id < EXCLUDED.message_id;
+                            """,
+    # links
+    'link_exists': 'SELECT 1 FROM links WHERE id=$1;',
+    'create_link': """INSERT INTO links (id, type, entity_id, user_id, expires_at, max_uses)
+                      VALUES ($1, $2, $3, $4, $5, $6);
+                   """,
+    'get_link': """SELECT id, type, entity_id, uses, public, user_id,
+                          max_uses, expires_at, created_at
+                   FROM links
+                   WHERE id=$1;
+                """,
+    # only uses a link that is still usable, nothing is returned otherwise
+    'use_link': """UPDATE links
+                   SET uses = uses + 1
+                   WHERE id=$1
+                       AND (max_uses = 0 OR uses < max_uses)
+                       AND (expires_at IS NULL OR expires_at > utc_now())
+                   RETURNING uses, max_uses;
+                """,
+    'delete_link': 'DELETE FROM links WHERE id=$1;',
+    # a batch at a time through links_expires_at_idx and links_limited_idx, skipping links
+    # being used right now. links that expired or ran out of uses, see link_is_usable
+    'delete_unusable_links': """DELETE FROM links
+                                WHERE id IN (
+                                    SELECT id FROM links
+                                    WHERE expires_at < utc_now()
+                                       OR (max_uses > 0 AND uses >= max_uses)
+                                    LIMIT $1
+                                    FOR UPDATE SKIP LOCKED
+                                )
+                                RETURNING id;
+                             """,
+    # relationships
+    'create_relationship': """INSERT INTO relationships (type, user_id, recipient_id)
+                              VALUES ($1, $2, $3);
+                           """,
+    'delete_relationship': """DELETE FROM relationships
+                              WHERE user_id=$1 AND recipient_id=$2
+                              RETURNING type;
+                           """,
+    'get_all_relationships': 'SELECT type, user_id, recipient_id FROM relationships;',
+    # a marker after every change committed so far, see CacheMaintainer.sync
+    'notify': 'SELECT pg_notify($1, $2);',
+    # replicas, 0 when every received change has been replayed
+    'get_replica_lag': """SELECT (CASE
+                               WHEN NOT pg_is_in_recovery() THEN 0
+                               WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                               ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+                           END)::float8;
+                        """,
+    # event bus
+    'notify_events': 'SELECT pg_notify($1, unnest($2::text[]));',
+    'create_event_payload': 'INSERT INTO event_payloads (payload) VALUES ($1) RETURNING id;',
+    'get_event_payload': 'SELECT payload FROM event_payloads WHERE id=$1;',
+    'prune_event_payloads': """DELETE FROM event_payloads
+                               WHERE created_at < utc_now() - make_interval(secs => $1);
+                            """,
+}
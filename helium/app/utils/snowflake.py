@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+import logging
+import time
+
+
+class SnowflakeGenerator:
+    """Creates unique ids that sort by the time they were created.
+
+    An id is 63 bits: 41 bits of milliseconds since the epoch, then a 5 bit worker id
+    (one per machine), a 5 bit process id (one per pre-forked worker process) and a 12
+    bit sequence counting the ids created in the same millisecond. Ids from different
+    processes can't collide as long as each has its own worker and process id.
+
+    41 bits of milliseconds last about 69.7 years from the epoch, after which ids no longer
+    fit in a signed 64 bit integer. With the default epoch of 1609459200 (in milliseconds,
+    so early 1970) that is September 2039. A later epoch would make new ids sort before
+    the ones created so far, so moving it needs the existing ids rewritten.
+
+    When a millisecond's sequence runs out, or the system clock goes backwards, ids carry
+    on from the last timestamp used, borrowing the next millisecond when needed, so they
+    never wait on or go backwards with the clock. The clock catches up with a borrowed
+    millisecond as soon as it ticks.
+    """
+
+    WORKER_ID_BITS = 5
+    PROCESS_ID_BITS = 5
+    SEQUENCE_BITS = 12
+
+    MAX_WORKER_ID = (1 << WORKER_ID_BITS) - 1
+    MAX_PROCESS_ID = (1 << PROCESS_ID_BITS) - 1
+    MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+
+    PROCESS_ID_SHIFT = SEQUENCE_BITS
+    WORKER_ID_SHIFT = SEQUENCE_BITS + PROCESS_ID_BITS
+    TIMESTAMP_SHIFT = SEQUENCE_BITS + PROCESS_ID_BITS + WORKER_ID_BITS
+
+    def __init__(self, epoch_ms: int, *, worker_id: int = 0, process_id: int = 0):
+        if not 0 <= worker_id <= self.MAX_WORKER_ID:
+            raise ValueError(f'worker_id must be between 0 and {self.MAX_WORKER_ID}')
+
+        if not 0 <= process_id <= self.MAX_PROCESS_ID:
+            raise ValueError(f'process_id must be between 0 and {self.MAX_PROCESS_ID}')
+
+        self.epoch_ms = epoch_ms
+        self.worker_id = worker_id
+        self.process_id = process_id
+        self._node = (worker_id << self.WORKER_ID_SHIFT) | (process_id << self.PROCESS_ID_SHIFT)
+
+        self.last_timestamp: int = -1
+        self.sequence: int = 0
+        self._last_clock: int = -1  # the clock's last reading, to tell when it goes back
+        self._clock_behind = False
+
+        self.exhausted: int = 0  # times the sequence ran out and a millisecond was borrowed
+        self.clock_regressions: int = 0
+
+    @classmethod
+    def timestamp_of(cls, id: str) -> int:
+        """Gets the milliseconds since the epoch an id was created at."""
+
+        return int(id) >> cls.TIMESTAMP_SHIFT
+
+    def current_timestamp(self) -> int:
+        return int(time.time() * 1000) - self.epoch_ms
+
+    def next_timestamp(self) -> int:
+        """Reserves the next sequence number, returning the timestamp it belongs to."""
+
+        now = self.current_timestamp()
+
+        if now > self.last_timestamp:
+            self.last_timestamp = now
+            self.sequence = 0
+            self._last_clock = now
+            self._clock_behind = False
+            return now
+
+        # ids can run ahead of the clock after borrowing a millisecond, that isn't the clock
+        # going back
+        if now < self._last_clock and not self._clock_behind:
+            self.clock_regressions += 1
+            self._clock_behind = True
+            logging.warning(
+                f'System clock went back {self._last_clock - now}ms, '
+                'creating ids from the last timestamp used until it catches up.'
+            )
+
+        self._last_clock = now
+
+        if self.sequence < self.MAX_SEQUENCE:
+            self.sequence += 1
+            return self.last_timestamp
+
+        # waiting for the clock would block the event loop, borrow the next millisecond
+        # instead
+        self.exhausted += 1
+        self.last_timestamp += 1
+        self.sequence = 0
+        return self.last_timestamp
+
+    def create_id(self) -> str:
+        return str((self.next_timestamp() << self.TIMESTAMP_SHIFT) | self._node | self.sequence)
@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import Callable, Generic, Hashable, TypeVar
+
+T = TypeVar('T', bound=Hashable)
+
+
+class TimerWheel(Generic[T]):
+    """A hashed timer wheel that expires items in bulk.
+
+    Items are placed in the slot for the tick their deadline falls on, and a single task
+    sweeps one slot per tick. Pushing a deadline back only updates the stored deadline;
+    the item is moved to its new slot when the sweep reaches its old one, so refreshing
+    an item is O(1) no matter how many items there are.
+    """
+
+    def __init__(
+        self, callback: Callable[[list[T]], None], *, tick: float = 1, slots: int = 128
+    ):
+        self.callback = callback
+        self.tick = tick
+
+        self._slots: list[set[T]] = [set() for _ in range(slots)]
+        # item: deadline in time.monotonic() seconds
+        self._deadlines: dict[T, float] = {}
+        # item: index of the slot it is in
+        self._positions: dict[T, int] = {}
+        self._current_tick = int(time.monotonic() / tick)
+        self._task: asyncio.Task | None = None
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+    def __contains__(self, item: object) -> bool:
+        return item in self._deadlines
+
+    def _place(self, item: T, deadline: float):
+        # the slot after the deadline's tick, so the item has always expired once it is swept
+        index = (int(deadline / self.tick) + 1) % len(self._slots)
+        self._slots[index].add(item)
+        self._positions[item] = index
+
+    def schedule(self, item: T, deadline: float):
+        """Sets the time.monotonic() deadline an item expires at."""
+
+        position = self._positions.get(item)
+
+        if position is not None and deadline < self._deadlines[item]:
+            # moving a deadline earlier has to move the item right away
+            self._slots[position].discard(item)
+            position = None
+
+        self._deadlines[item] = deadline
+
+        if position is None:
+            self._place(item, deadline)
+
+    def remove(self, item: T):
+        position = self._positions.pop(item, None)
+
+        if position is not None:
+            self._slots[position].discard(item)
+            del self._deadlines[item]
+
+    def advance(self, now: float) -> list[T]:
+        """Sweeps every slot up to now and returns the items that expired."""
+
+        target = int(now / self.tick)
+        # after a long stall, one full turn of the wheel visits every slot
+        start = max(self._current_tick + 1, target - len(self._slots) + 1)
+        expired: list[T] = []
+
+        for tick in range(start, target + 1):
+            slot = self._slots[tick % len(self._slots)]
+
+            for item in list(slot):
+                deadline = self._deadlines[item]
+
+                if deadline <= now:
+                    slot.discard(item)
+                    del self._positions[item]
+                    del self._deadlines[item]
+                    expired.append(item)
+                elif int(deadline / self.tick) + 1 != tick:
+                    slot.discard(item)
+                    self._place(item, deadline)
+
+        self._current_tick = max(self._current_tick, target)
+        return expired
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.tick)
+
+            expired = self.advance(time.monotonic())
+
+            if expired:
+                try:
+                    self.callback(expired)
+                except Exception:
+                    logging.exception('Timer wheel callback failed.')
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
@@ -1,37 +1,134 @@
 from __future__ import annotations
 
 import base64
+import hashlib
+import hmac
 import secrets
 import string
 import time
+from typing import Any
 
 import itsdangerous
 
+from .snowflake import SnowflakeGenerator
+
+
+class InvalidToken(Exception):
+    pass
+
 
 class Tokens:
-    def __init__(self, epoch: int, secret: str, link_length: int):
+    """Creates ids, link ids and the tokens users authenticate with.
+
+    Tokens look like `<user id>.<issued at>.<signature>`, where the signature is a
+    truncated HMAC-SHA256 of the rest. Tokens in the older itsdangerous format are still
+    accepted.
+
+    Ids come from a SnowflakeGenerator. `epoch` is in milliseconds, as it was for the
+    ids created before it, so that new ids keep sorting after existing ones.
+
+    Tokens that have been verified are remembered for `cache_ttl` seconds, so checking a
+    token again is a dict lookup. Revoked tokens are tracked by their hash, which is
+    checked before a remembered token is accepted.
+
+    Tokens are valid for `max_age` seconds after they are issued, or forever if it is 0.
+    A revocation only has to outlive the token it revokes, so with a max age it can be
+    forgotten after `revocation_ttl` seconds.
+    """
+
+    SIGNATURE_SIZE = 16  # bytes of the HMAC kept in a token
+
+    def __init__(
+        self,
+        epoch: int,
+        secret: str,
+        link_length: int,
+        *,
+        worker_id: int = 0,
+        process_id: int = 0,
+        cache_size: int = 10000,
+        cache_ttl: float = 300,
+        max_age: int = 0,
+    ):
         self.epoch = epoch
         self.secret = secret
         self.link_length = link_length
+        self.snowflakes = SnowflakeGenerator(epoch, worker_id=worker_id, process_id=process_id)
 
         self.signer = itsdangerous.TimestampSigner(secret)
-        self.incrementor: int = 0
 
-    def create_id(self) -> str:
-        self.incrementor += 1
-        now = int(time.time() * 1000 - self.epoch)
+        self.key = hashlib.sha256(b'zupplin.tokens' + secret.encode()).digest()
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.max_age = max_age
+        # token: (user id, token hash, monotonic time it expires from the cache)
+        self._verified: dict[str, tuple[str, str, float]] = {}
+        # hashes of revoked tokens
+        self.revoked: set[str] = set()
+
+        self.cache_hits: int = 0
+        self.cache_misses: int = 0
 
-        snowflake = now << 22
-        snowflake |= self.incrementor
+    def create_id(self) -> str:
+        return self.snowflakes.create_id()
 
-        return str(snowflake)
+    def sign(self, payload: str) -> str:
+        signature = hmac.new(self.key, payload.encode(), 'sha256').digest()[: self.SIGNATURE_SIZE]
+        return base64.urlsafe_b64encode(signature).rstrip(b'=').decode()
 
     def create_token(self, id: str) -> str:
-        b64_token = base64.b64encode(id.encode())
-        token = self.signer.sign(b64_token)
-        return token.decode()
+        payload = f'{id}.{int(time.time())}'
+        return f'{payload}.{self.sign(payload)}'
+
+    @staticmethod
+    def hash_token(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
 
     def validate_token(self, token: str, *, max_age: int | None = None) -> str:
+        """Gets the id of the user a token belongs to, raising if it isn't valid."""
+
+        if max_age is None:
+            cached = self._verified.get(token)
+
+            if cached is not None and cached[2] > time.monotonic():
+                if cached[1] in self.revoked:
+                    raise InvalidToken('Token was revoked.')
+
+                self.cache_hits += 1
+                return cached[0]
+
+        self.cache_misses += 1
+        user_id = self.verify_token(token, max_age=max_age or self.max_age or None)
+        token_hash = self.hash_token(token)
+
+        if token_hash in self.revoked:
+            raise InvalidToken('Token was revoked.')
+
+        if token not in self._verified and len(self._verified) >= self.cache_size:
+            # the oldest entry is the closest to expiring anyway
+            self._verified.pop(next(iter(self._verified)))
+
+        self._verified[token] = (user_id, token_hash, time.monotonic() + self.cache_ttl)
+        return user_id
+
+    def verify_token(self, token: str, *, max_age: int | None = None) -> str:
+        user_id, _, rest = token.partition('.')
+
+        if not user_id.isdigit():
+            # base64 of an id never starts with a digit
+            return self.verify_legacy_token(token, max_age=max_age)
+
+        issued_at, _, signature = rest.partition('.')
+
+        if not hmac.compare_digest(signature, self.sign(f'{user_id}.{issued_at}')):
+            raise InvalidToken('Invalid signature.')
+
+        if max_age is not None and int(issued_at) + max_age < time.time():
+            raise InvalidToken('Token expired.')
+
+        return user_id
+
+    def verify_legacy_token(self, token: str, *, max_age: int | None = None) -> str:
         encoded_token = token.encode()
         result = self.signer.unsign(encoded_token, max_age=max_age)
 
@@ -42,6 +139,32 @@ class Tokens:
 
         return base64.b64decode(id.decode()).decode()
 
+    @property
+    def revocation_ttl(self) -> float | None:
+        """Seconds a revocation has to be kept for, None if tokens never expire."""
+
+        if not self.max_age:
+            return None
+
+        # a token verified just before it expired can still be remembered for cache_ttl
+        return self.max_age + self.cache_ttl
+
+    def revoke(self, token_hash: str):
+        self.revoked.add(token_hash)
+
+    def unrevoke(self, token_hash: str):
+        self.revoked.discard(token_hash)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            'cached': len(self._verified),
+            'hits': self.cache_hits,
+            'misses': self.cache_misses,
+            'revoked': len(self.revoked),
+            'ids_exhausted': self.snowflakes.exhausted,
+            'clock_regressions': self.snowflakes.clock_regressions,
+        }
+
     AVAILABLE_CHARS: str = string.ascii_letters + string.digits
 
     def create_link_id(self) -> str:
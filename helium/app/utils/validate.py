@@ -56,3 +56,17 @@ def validate(td: Type[TypedDict], body: dict[str, Any]) -> bool:
             return False
 
     return True
+
+
+MAX_ID = (1 << 63) - 1  # ids are stored as BIGINT
+MAX_ID_LENGTH = len(str(MAX_ID))
+
+
+def is_id(value: Any) -> bool:
+    """Returns whether a value from a request is an id that can be looked up"""
+
+    # isdigit alone also accepts digits from other scripts, like superscripts
+    if not isinstance(value, str) or not value.isascii() or not value.isdigit():
+        return False
+
+    return len(value) <= MAX_ID_LENGTH and int(value) <= MAX_ID
@@ -0,0 +1,90 @@
+-- snowflake ids are stored as BIGINT instead of TEXT, which halves the size of every
+-- index and join on them and makes them sort numerically.
+-- link ids are random strings and stay TEXT.
+
+-- foreign keys can't span the two types, so they are dropped while columns are converted
+ALTER TABLE user_settings DROP CONSTRAINT IF EXISTS user_settings_user_id_fkey;
+ALTER TABLE rooms DROP CONSTRAINT IF EXISTS rooms_owner_id_fkey;
+ALTER TABLE room_members DROP CONSTRAINT IF EXISTS room_members_user_id_fkey;
+ALTER TABLE room_members DROP CONSTRAINT IF EXISTS room_members_room_id_fkey;
+ALTER TABLE messages DROP CONSTRAINT IF EXISTS messages_room_id_fkey;
+ALTER TABLE messages DROP CONSTRAINT IF EXISTS messages_author_id_fkey;
+ALTER TABLE room_last_messages DROP CONSTRAINT IF EXISTS room_last_messages_room_id_fkey;
+ALTER TABLE room_last_messages DROP CONSTRAINT IF EXISTS room_last_messages_message_id_fkey;
+ALTER TABLE links DROP CONSTRAINT IF EXISTS links_user_id_fkey;
+ALTER TABLE relationships DROP CONSTRAINT IF EXISTS relationships_user_id_fkey;
+ALTER TABLE relationships DROP CONSTRAINT IF EXISTS relationships_recipient_id_fkey;
+ALTER TABLE revoked_tokens DROP CONSTRAINT IF EXISTS revoked_tokens_user_id_fkey;
+
+ALTER TABLE users ALTER COLUMN id TYPE BIGINT USING id::bigint;
+ALTER TABLE user_settings ALTER COLUMN user_id TYPE BIGINT USING user_id::bigint;
+
+ALTER TABLE rooms
+    ALTER COLUMN id TYPE BIGINT USING id::bigint,
+    ALTER COLUMN owner_id TYPE BIGINT USING owner_id::bigint;
+
+ALTER TABLE room_members
+    ALTER COLUMN user_id TYPE BIGINT USING user_id::bigint,
+    ALTER COLUMN room_id TYPE BIGINT USING room_id::bigint;
+
+ALTER TABLE messages
+    ALTER COLUMN id TYPE BIGINT USING id::bigint,
+    ALTER COLUMN room_id TYPE BIGINT USING room_id::bigint,
+    ALTER COLUMN author_id TYPE BIGINT USING author_id::bigint;
+
+ALTER TABLE room_last_messages
+    ALTER COLUMN room_id TYPE BIGINT USING room_id::bigint,
+    ALTER COLUMN message_id TYPE BIGINT USING message_id::bigint;
+
+ALTER TABLE links
+    ALTER COLUMN entity_id TYPE BIGINT USING entity_id::bigint,
+    ALTER COLUMN user_id TYPE BIGINT USING user_id::bigint;
+
+ALTER TABLE relationships
+    ALTER COLUMN user_id TYPE BIGINT USING user_id::bigint,
+    ALTER COLUMN recipient_id TYPE BIGINT USING recipient_id::bigint;
+
+ALTER TABLE revoked_tokens ALTER COLUMN user_id TYPE BIGINT USING user_id::bigint;
+
+ALTER TABLE user_settings
+    ADD CONSTRAINT user_settings_user_id_fkey
+    FOREIGN KEY (user_id) REFERENCES users ON DELETE CASCADE;
+ALTER TABLE rooms
+    ADD CONSTRAINT rooms_owner_id_fkey
+    FOREIGN KEY (owner_id) REFERENCES users ON DELETE NO ACTION ON UPDATE NO ACTION;
+ALTER TABLE room_members
+    ADD CONSTRAINT room_members_user_id_fkey
+    FOREIGN KEY (user_id) REFERENCES users ON DELETE CASCADE,
+    ADD CONSTRAINT room_members_room_id_fkey
+    FOREIGN KEY (room_id) REFERENCES rooms ON DELETE CASCADE;
+ALTER TABLE messages
+    ADD CONSTRAINT messages_room_id_fkey
+    FOREIGN KEY (room_id) REFERENCES rooms ON DELETE CASCADE,
+    ADD CONSTRAINT messages_author_id_fkey
+    FOREIGN KEY (author_id) REFERENCES users ON DELETE NO ACTION ON UPDATE NO ACTION;
+ALTER TABLE room_last_messages
+    ADD CONSTRAINT room_last_messages_room_id_fkey
+    FOREIGN KEY (room_id) REFERENCES rooms ON DELETE CASCADE,
+    ADD CONSTRAINT room_last_messages_message_id_fkey
+    FOREIGN KEY (message_id) REFERENCES messages ON DELETE CASCADE;
+ALTER TABLE links
+    ADD CONSTRAINT links_user_id_fkey
+    FOREIGN KEY (user_id) REFERENCES users ON DELETE NO ACTION ON UPDATE NO ACTION;
+ALTER TABLE relationships
+    ADD CONSTRAINT relationships_user_id_fkey
+    FOREIGN KEY (user_id) REFERENCES users ON DELETE CASCADE,
+    ADD CONSTRAINT relationships_recipient_id_fkey
+    FOREIGN KEY (recipient_id) REFERENCES users ON DELETE CASCADE;
+ALTER TABLE revoked_tokens
+    ADD CONSTRAINT revoked_tokens_user_id_fkey
+    FOREIGN KEY (user_id) REFERENCES users ON DELETE CASCADE;
+
+-- message history is paged by (room_id, id), which the conversion above rebuilt
+CREATE INDEX IF NOT EXISTS messages_room_id_id_idx ON messages (room_id, id);
+-- room member lists, the primary key only covers lookups by user
+CREATE INDEX IF NOT EXISTS room_members_room_id_idx ON room_members (room_id);
+-- the other side of relationships, the primary key only covers lookups by user
+CREATE INDEX IF NOT EXISTS relationships_recipient_id_idx ON relationships (recipient_id);
+-- finding expired links
+CREATE INDEX IF NOT EXISTS links_expires_at_idx ON links (expires_at)
+WHERE expires_at IS NOT NULL;
@@ -0,0 +1,41 @@
+-- cache change notifications were numbered from a sequence to find missed ones, but
+-- rolled back transactions burn numbers too, which looked like missed changes.
+-- notifications only reach the listener once committed and are never dropped while it
+-- is connected, so the numbers are gone and only a reconnect makes the caches resync.
+
+CREATE OR REPLACE FUNCTION notify_cache_change() RETURNS trigger AS $$
+DECLARE
+    changed RECORD;
+    data JSON;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        changed := OLD;
+    ELSE
+        changed := NEW;
+    END IF;
+
+    IF TG_TABLE_NAME = 'users' THEN
+        data := json_build_array(changed.id::text, changed.username, changed.name);
+    ELSIF TG_TABLE_NAME = 'room_members' THEN
+        data := json_build_array(
+            changed.room_id::text, changed.user_id::text, changed.permission_level
+        );
+    ELSIF TG_TABLE_NAME = 'revoked_tokens' THEN
+        data := json_build_array(changed.token_hash);
+    ELSE
+        data := json_build_array(
+            changed.type, changed.user_id::text, changed.recipient_id::text
+        );
+    END IF;
+
+    PERFORM pg_notify('cache_changes', json_build_object(
+        't', TG_TABLE_NAME,
+        'o', left(TG_OP, 1),
+        'd', data
+    )::text);
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP SEQUENCE IF EXISTS cache_changes_seq;
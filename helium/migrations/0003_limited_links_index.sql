@@ -0,0 +1,5 @@
+-- finding links that could run out of uses, which the link sweeper deletes once they
+-- have along with expired ones. only max_uses is indexed, it never changes, so counting
+-- a use can still be a HOT update
+CREATE INDEX IF NOT EXISTS links_limited_idx ON links (max_uses)
+WHERE max_uses > 0;
@@ -0,0 +1,32 @@
+-- deleting a room's last message used to cascade to its room_last_messages row, leaving
+-- the room without a last message even when it had older ones. the row is now pointed at
+-- the newest message left, or removed once the room has none.
+
+CREATE OR REPLACE FUNCTION recompute_room_last_messages() RETURNS trigger AS $$
+BEGIN
+    DELETE FROM room_last_messages
+    WHERE message_id IN (SELECT id FROM deleted_messages)
+      AND NOT EXISTS (
+          SELECT 1 FROM messages WHERE messages.room_id = room_last_messages.room_id
+      );
+
+    UPDATE room_last_messages
+    SET message_id = (
+        SELECT max(id) FROM messages WHERE messages.room_id = room_last_messages.room_id
+    )
+    WHERE message_id IN (SELECT id FROM deleted_messages);
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS messages_recompute_last_message ON messages;
+CREATE TRIGGER messages_recompute_last_message AFTER DELETE ON messages
+    REFERENCING OLD TABLE AS deleted_messages
+    FOR EACH STATEMENT EXECUTE FUNCTION recompute_room_last_messages();
+
+-- checked at commit, once the trigger has moved the row off the deleted message
+ALTER TABLE room_last_messages DROP CONSTRAINT IF EXISTS room_last_messages_message_id_fkey;
+ALTER TABLE room_last_messages
+    ADD CONSTRAINT room_last_messages_message_id_fkey
+    FOREIGN KEY (message_id) REFERENCES messages DEFERRABLE INITIALLY DEFERRED;
@@ -1,3 +1,6 @@
+-- the baseline schema, applied to new databases before every migration in migrations/.
+-- changes to existing tables go in a new migration, applied with `python -m app db migrate`
+
 SET TIME ZONE 'utc';
 
 CREATE OR REPLACE function utc_now() returns timestamp as $$
@@ -57,6 +60,23 @@ CREATE TABLE IF NOT EXISTS messages (
     created_at TIMESTAMP DEFAULT utc_now()
 );
 
+-- message history is paged by snowflake id within a room
+CREATE INDEX IF NOT EXISTS messages_room_id_id_idx ON messages (room_id, id);
+
+
+-- the newest message in each room, kept up to date whenever a message is sent
+CREATE TABLE IF NOT EXISTS room_last_messages (
+    room_id TEXT PRIMARY KEY REFERENCES rooms ON DELETE CASCADE,
+    message_id TEXT NOT NULL REFERENCES messages ON DELETE CASCADE
+);
+
+-- backfill databases that had messages before this table existed
+INSERT INTO room_last_messages (room_id, message_id)
+SELECT DISTINCT ON (room_id) room_id, id
+FROM messages
+WHERE NOT EXISTS (SELECT 1 FROM room_last_messages)
+ORDER BY room_id, id DESC;
+
 
 CREATE TABLE IF NOT EXISTS links (
     id TEXT PRIMARY KEY,
@@ -84,3 +104,82 @@ CREATE TABLE IF NOT EXISTS relationships (
 
     created_at TIMESTAMP DEFAULT utc_now()
 );
+
+
+-- event bus payloads too large for a NOTIFY, referenced by id and pruned shortly after
+CREATE TABLE IF NOT EXISTS event_payloads (
+    id BIGSERIAL PRIMARY KEY,
+    payload TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT utc_now()
+);
+
+
+-- tokens revoked by logging out, by hash
+CREATE TABLE IF NOT EXISTS revoked_tokens (
+    token_hash TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL REFERENCES users ON DELETE CASCADE,
+    revoked_at TIMESTAMP DEFAULT utc_now()
+);
+
+
+-- change notifications that keep every process's caches up to date
+CREATE SEQUENCE IF NOT EXISTS cache_changes_seq;
+
+CREATE OR REPLACE FUNCTION notify_cache_change() RETURNS trigger AS $$
+DECLARE
+    changed RECORD;
+    data JSON;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        changed := OLD;
+    ELSE
+        changed := NEW;
+    END IF;
+
+    IF TG_TABLE_NAME = 'users' THEN
+        data := json_build_array(changed.id::text, changed.username, changed.name);
+    ELSIF TG_TABLE_NAME = 'room_members' THEN
+        data := json_build_array(
+            changed.room_id::text, changed.user_id::text, changed.permission_level
+        );
+    ELSIF TG_TABLE_NAME = 'revoked_tokens' THEN
+        data := json_build_array(changed.token_hash);
+    ELSE
+        data := json_build_array(
+            changed.type, changed.user_id::text, changed.recipient_id::text
+        );
+    END IF;
+
+    PERFORM pg_notify('cache_changes', json_build_object(
+        's', nextval('cache_changes_seq'),
+        't', TG_TABLE_NAME,
+        'o', left(TG_OP, 1),
+        'd', data
+    )::text);
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS users_cache_change ON users;
+CREATE TRIGGER users_cache_change AFTER INSERT OR DELETE ON users
+FOR EACH ROW EXECUTE FUNCTION notify_cache_change();
+
+-- password changes and the like aren't cached, so they don't need a notification
+DROP TRIGGER IF EXISTS users_cache_update ON users;
+CREATE TRIGGER users_cache_update AFTER UPDATE ON users
+FOR EACH ROW
+WHEN (OLD.username IS DISTINCT FROM NEW.username OR OLD.name IS DISTINCT FROM NEW.name)
+EXECUTE FUNCTION notify_cache_change();
+
+DROP TRIGGER IF EXISTS room_members_cache_change ON room_members;
+CREATE TRIGGER room_members_cache_change AFTER INSERT OR UPDATE OR DELETE ON room_members
+FOR EACH ROW EXECUTE FUNCTION notify_cache_change();
+
+DROP TRIGGER IF EXISTS relationships_cache_change ON relationships;
+CREATE TRIGGER relationships_cache_change AFTER INSERT OR UPDATE OR DELETE ON relationships
+FOR EACH ROW EXECUTE FUNCTION notify_cache_change();
+
+DROP TRIGGER IF EXISTS revoked_tokens_cache_change ON revoked_tokens;
+CREATE TRIGGER revoked_tokens_cache_change AFTER INSERT OR DELETE ON revoked_tokens
+FOR EACH ROW EXECUTE FUNCTION notify_cache_change();
@@ -10,6 +10,7 @@ import pytest_asyncio
 from tornado.httpclient import AsyncHTTPClient, HTTPRequest
 
 from app.app import Application
+from app.utils.cache import User
 from app.utils.database import DROP_TABLES, Database
 
 
@@ -30,7 +31,9 @@ def config():
 
 @pytest_asyncio.fixture(scope='package')
 async def database(config):
-    return await Database.connect(config['database'])
+    database = await Database.connect(config['database'])
+    yield database
+    await database.close()
 
 
 @pytest_asyncio.fixture(scope='package')
@@ -40,9 +43,12 @@ async def app(config, database):
 
     app = Application(config, database)
     await app.prepare()
-    app.listen(app.config['server']['port'], app.config['server']['host'])
+    server = app.listen(app.config['server']['port'], app.config['server']['host'])
 
-    return app
+    yield app
+
+    server.stop()
+    await app.close()
 
 
 @pytest_asyncio.fixture(scope='module')
@@ -62,7 +68,7 @@ async def create_user(app):
             'name': kwargs['name'],
         }
 
-        app.user_cache[record['id']] = user
+        app.user_cache[record['id']] = User(id, user['username'], user['name'])
 
         return user
 
@@ -1,3 +1,4 @@
+import asyncio
 from typing import Optional
 
 import pytest
@@ -32,6 +33,17 @@ async def create_account(app, make_request):
                 app.user_cache.pop(id)
 
 
+async def changes_applied(condition) -> bool:
+    # cache changes arrive through CDC, shortly after the transaction commits
+    for _ in range(100):
+        if condition():
+            return True
+
+        await asyncio.sleep(0.01)
+
+    return False
+
+
 class TestAccountCreationSuccess:
     @pytest_asyncio.fixture(scope='class', autouse=True)
     async def response(self, create_account):
@@ -44,8 +56,9 @@ class TestAccountCreationSuccess:
     def test_response(self, response):
         assert response.code == 200
 
-    def test_cache(self, app):
-        assert len(app.user_cache) == 1
+    @pytest.mark.asyncio
+    async def test_cache(self, app):
+        assert await changes_applied(lambda: len(app.user_cache) == 1)
 
     @pytest.mark.asyncio
     async def test_database(self, database):
@@ -81,3 +94,29 @@ class TestAccountCreationFailure:
 
     def test_response(self, response):
         assert response.code == 400
+
+
+class TestRevocations:
+    @pytest.mark.asyncio
+    async def test_logout(self, app, create_user, make_request):
+        user = await create_user(None, name='.', password='.', email='logout@email.com')
+        token = app.tokens.create_token(user['id'])
+        token_hash = app.tokens.hash_token(token)
+
+        response = await make_request('logout', 'POST', token=token, allow_nonstandard_methods=True)
+        assert response.code == 204
+        assert token_hash in app.tokens.revoked
+
+        response = await make_request('users/me', 'GET', token=token)
+        assert response.code == 401
+
+        # revocations outliving the tokens they revoke are swept, and forgotten everywhere
+        async with app.database.acquire() as conn:
+            await conn.execute(
+                "UPDATE revoked_tokens SET revoked_at = utc_now() - interval '2 hours' "
+                'WHERE token_hash=$1;',
+                token_hash,
+            )
+
+        await app.database.execute('delete_expired_revocations', 3600)
+        assert await changes_applied(lambda: token_hash not in app.tokens.revoked)
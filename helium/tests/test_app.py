@@ -0,0 +1,119 @@
+import asyncio
+
+import orjson
+import pytest
+from tornado.httpclient import HTTPRequest
+from tornado.httpserver import HTTPServer
+from tornado.testing import bind_unused_port
+
+from app.app import Application
+from app.utils.snowflake import SnowflakeGenerator
+
+
+class SlowRelationshipsApplication(Application):
+    # holds the relationship warmup back until the test lets it go
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.release_relationships = asyncio.Event()
+
+    async def fill_relationship_cache(self):
+        await self.release_relationships.wait()
+        await super().fill_relationship_cache()
+
+
+class TestWarmup:
+    @pytest.mark.asyncio
+    async def test_streamed_in_batches(self, app, create_user, monkeypatch):
+        for i in range(5):
+            await create_user(None, name='.', password='.', email=f'warmup{i}@email.com')
+
+        batches: list[list[str]] = []
+        monkeypatch.setattr(app, 'warmup_batch_size', 2)
+
+        await app.warm_cache(
+            'users', 'get_all_users', lambda records: batches.append([r['id'] for r in records])
+        )
+
+        async with app.database.acquire() as conn:
+            ids = {str(id) for id in await conn.fetchval('SELECT array_agg(id) FROM users;')}
+
+        assert len(batches) > 1 and all(len(batch) <= 2 for batch in batches)
+        assert {id for batch in batches for id in batch} == ids
+
+    @pytest.mark.asyncio
+    async def test_serves_before_relationships(
+        self, app, config, database, create_user, http_client
+    ):
+        user = await create_user(None, name='.', password='.', email='slow1@email.com')
+        recipient = await create_user(None, name='.', password='.', email='slow2@email.com')
+        token = app.tokens.create_token(user['id'])
+
+        slow_app = SlowRelationshipsApplication(config, database)
+        # startup doesn't wait for the relationship warmup
+        await asyncio.wait_for(slow_app.prepare(), 5)
+
+        sock, port = bind_unused_port()
+        server = HTTPServer(slow_app)
+        server.add_sockets([sock])
+
+        def request(path: str, method: str = 'GET', body: dict | None = None):
+            return http_client.fetch(
+                HTTPRequest(
+                    f'http://127.0.0.1:{port}/{path}',
+                    method,
+                    body=orjson.dumps(body) if body else None,
+                    headers={'Authorization': f'Bearer {token}'},
+                ),
+                raise_error=False,
+            )
+
+        try:
+            assert not slow_app.relationships_ready.is_set()
+
+            # requests that don't need relationships are served during the warmup
+            response = await request('users/me')
+            assert response.code == 200
+
+            # relationship requests wait for it
+            body = {'recipient_id': recipient['id'], 'type': 1}
+            pending = asyncio.ensure_future(request('relationships', 'POST', body))
+            await asyncio.sleep(0.1)
+            assert not pending.done()
+
+            slow_app.release_relationships.set()
+            await asyncio.wait_for(slow_app.relationships_ready.wait(), 5)
+            assert (await asyncio.wait_for(pending, 5)).code == 200
+        finally:
+            server.stop()
+            await slow_app.close()
+
+
+class TestWorkers:
+    def test_default(self, monkeypatch):
+        monkeypatch.setattr('tornado.process.cpu_count', lambda: 8)
+
+        assert Application.get_workers({'autoreload': False}) == 1
+        assert Application.get_workers({'workers': 4, 'autoreload': False}) == 4
+        assert Application.get_workers({'workers': 0, 'autoreload': False}) == 8
+
+    def test_autoreload(self):
+        assert Application.get_workers({'workers': 4, 'autoreload': True}) == 1
+
+    def test_one_process_id_each(self, monkeypatch):
+        most = SnowflakeGenerator.MAX_PROCESS_ID + 1
+        assert Application.get_workers({'workers': most, 'autoreload': False}) == most
+
+        # one core per worker isn't allowed past the process ids either
+        monkeypatch.setattr('tornado.process.cpu_count', lambda: most + 1)
+
+        for server_config in ({'workers': most + 1}, {'workers': 0}):
+            with pytest.raises(ValueError):
+                Application.get_workers({**server_config, 'autoreload': False})
+
+    def test_process_id(self, config, database):
+        # fork_processes numbers the workers from 0, which become their process ids
+        app = Application(config, database, process_id=SnowflakeGenerator.MAX_PROCESS_ID)
+        id = int(app.tokens.create_id())
+
+        process_id = (id >> SnowflakeGenerator.PROCESS_ID_SHIFT) & SnowflakeGenerator.MAX_PROCESS_ID
+        assert process_id == SnowflakeGenerator.MAX_PROCESS_ID
@@ -0,0 +1,241 @@
+import asyncio
+import datetime
+
+import orjson
+import pytest
+
+from app.utils.cache import (
+    LinkCache,
+    MembershipIndex,
+    Relationship,
+    RelationshipStore,
+    User,
+    UserCache,
+)
+
+
+class TestUser:
+    def test_serialize(self):
+        user = User('1', None, '.')
+        assert orjson.loads(orjson.dumps(user)) == {'id': '1', 'username': None, 'name': '.'}
+
+    def test_interned_id(self):
+        first = User(''.join(['12', '34']), None, '.')
+        second = User(''.join(['1', '234']), None, '.')
+        assert first.id is second.id
+
+
+class UserDatabase:
+    # stands in for Database, counting how many queries the cache makes
+    def __init__(self, *ids: str):
+        self.records = {id: {'id': id, 'username': None, 'name': '.'} for id in ids}
+        self.queries = 0
+
+    async def get_user(self, user_id):
+        self.queries += 1
+        await asyncio.sleep(0)
+        return self.records.get(user_id)
+
+    async def get_users(self, user_ids):
+        self.queries += 1
+        return [self.records[id] for id in user_ids if id in self.records]
+
+
+class TestUserCache:
+    def test_lru(self):
+        cache = UserCache(UserDatabase(), max_size=2)
+        cache.add(User('1', None, '.'))
+        cache.add(User('2', None, '.'))
+        cache.get('1')
+        cache.add(User('3', None, '.'))
+
+        assert '1' in cache
+        assert '2' not in cache
+        assert cache.evictions == 1
+
+    def test_replace(self):
+        cache = UserCache(UserDatabase())
+        cache.add(User('1', None, '.'))
+        loaded = UserCache(UserDatabase())
+        loaded.add(User('2', None, '.'))
+
+        cache.replace(loaded)
+
+        # a user deleted while its change was missed doesn't survive the reload
+        assert '1' not in cache
+        assert cache.get('2') == User('2', None, '.')
+
+    @pytest.mark.asyncio
+    async def test_read_through(self):
+        database = UserDatabase('1')
+        cache = UserCache(database, max_size=10)
+
+        users = await asyncio.gather(*(cache.fetch('1') for _ in range(5)))
+
+        assert all(user == User('1', None, '.') for user in users)
+        assert database.queries == 1
+        assert await cache.fetch('1') == User('1', None, '.')
+        assert database.queries == 1
+        assert await cache.fetch('2') is None
+
+    @pytest.mark.asyncio
+    async def test_fetch_many(self):
+        database = UserDatabase('1', '2', '3')
+        cache = UserCache(database)
+        cache.add(User('1', None, '.'))
+
+        users = await cache.fetch_many(['1', '2', '3', '2'])
+
+        assert set(users) == {'1', '2', '3'}
+        assert database.queries == 1
+
+    @pytest.mark.asyncio
+    async def test_fetch_many_shares_queries(self):
+        database = UserDatabase('1', '2', '3')
+        cache = UserCache(database)
+
+        single, many, again = await asyncio.gather(
+            cache.fetch('1'), cache.fetch_many(['1', '2', '3']), cache.fetch_many(['2', '3'])
+        )
+
+        assert single == User('1', None, '.')
+        assert set(many) == {'1', '2', '3'} and set(again) == {'2', '3'}
+        assert database.queries == 2
+        assert not cache._pending
+
+
+class TestRelationshipStore:
+    def test_add(self):
+        store = RelationshipStore()
+        store.add(0, '1', '2')
+
+        assert store.get('1', '2') == Relationship(0, '1', '2')
+        assert store.get('2', '1') is None
+        assert store.outgoing('1') == [Relationship(0, '1', '2')]
+        assert store.incoming('2') == [Relationship(0, '1', '2')]
+        assert len(store) == 1
+
+    def test_replace(self):
+        store = RelationshipStore()
+        store.add(0, '1', '2')
+        store.add(1, '1', '2')
+
+        assert store.get('1', '2') == Relationship(1, '1', '2')
+        assert store.incoming('2') == [Relationship(1, '1', '2')]
+        assert len(store) == 1
+
+    def test_remove(self):
+        store = RelationshipStore()
+        store.add(0, '1', '2')
+        store.add(0, '2', '1')
+
+        assert store.remove('1', '2') == Relationship(0, '1', '2')
+        assert store.remove('1', '2') is None
+        assert store.get('2', '1') == Relationship(0, '2', '1')
+        assert store.outgoing('1') == []
+        assert store.incoming('1') == [Relationship(0, '2', '1')]
+        assert len(store) == 1
+
+
+class TestMembershipIndex:
+    def test_add(self):
+        index = MembershipIndex()
+        index.add('room', '1')
+        index.add('room', '2', 1)
+        index.add('other', '1')
+
+        assert index.is_member('room', '1')
+        assert not index.is_member('room', '3')
+        assert not index.is_member('missing', '1')
+        assert set(index.members('room')) == {'1', '2'}
+        assert index.rooms('1') == {'room', 'other'}
+        assert index.permission_level('room', '2') == 1
+
+    def test_remove(self):
+        index = MembershipIndex()
+        index.add('room', '1')
+        index.add('other', '1')
+
+        assert index.remove('room', '1')
+        assert not index.remove('room', '1')
+        assert 'room' not in index
+        assert index.rooms('1') == {'other'}
+
+    def test_remove_room(self):
+        index = MembershipIndex()
+        index.add('room', '1')
+        index.add('room', '2')
+        index.add('other', '1')
+
+        index.remove_room('room')
+
+        assert 'room' not in index
+        assert index.rooms('1') == {'other'}
+        assert index.rooms('2') == set()
+
+
+class LinkDatabase:
+    def __init__(self, **links: dict):
+        self.links = {
+            id: {'id': id, 'uses': 0, 'max_uses': 0, 'expires_at': None, **link}
+            for id, link in links.items()
+        }
+        self.queries = 0
+
+    async def get_link(self, link_id, *, readonly=False, user_id=None):
+        self.queries += 1
+        await asyncio.sleep(0)
+        return self.links.get(link_id)
+
+
+class TestLinkCache:
+    @pytest.mark.asyncio
+    async def test_read_through(self):
+        database = LinkDatabase(link={})
+        cache = LinkCache(database)
+
+        links = await asyncio.gather(*(cache.fetch('link') for _ in range(5)))
+        await cache.fetch('link')
+
+        assert all(link is not None for link in links)
+        assert database.queries == 1
+        assert await cache.fetch('missing') is None
+
+    @pytest.mark.asyncio
+    async def test_loads_shared_per_route(self):
+        database = LinkDatabase(link={})
+        cache = LinkCache(database)
+
+        await asyncio.gather(
+            cache.fetch('link'),
+            cache.fetch('link', readonly=True, user_id='1'),
+            cache.fetch('link', readonly=True, user_id='1'),
+        )
+
+        # the primary read doesn't wait on the replica read, or the other way around
+        assert database.queries == 2
+        assert not cache._pending
+
+    @pytest.mark.asyncio
+    async def test_unusable(self):
+        expired = datetime.datetime.utcnow() - datetime.timedelta(seconds=1)
+        database = LinkDatabase(expired={'expires_at': expired}, used={'uses': 1, 'max_uses': 1})
+        cache = LinkCache(database)
+
+        assert await cache.fetch('expired') is None
+        assert await cache.fetch('used') is None
+        assert len(cache) == 0
+
+    @pytest.mark.asyncio
+    async def test_record_use(self):
+        database = LinkDatabase(link={'max_uses': 2})
+        cache = LinkCache(database)
+        await cache.fetch('link')
+
+        cache.record_use('link', 1)
+        assert cache.get('link')['uses'] == 1  # type: ignore
+
+        # used up links are dropped instead of being served from the cache
+        cache.record_use('link', 2)
+        assert cache.get('link') is None
+        assert database.queries == 1
@@ -0,0 +1,83 @@
+import asyncio
+from types import SimpleNamespace
+
+import orjson
+import pytest
+
+from app.utils.cache import MembershipIndex, RelationshipStore, User, UserCache
+from app.utils.cache_maintainer import CacheMaintainer
+from app.utils.token import Tokens
+
+
+def make_maintainer() -> CacheMaintainer:
+    application = SimpleNamespace(
+        user_cache=UserCache(None),  # type: ignore
+        room_cache=MembershipIndex(),
+        relationship_cache=RelationshipStore(),
+        tokens=Tokens(1609459200, 'secret', 10),
+    )
+    return CacheMaintainer(application)  # type: ignore
+
+
+def notify(maintainer: CacheMaintainer, table: str, op: str, *data):
+    payload = orjson.dumps({'t': table, 'o': op, 'd': data}).decode()
+    maintainer.on_notification(None, 0, maintainer.CHANNEL, payload)
+
+
+class TestCacheMaintainer:
+    def test_apply(self):
+        maintainer = make_maintainer()
+        app = maintainer.application
+
+        notify(maintainer, 'users', 'I', '1', None, '.')
+        notify(maintainer, 'users', 'U', '1', 'user', '.')
+        notify(maintainer, 'room_members', 'I', 'room', '1', 0)
+        notify(maintainer, 'relationships', 'I', 0, '1', '2')
+
+        assert app.user_cache.get('1') == User('1', 'user', '.')
+        assert app.room_cache.is_member('room', '1')
+        assert app.relationship_cache.get('1', '2') is not None
+
+        notify(maintainer, 'users', 'D', '1', 'user', '.')
+        notify(maintainer, 'room_members', 'D', 'room', '1', 0)
+        notify(maintainer, 'relationships', 'D', 0, '1', '2')
+
+        assert '1' not in app.user_cache
+        assert not app.room_cache.is_member('room', '1')
+        assert app.relationship_cache.get('1', '2') is None
+        assert maintainer.applied == 7
+
+    def test_revoked_tokens(self):
+        maintainer = make_maintainer()
+        tokens = maintainer.application.tokens
+
+        notify(maintainer, 'revoked_tokens', 'I', 'hash')
+        assert 'hash' in tokens.revoked
+
+        notify(maintainer, 'revoked_tokens', 'D', 'hash')
+        assert 'hash' not in tokens.revoked
+
+    def test_hold(self):
+        maintainer = make_maintainer()
+        app = maintainer.application
+
+        with maintainer.hold('room_members'):
+            notify(maintainer, 'room_members', 'D', 'room', '1', 0)
+            # stands in for a load that read the row before it was deleted
+            app.room_cache.add('room', '1')
+
+        assert not app.room_cache.is_member('room', '1')
+
+    @pytest.mark.asyncio
+    async def test_sync_markers(self):
+        maintainer = make_maintainer()
+        future = asyncio.get_running_loop().create_future()
+        maintainer._syncs['mine'] = future
+
+        # markers sent by other processes are ignored, and neither counts as a change
+        notify(maintainer, 'sync', 'N', 'other')
+        assert not future.done()
+
+        notify(maintainer, 'sync', 'N', 'mine')
+        assert future.done()
+        assert maintainer.applied == 0
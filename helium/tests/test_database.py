@@ -0,0 +1,87 @@
+import pytest
+
+from app.utils.database import Database, PoolStats
+
+
+class TimeoutPool:
+    # stands in for a pool, recording the timeout of every acquire
+    def __init__(self):
+        self.timeouts: list[float | None] = []
+
+    async def acquire(self, *, timeout):
+        self.timeouts.append(timeout)
+        return object()
+
+    async def release(self, conn):
+        pass
+
+
+class TestPoolStats:
+    def test_histogram(self):
+        stats = PoolStats()
+
+        for wait in (0.0005, 0.001, 0.003, 0.2, 10):
+            stats.record(wait)
+
+        histogram = stats.stats()['wait_histogram']
+
+        assert histogram['<=1ms'] == 2
+        assert histogram['<=5ms'] == 1
+        assert histogram['<=500ms'] == 1
+        assert histogram['>5000ms'] == 1
+        assert sum(histogram.values()) == stats.acquires == 5
+        assert stats.stats()['max_wait_ms'] == 10000
+
+
+class TestAcquire:
+    @pytest.mark.asyncio
+    async def test_timeout(self):
+        pool = TimeoutPool()
+        database = Database(pool, acquire_timeout=10)  # type: ignore
+
+        for timeout in (None, 0, 1):
+            async with database.acquire(timeout=timeout):
+                pass
+
+        assert pool.timeouts == [10, 0, 1]
+
+
+class TestReplicaRouting:
+    def create_database(self) -> Database:
+        database = Database(None, replicas=['replica-1', 'replica-2'])  # type: ignore
+
+        for replica in database.replicas:
+            replica.healthy = True
+
+        return database
+
+    def test_round_robin(self):
+        database = self.create_database()
+
+        chosen = {database.choose_replica().uri for _ in range(4)}  # type: ignore
+        assert chosen == {'replica-1', 'replica-2'}
+
+    def test_unhealthy_replicas_skipped(self):
+        database = self.create_database()
+        database.replicas[0].mark_down()
+
+        assert all(database.choose_replica() is database.replicas[1] for _ in range(4))
+        assert database.replicas[0].fallbacks == 1
+
+        database.replicas[1].mark_down()
+        assert database.choose_replica() is None
+
+    def test_read_your_writes(self):
+        database = self.create_database()
+        database.mark_write('1')
+
+        assert database.choose_replica('1') is None
+        assert database.choose_replica('2') is not None
+        assert database.choose_replica() is not None
+
+    def test_writes_untracked_without_replicas(self):
+        database = Database(None)  # type: ignore
+        database.mark_write('1')
+
+        assert not database.last_writes
+        assert database.choose_replica('1') is None
@@ -0,0 +1,54 @@
+import orjson
+import pytest
+
+from app.utils.encoding import JSONEncoding, MsgpackEncoding
+
+msgpack = pytest.importorskip('msgpack')
+
+
+class TestJSONEncoding:
+    def test_dispatch_frame(self):
+        prefix = JSONEncoding.dispatch_prefix(0, 'MESSAGE', {'id': '1'})
+
+        assert orjson.loads(JSONEncoding.dispatch_frame(prefix, 5)) == {
+            'opcode': '0',
+            'event_name': 'MESSAGE',
+            'data': {'id': '1'},
+            'increment': 5,
+        }
+
+    def test_batch(self):
+        prefix = JSONEncoding.dispatch_prefix(0, 'MESSAGE', {})
+        frames = [JSONEncoding.dispatch_frame(prefix, increment) for increment in (1, 2)]
+
+        batch = orjson.loads(JSONEncoding.batch(7, frames))
+
+        assert batch['opcode'] == '7'
+        assert [frame['increment'] for frame in batch['data']] == [1, 2]
+
+
+class TestMsgpackEncoding:
+    def test_dispatch_frame(self):
+        prefix = MsgpackEncoding.dispatch_prefix(0, 'MESSAGE', {'id': '1'})
+
+        assert msgpack.unpackb(MsgpackEncoding.dispatch_frame(prefix, 70000)) == {
+            'opcode': '0',
+            'event_name': 'MESSAGE',
+            'data': {'id': '1'},
+            'increment': 70000,
+        }
+
+    @pytest.mark.parametrize('count', [0, 1, 15, 16, 70000])
+    def test_batch(self, count):
+        # array headers change size at 16 and 65536 entries
+        prefix = MsgpackEncoding.dispatch_prefix(0, 'MESSAGE', {})
+        frames = [MsgpackEncoding.dispatch_frame(prefix, increment) for increment in range(count)]
+
+        batch = msgpack.unpackb(MsgpackEncoding.batch(7, frames))
+
+        assert batch['opcode'] == '7'
+        assert [frame['increment'] for frame in batch['data']] == list(range(count))
+
+    def test_text_frame(self):
+        with pytest.raises(TypeError):
+            MsgpackEncoding.loads('{"opcode": 1}')
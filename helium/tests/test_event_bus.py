@@ -0,0 +1,40 @@
+import asyncio
+
+import pytest
+
+from app.utils.event_bus import BusEvent, LocalEventBus
+
+
+class TestLocalEventBus:
+    @pytest.mark.asyncio
+    async def test_publish(self):
+        received: dict[str, list[BusEvent]] = {'first': [], 'second': []}
+        first = LocalEventBus(received['first'].append, channel='test')
+        second = LocalEventBus(received['second'].append, channel='test')
+        await first.start()
+        await second.start()
+
+        event = BusEvent('MESSAGE', {'content': '.'}, room_id='1')
+        first.publish(event)
+        await asyncio.sleep(0)
+
+        assert received == {'first': [], 'second': [event]}
+
+        await first.close()
+        await second.close()
+
+    @pytest.mark.asyncio
+    async def test_closed(self):
+        received: list[BusEvent] = []
+        first = LocalEventBus(received.append, channel='test')
+        second = LocalEventBus(received.append, channel='test')
+        await first.start()
+        await second.start()
+        await second.close()
+
+        first.publish(BusEvent('ROOM_JOIN', {}, user_id='1'))
+        await asyncio.sleep(0)
+
+        assert received == []
+
+        await first.close()
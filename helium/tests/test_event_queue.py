@@ -0,0 +1,35 @@
+from dataclasses import dataclass
+
+from app.utils.event_queue import EventQueue
+
+
+@dataclass
+class Event:
+    name: str
+    ephemeral: bool = False
+
+
+class TestEventQueue:
+    def test_drop_oldest_ephemeral(self):
+        queue = EventQueue(2)
+        queue.put(Event('a'))
+        queue.put(Event('b', ephemeral=True))
+
+        assert queue.put(Event('c'))
+        assert [queue.get_nowait().name for _ in range(len(queue))] == ['a', 'c']
+        assert queue.dropped == 1
+
+    def test_drop_incoming_ephemeral(self):
+        queue = EventQueue(1)
+        queue.put(Event('a'))
+
+        assert queue.put(Event('b', ephemeral=True))
+        assert len(queue) == 1
+        assert queue.dropped == 1
+
+    def test_refuse(self):
+        queue = EventQueue(1)
+        queue.put(Event('a'))
+
+        assert not queue.put(Event('b'))
+        assert queue.high_water == 1
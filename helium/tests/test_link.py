@@ -0,0 +1,48 @@
+import orjson
+import pytest
+import pytest_asyncio
+
+
+@pytest_asyncio.fixture(scope='module')
+async def room(app, create_user, make_request):
+    user = await create_user(None, name='.', password='.', email='links@email.com')
+    token = app.tokens.create_token(user['id'])
+
+    response = await make_request('rooms', 'POST', body={'name': '.'}, token=token)
+    room_id = orjson.loads(response.body)['id']
+
+    yield {'id': room_id, 'token': token}
+
+    async with app.database.acquire() as conn:
+        await conn.execute('DELETE FROM links WHERE entity_id=$1;', room_id)
+        await conn.execute('DELETE FROM rooms WHERE id=$1;', room_id)
+
+    app.room_cache.remove_room(room_id)
+
+
+class TestLinkSweep:
+    @pytest.mark.asyncio
+    async def test_sweep(self, app, room, make_request):
+        link_ids: dict[str, str] = {}
+
+        for name, max_uses in (('usable', 2), ('used_up', 1), ('expired', 0)):
+            body = {'max_uses': max_uses}
+            response = await make_request(
+                f'rooms/{room["id"]}/links', 'POST', body=body, token=room['token']
+            )
+            link_ids[name] = orjson.loads(response.body)['id']
+
+        async with app.database.acquire() as conn:
+            await conn.execute(
+                'UPDATE links SET uses = 1 WHERE id = ANY($1::text[]);',
+                [link_ids['usable'], link_ids['used_up']],
+            )
+            await conn.execute(
+                "UPDATE links SET expires_at = utc_now() - interval '1 second' WHERE id=$1;",
+                link_ids['expired'],
+            )
+
+        records = await app.database.fetch('delete_unusable_links', 100)
+
+        assert {record['id'] for record in records} == {link_ids['used_up'], link_ids['expired']}
+        assert await app.database.get_link(link_ids['usable']) is not None
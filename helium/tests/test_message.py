@@ -0,0 +1,140 @@
+import orjson
+import pytest
+import pytest_asyncio
+
+
+@pytest_asyncio.fixture(scope='module')
+async def room(app, create_user, make_request):
+    user = await create_user(None, name='.', password='.', email='history@email.com')
+    token = app.tokens.create_token(user['id'])
+
+    response = await make_request('rooms', 'POST', body={'name': '.'}, token=token)
+    room_id = orjson.loads(response.body)['id']
+
+    message_ids: list[str] = []
+    for i in range(10):
+        response = await make_request(
+            f'rooms/{room_id}/messages', 'POST', body={'content': str(i)}, token=token
+        )
+        message_ids.append(orjson.loads(response.body)['id'])
+
+    yield {'id': room_id, 'token': token, 'message_ids': message_ids}
+
+    async with app.database.acquire() as conn:
+        await conn.execute('DELETE FROM rooms WHERE id=$1;', room_id)
+
+    app.room_cache.remove_room(room_id)
+
+
+@pytest.fixture(scope='module')
+def get_history(room, make_request):
+    async def _get_history(query: str = ''):
+        response = await make_request(
+            f'rooms/{room["id"]}/messages{query}', 'GET', token=room['token']
+        )
+        assert response.code == 200
+        return [message['id'] for message in orjson.loads(response.body)]
+
+    return _get_history
+
+
+class TestMessageHistory:
+    @pytest.mark.asyncio
+    async def test_latest(self, room, get_history):
+        assert await get_history('?limit=3') == room['message_ids'][:-4:-1]
+
+    @pytest.mark.asyncio
+    async def test_before(self, room, get_history):
+        ids = room['message_ids']
+        assert await get_history(f'?before={ids[5]}&limit=2') == [ids[4], ids[3]]
+
+    @pytest.mark.asyncio
+    async def test_after(self, room, get_history):
+        ids = room['message_ids']
+        assert await get_history(f'?after={ids[5]}&limit=2') == [ids[7], ids[6]]
+
+    @pytest.mark.asyncio
+    async def test_around(self, room, get_history):
+        ids = room['message_ids']
+        assert await get_history(f'?around={ids[5]}&limit=3') == [ids[6], ids[5], ids[4]]
+
+    @pytest.mark.asyncio
+    async def test_invalid(self, room, make_request):
+        response = await make_request(
+            f'rooms/{room["id"]}/messages?before=1&after=2', 'GET', token=room['token']
+        )
+        assert response.code == 400
+
+    @pytest.mark.asyncio
+    async def test_out_of_range_id(self, room, make_request):
+        response = await make_request(
+            f'rooms/{room["id"]}/messages?before={2 ** 63}', 'GET', token=room['token']
+        )
+        assert response.code == 400
+
+    @pytest.mark.asyncio
+    async def test_invalid_message_id(self, room, make_request):
+        for message_id in ('abc', str(2**63)):
+            response = await make_request(
+                f'rooms/{room["id"]}/messages/{message_id}', 'GET', token=room['token']
+            )
+            assert response.code == 404
+
+
+class TestLastMessage:
+    @pytest.mark.asyncio
+    async def test_last_message(self, app, create_user, make_request):
+        owner = await create_user(None, name='.', password='.', email='last@email.com')
+        member = await create_user(None, name='.', password='.', email='last2@email.com')
+        owner_token = app.tokens.create_token(owner['id'])
+        member_token = app.tokens.create_token(member['id'])
+
+        response = await make_request('rooms', 'POST', body={'name': '.'}, token=owner_token)
+        room_id = orjson.loads(response.body)['id']
+
+        async def post_message(content: str) -> str:
+            response = await make_request(
+                f'rooms/{room_id}/messages', 'POST', body={'content': content}, token=owner_token
+            )
+            return orjson.loads(response.body)['id']
+
+        async def get_last_message():
+            response = await make_request('users/me', 'GET', token=owner_token)
+            return orjson.loads(response.body)['rooms'][room_id]['last_message']
+
+        try:
+            assert await get_last_message() is None
+
+            first_id = await post_message('first')
+            last_message = await get_last_message()
+            assert last_message['id'] == first_id and last_message['content'] == 'first'
+            assert last_message['author']['id'] == owner['id']
+
+            response = await make_request(
+                f'rooms/{room_id}/links', 'POST', body={'max_uses': 0}, token=owner_token
+            )
+            link_id = orjson.loads(response.body)['id']
+            response = await make_request(
+                f'links/{link_id}', 'POST', token=member_token, allow_nonstandard_methods=True
+            )
+            assert orjson.loads(response.body)['last_message']['id'] == first_id
+
+            second_id = await post_message('second')
+            assert (await get_last_message())['id'] == second_id
+
+            # deleting the last message goes back to the one before it, not to none
+            async with app.database.acquire() as conn:
+                await conn.execute('DELETE FROM messages WHERE id=$1;', int(second_id))
+
+            assert (await get_last_message())['id'] == first_id
+
+            async with app.database.acquire() as conn:
+                await conn.execute('DELETE FROM messages WHERE id=$1;', int(first_id))
+
+            assert await get_last_message() is None
+        finally:
+            async with app.database.acquire() as conn:
+                await conn.execute('DELETE FROM links WHERE entity_id=$1;', int(room_id))
+                await conn.execute('DELETE FROM rooms WHERE id=$1;', int(room_id))
+
+            app.room_cache.remove_room(room_id)
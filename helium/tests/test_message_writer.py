@@ -0,0 +1,100 @@
+import asyncio
+import contextlib
+
+import pytest
+
+from app.utils.errors import ServiceUnavailable
+from app.utils.message_writer import MessageWriter, PendingMessage
+
+
+class MessageConnection:
+    # stands in for a connection, failing any batch with a message in a missing room
+    def __init__(self):
+        self.batches: list[list[PendingMessage]] = []
+        self.last_messages: dict[str, str] = {}
+
+    @contextlib.asynccontextmanager
+    async def transaction(self):
+        yield
+
+    async def copy_records_to_table(self, table, *, records, columns):
+        if any(record.room_id == 'missing' for record in records):
+            raise ValueError('room does not exist')
+
+        self.batches.append(list(records))
+
+
+class MessageDatabase:
+    def __init__(self):
+        self.connection = MessageConnection()
+
+    @contextlib.asynccontextmanager
+    async def acquire(self):
+        yield self.connection
+
+    async def execute(self, name, room_ids, message_ids, *, conn):
+        conn.last_messages.update(zip(room_ids, message_ids))
+
+
+class UnavailableDatabase(MessageDatabase):
+    # stands in for a database whose pool has no connection to give
+    @contextlib.asynccontextmanager
+    async def acquire(self):
+        raise ServiceUnavailable
+        yield
+
+
+def make_message(id: int, room_id: str = 'room') -> PendingMessage:
+    return PendingMessage(str(id), '.', room_id, '1', 0)
+
+
+class TestMessageWriter:
+    @pytest.mark.asyncio
+    async def test_batch(self):
+        database = MessageDatabase()
+        writer = MessageWriter(database, max_batch_size=3)  # type: ignore
+
+        await asyncio.gather(*(writer.write(make_message(i)) for i in range(5)))
+
+        assert [len(batch) for batch in database.connection.batches] == [3, 2]
+        assert database.connection.last_messages == {'room': '4'}
+        assert writer.messages == 5
+
+    @pytest.mark.asyncio
+    async def test_failed_message(self):
+        database = MessageDatabase()
+        writer = MessageWriter(database)  # type: ignore
+
+        results = await asyncio.gather(
+            writer.write(make_message(1)),
+            writer.write(make_message(2, 'missing')),
+            writer.write(make_message(3)),
+            return_exceptions=True,
+        )
+
+        assert results[0] is None and results[2] is None
+        assert isinstance(results[1], ValueError)
+        assert writer.failed_batches == 1
+        assert writer.messages == 2
+
+    @pytest.mark.asyncio
+    async def test_no_connection(self):
+        writer = MessageWriter(UnavailableDatabase())  # type: ignore
+
+        # the batch and the retry both fail to get a connection
+        with pytest.raises(ServiceUnavailable):
+            await asyncio.wait_for(writer.write(make_message(1)), 1)
+
+        assert writer.failed_batches == 1
+
+    @pytest.mark.asyncio
+    async def test_close(self):
+        database = MessageDatabase()
+        writer = MessageWriter(database, max_delay=60)  # type: ignore
+
+        write = asyncio.create_task(writer.write(make_message(1)))
+        await asyncio.sleep(0)
+        await writer.close()
+
+        assert write.done()
+        assert [len(batch) for batch in database.connection.batches] == [1]
@@ -0,0 +1,73 @@
+import asyncpg
+import pytest
+
+from app.utils import migrations
+from app.utils.database import Database
+from app.utils.migrations import Migration, load_migrations
+
+
+class TestMigrations:
+    def test_load_migrations(self, tmp_path):
+        for filename in ('0002_second.sql', '0001_first.sql', '0010_tenth.sql', 'notes.txt'):
+            (tmp_path / filename).write_text('SELECT 1;')
+
+        migrations = load_migrations(str(tmp_path))
+
+        assert [(migration.version, migration.name) for migration in migrations] == [
+            (1, 'first'),
+            (2, 'second'),
+            (10, 'tenth'),
+        ]
+        assert all(isinstance(migration, Migration) for migration in migrations)
+
+    def test_versions_are_unique(self):
+        versions = [migration.version for migration in load_migrations()]
+
+        assert len(versions) == len(set(versions))
+
+
+class TestBigintIds:
+    @pytest.mark.asyncio
+    async def test_text_ids_converted(self, config):
+        connection = await asyncpg.connect(config['database']['uri'])
+
+        try:
+            # a schema of its own, so the baseline's TEXT tables don't touch the test database
+            await connection.execute('CREATE SCHEMA bigint_ids; SET search_path TO bigint_ids;')
+            await Database.create_baseline(connection)
+            await migrations.create_migrations_table(connection)
+
+            # the cache change triggers would reach the running test app
+            await connection.execute('ALTER TABLE users DISABLE TRIGGER USER;')
+            await connection.execute(
+                """INSERT INTO users (id, email, name, hashed_password) VALUES ('1', '.', '.', '.');
+                   INSERT INTO rooms (id, name, owner_id) VALUES ('2', '.', '1');
+                   INSERT INTO messages (id, room_id, author_id)
+                   VALUES ('9', '2', '1'), ('10', '2', '1');
+                   INSERT INTO room_last_messages (room_id, message_id) VALUES ('2', '10');
+                """
+            )
+
+            migration = next(migration for migration in load_migrations() if migration.version == 1)
+            await migrations.apply(connection, migration)
+
+            id_type = await connection.fetchval(
+                """SELECT data_type FROM information_schema.columns
+                   WHERE table_schema = 'bigint_ids' AND table_name = 'messages'
+                   AND column_name = 'id';
+                """
+            )
+            assert id_type == 'bigint'
+
+            # TEXT ids sorted '10' before '9'
+            ids = await connection.fetch('SELECT id FROM messages ORDER BY id;')
+            assert [record['id'] for record in ids] == [9, 10]
+
+            # foreign keys were added back
+            with pytest.raises(asyncpg.ForeignKeyViolationError):
+                await connection.execute(
+                    'INSERT INTO messages (id, room_id, author_id) VALUES (11, 3, 1);'
+                )
+        finally:
+            await connection.execute('DROP SCHEMA IF EXISTS bigint_ids CASCADE;')
+            await connection.close()
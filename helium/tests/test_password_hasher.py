@@ -0,0 +1,62 @@
+import asyncio
+import threading
+
+import argon2
+import pytest
+
+from app.utils.errors import ServiceUnavailable
+from app.utils.password_hasher import PasswordHasher
+
+
+def create_hasher(**kwargs) -> PasswordHasher:
+    # cheap parameters, these tests are about scheduling rather than strength
+    return PasswordHasher(time_cost=1, memory_cost=8, parallelism=1, **kwargs)
+
+
+class TestPasswordHasher:
+    @pytest.mark.asyncio
+    async def test_hash_and_verify(self):
+        hasher = create_hasher()
+        hashed_password = await hasher.hash('password')
+
+        assert await hasher.verify(hashed_password, 'password')
+        assert not await hasher.verify(hashed_password, 'wrong')
+        assert hasher.stats()['hashes'] == 1
+        assert hasher.stats()['verifications'] == 2
+
+    @pytest.mark.asyncio
+    async def test_malformed_hash(self):
+        hasher = create_hasher()
+
+        with pytest.raises(argon2.exceptions.InvalidHash):
+            await hasher.verify('not a hash', 'password')
+
+        assert hasher.stats()['verifications'] == 0
+
+    @pytest.mark.asyncio
+    async def test_runs_off_the_loop(self):
+        hasher = create_hasher()
+        loop_thread = threading.get_ident()
+
+        assert await hasher.run(threading.get_ident) != loop_thread
+
+    @pytest.mark.asyncio
+    async def test_queue_limit(self):
+        hasher = create_hasher(threads=1, max_queue=1)
+        release = threading.Event()
+
+        running = asyncio.create_task(hasher.run(release.wait))
+        await asyncio.sleep(0)
+        queued = asyncio.create_task(hasher.run(lambda: None))
+        await asyncio.sleep(0)
+
+        assert hasher.running == 1 and hasher.queued == 1
+
+        with pytest.raises(ServiceUnavailable):
+            await hasher.run(lambda: None)
+
+        release.set()
+        await asyncio.gather(running, queued)
+
+        assert hasher.stats()['rejected'] == 1
+        assert hasher.stats()['max_queued'] == 1
@@ -126,3 +126,18 @@ class TestFriendFailure:
 
     def test_response(self, response):
         assert response.code == 400
+
+
+class TestInvalidRecipient:
+    @pytest.mark.asyncio
+    async def test_invalid_recipient(self, app, create_user, make_request):
+        user = await create_user(None, name='.', password='.', email='9@a.b')
+        token = app.tokens.create_token(user['id'])
+
+        for recipient_id in ('abc', str(2**63)):
+            body = {'recipient_id': recipient_id, 'type': RelationshipType.FRIEND}
+            response = await make_request('relationships', 'POST', body=body, token=token)
+            assert response.code == 400
+
+            response = await make_request(f'relationships/{recipient_id}', 'DELETE', token=token)
+            assert response.code == 404
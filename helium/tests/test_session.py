@@ -0,0 +1,33 @@
+from app.modules.websocket import DispatchEvent, Session
+
+
+def make_session(events: int, buffer_size: int = 3) -> Session:
+    session = Session('1', buffer_size=buffer_size)
+
+    for i in range(events):
+        session.send(DispatchEvent('EVENT', {'i': i}))
+
+    return session
+
+
+class TestSession:
+    def test_replay(self):
+        session = make_session(5)
+        missed = session.missed_events(2)
+
+        assert missed is not None
+        assert [queued.increment for queued in missed] == [3, 4]
+        assert [queued.event.data['i'] for queued in missed] == [3, 4]
+
+    def test_nothing_missed(self):
+        assert make_session(5).missed_events(4) == []
+        assert make_session(0).missed_events(-1) == []
+
+    def test_overflow(self):
+        session = make_session(5)
+
+        assert session.missed_events(1) is not None
+        assert session.missed_events(0) is None
+
+    def test_future_increment(self):
+        assert make_session(5).missed_events(5) is None
@@ -0,0 +1,43 @@
+import time
+
+from app.utils.timer_wheel import TimerWheel
+
+
+class TestTimerWheel:
+    def test_expire(self):
+        wheel = TimerWheel(lambda _: None, tick=1, slots=8)
+        now = time.monotonic()
+        wheel.schedule('a', now + 2)
+        wheel.schedule('b', now + 5)
+
+        assert wheel.advance(now + 1) == []
+        assert wheel.advance(now + 3) == ['a']
+        assert wheel.advance(now + 6) == ['b']
+        assert len(wheel) == 0
+
+    def test_refresh(self):
+        wheel = TimerWheel(lambda _: None, tick=1, slots=8)
+        now = time.monotonic()
+        wheel.schedule('a', now + 2)
+        wheel.schedule('a', now + 4)
+
+        assert wheel.advance(now + 3) == []
+        assert wheel.advance(now + 5) == ['a']
+
+    def test_longer_than_wheel(self):
+        wheel = TimerWheel(lambda _: None, tick=1, slots=8)
+        now = time.monotonic()
+        wheel.schedule('a', now + 20)
+
+        assert wheel.advance(now + 10) == []
+        assert wheel.advance(now + 19) == []
+        assert wheel.advance(now + 21) == ['a']
+
+    def test_remove(self):
+        wheel = TimerWheel(lambda _: None, tick=1, slots=8)
+        now = time.monotonic()
+        wheel.schedule('a', now + 2)
+        wheel.remove('a')
+
+        assert 'a' not in wheel
+        assert wheel.advance(now + 3) == []
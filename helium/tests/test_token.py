@@ -0,0 +1,93 @@
+import time
+
+import pytest
+
+from app.utils.token import InvalidToken, Tokens
+
+
+class TestTokens:
+    def test_validate(self):
+        tokens = Tokens(1609459200, 'secret', 10)
+        token = tokens.create_token('1234')
+
+        assert tokens.validate_token(token) == '1234'
+        assert tokens.validate_token(token) == '1234'
+        assert tokens.stats()['hits'] == 1
+
+    def test_invalid_signature(self):
+        tokens = Tokens(1609459200, 'secret', 10)
+        user_id, issued_at, _ = tokens.create_token('1234').split('.')
+
+        with pytest.raises(InvalidToken):
+            tokens.validate_token(f'{user_id}.{issued_at}.AAAAAAAAAAAAAAAAAAAAAA')
+
+        tampered = tokens.create_token('1234').replace('1234', '1235')
+
+        with pytest.raises(InvalidToken):
+            Tokens(1609459200, 'secret', 10).validate_token(tampered)
+
+    def test_other_secret(self):
+        token = Tokens(1609459200, 'other', 10).create_token('1234')
+
+        with pytest.raises(InvalidToken):
+            Tokens(1609459200, 'secret', 10).validate_token(token)
+
+    def test_ids_sort_after_legacy_ids(self):
+        # ids from before snowflakes, created a second ago with the same epoch
+        legacy_id = (int(time.time() * 1000) - 1000 - 1609459200) << 22 | 1
+
+        assert int(Tokens(1609459200, 'secret', 10).create_id()) > legacy_id
+
+    def test_legacy_token(self):
+        tokens = Tokens(1609459200, 'secret', 10)
+        token = tokens.signer.sign(b'MTIzNA==').decode()  # base64 of 1234
+
+        assert tokens.validate_token(token) == '1234'
+
+    def test_revoked(self):
+        tokens = Tokens(1609459200, 'secret', 10)
+        token = tokens.create_token('1234')
+        tokens.validate_token(token)
+
+        tokens.revoke(tokens.hash_token(token))
+
+        # the cached result isn't used for a revoked token
+        with pytest.raises(InvalidToken):
+            tokens.validate_token(token)
+
+        tokens.unrevoke(tokens.hash_token(token))
+        assert tokens.validate_token(token) == '1234'
+
+    def test_cache_size(self):
+        tokens = Tokens(1609459200, 'secret', 10, cache_size=2)
+        created = [tokens.create_token(str(id)) for id in range(1, 4)]
+
+        for token in created:
+            tokens.validate_token(token)
+
+        assert tokens.stats()['cached'] == 2
+
+    def test_cache_full(self):
+        tokens = Tokens(1609459200, 'secret', 10, cache_size=2)
+        first, second = tokens.create_token('1'), tokens.create_token('2')
+        tokens.validate_token(first)
+        tokens.validate_token(second)
+
+        # checking a remembered token again doesn't evict another one
+        tokens._verified[second] = ('2', tokens.hash_token(second), 0)
+        tokens.validate_token(second)
+
+        assert first in tokens._verified and second in tokens._verified
+
+    def test_max_age(self):
+        tokens = Tokens(1609459200, 'secret', 10, max_age=60)
+        token = tokens.create_token('1234')
+        user_id, _, _ = token.split('.')
+        expired = f'{user_id}.{int(time.time()) - 61}'
+
+        assert tokens.validate_token(token) == '1234'
+        assert tokens.revocation_ttl == 60 + tokens.cache_ttl
+        assert Tokens(1609459200, 'secret', 10).revocation_ttl is None
+
+        with pytest.raises(InvalidToken):
+            tokens.validate_token(f'{expired}.{tokens.sign(expired)}')
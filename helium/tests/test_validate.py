@@ -2,7 +2,7 @@ from typing import Literal, NotRequired, TypedDict
 
 import pytest
 
-from app.utils.validate import validate
+from app.utils.validate import is_id, validate
 
 
 class PlainDict(TypedDict):
@@ -52,3 +52,20 @@ test_data = [
 def test_validate(td, d, expected):
     assert validate(td, d) == expected
 
+
+
+@pytest.mark.parametrize(
+    'value,expected',
+    [
+        ('1234', True),
+        (str(2**63 - 1), True),
+        (str(2**63), False),
+        ('0' * 5000, False),
+        ('12a', False),
+        ('', False),
+        ('\u00b2', False),
+        (1234, False),
+    ],
+)
+def test_is_id(value, expected):
+    assert is_id(value) == expected
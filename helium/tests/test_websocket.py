@@ -0,0 +1,65 @@
+import orjson
+import pytest
+import pytest_asyncio
+from tornado.websocket import websocket_connect
+
+from app.modules.websocket import WebsocketOpcode
+
+
+async def read_message(connection) -> dict:
+    message = await connection.read_message()
+    assert message is not None, 'the connection was closed'
+    return orjson.loads(message)
+
+
+@pytest_asyncio.fixture(scope='module')
+async def connect(app, create_user):
+    user = await create_user(None, name='.', password='.', email='websocket@email.com')
+    token = app.tokens.create_token(user['id'])
+    connections = []
+
+    async def _connect(**identify):
+        url = f"ws://{app.config['server']['host']}:{app.config['server']['port']}"
+        connection = await websocket_connect(f'{url}/websocket/connect')
+        connections.append(connection)
+
+        data = {'token': token, **identify}
+        connection.write_message(orjson.dumps({'opcode': '3', 'data': data}))
+        ready = await read_message(connection)
+        assert ready['opcode'] == str(WebsocketOpcode.READY.value)
+
+        return user['id'], connection
+
+    yield _connect
+
+    for connection in connections:
+        connection.close()
+
+
+class TestDispatch:
+    @pytest.mark.asyncio
+    async def test_batch(self, app, connect):
+        user_id, connection = await connect(batch=True)
+
+        # queued in the same tick, so they are all waiting when the flush runs
+        for i in range(3):
+            app.send_event(user_id, 'EVENT', {'i': i})
+
+        message = await read_message(connection)
+
+        assert message['opcode'] == str(WebsocketOpcode.DISPATCH_BATCH.value)
+        assert [frame['data']['i'] for frame in message['data']] == [0, 1, 2]
+        assert [frame['increment'] for frame in message['data']] == [0, 1, 2]
+
+    @pytest.mark.asyncio
+    async def test_no_batch(self, app, connect):
+        user_id, connection = await connect()
+
+        for i in range(2):
+            app.send_event(user_id, 'EVENT', {'i': i})
+
+        for i in range(2):
+            message = await read_message(connection)
+
+            assert message['opcode'] == str(WebsocketOpcode.DISPATCH.value)
+            assert message['data'] == {'i': i}